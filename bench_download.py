@@ -0,0 +1,144 @@
+"""
+Benchmark for the download transfer loop in gui_downloader.download_file_async.
+
+Serves a random file from a local HTTP server in a separate process and downloads it with:
+  - before:    the previous loop (8 KB chunks, awaited aiofiles write per chunk, time.time() twice
+               and asyncio.sleep(0.001) per chunk)
+  - after:     download_file_async as a single stream
+  - segmented: download_file_async with SEGMENT_COUNT ranges
+
+and reports throughput and client CPU time per MB (the server's CPU is not counted).
+
+Usage: python bench_download.py [--size-mb 200] [--runs 3]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+
+import aiofiles
+import aiohttp
+from aiohttp import web
+
+BENCH_HOST = "127.0.0.1"
+BENCH_PORT = 8799
+SERVER_WRITE_SIZE = 1024 * 1024
+
+
+def run_server(size, ready):
+    """Serves `size` random bytes at /file with ETag and range support (like the TikTok CDN)."""
+    data = os.urandom(size)
+
+    async def handle(request):
+        start, end, status = 0, size - 1, 200
+        range_header = request.headers.get('Range')
+        if range_header and request.headers.get('If-Range') == '"bench"':
+            first, last = range_header.split('=')[1].split('-')
+            start, end, status = int(first), int(last) if last else size - 1, 206
+        headers = {'ETag': '"bench"', 'Accept-Ranges': 'bytes', 'Content-Length': str(end + 1 - start)}
+        if status == 206:
+            headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+        response = web.StreamResponse(status=status, headers=headers)
+        await response.prepare(request)
+        view = memoryview(data)[start:end + 1]
+        try:
+            for offset in range(0, len(view), SERVER_WRITE_SIZE):
+                await response.write(view[offset:offset + SERVER_WRITE_SIZE])
+            await response.write_eof()
+        except ConnectionError:
+            pass # The segmented download drops its first stream once it has the headers
+        return response
+
+    async def main():
+        app = web.Application()
+        app.router.add_get('/file', handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, BENCH_HOST, BENCH_PORT).start()
+        ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+async def legacy_download(url, save_path, session):
+    """The transfer loop download_file_async used before, kept here as the baseline."""
+    async with session.get(url) as response:
+        response.raise_for_status()
+        downloaded_size = 0
+        last_update_time = time.time()
+        async with aiofiles.open(save_path, 'wb') as f:
+            async for chunk in response.content.iter_chunked(8192):
+                if chunk:
+                    await f.write(chunk)
+                    downloaded_size += len(chunk)
+                    current_time = time.time()
+                    if current_time - last_update_time >= 0.5:
+                        last_update_time = current_time
+                await asyncio.sleep(0.001)
+    return True, None
+
+
+async def measure(name, download, size, runs, directory):
+    """Runs `download` `runs` times and prints the best throughput and the average CPU per MB."""
+    url = f"http://{BENCH_HOST}:{BENCH_PORT}/file"
+    best_rate = 0.0
+    cpu_per_mb = []
+    connector = aiohttp.TCPConnector(limit_per_host=8)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        for run in range(runs):
+            save_path = os.path.join(directory, f"{name}_{run}.bin")
+            cpu_start, wall_start = time.process_time(), time.perf_counter()
+            success, error = await download(url, save_path, session)
+            wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+            if not success or os.path.getsize(save_path) != size:
+                raise RuntimeError(f"{name}: download failed ({error})")
+            os.remove(save_path)
+            best_rate = max(best_rate, size / wall)
+            cpu_per_mb.append(cpu * 1000 / (size / 1024 / 1024))
+    average_cpu = sum(cpu_per_mb) / len(cpu_per_mb)
+    print(f"{name:<10} {best_rate / 1024 / 1024:>10.1f} MB/s {average_cpu:>10.2f} ms CPU/MB")
+    return best_rate, average_cpu
+
+
+async def run_benchmarks(size, runs):
+    from gui_downloader import download_file_async, SEGMENT_COUNT
+
+    async def after(url, save_path, session):
+        return await download_file_async(url, save_path, session=session, segments=1)
+
+    async def segmented(url, save_path, session):
+        return await download_file_async(url, save_path, session=session, segments=SEGMENT_COUNT)
+
+    print(f"File size: {size / 1024 / 1024:.0f} MB, best of {runs} run(s)")
+    print(f"{'variant':<10} {'throughput':>15} {'client CPU':>17}")
+    with tempfile.TemporaryDirectory() as directory:
+        before_rate, before_cpu = await measure("before", legacy_download, size, runs, directory)
+        after_rate, after_cpu = await measure("after", after, size, runs, directory)
+        await measure("segmented", segmented, size, runs, directory)
+    print(f"single stream: {after_rate / before_rate:.1f}x throughput, {before_cpu / after_cpu:.1f}x less CPU per MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=200, help="size of the served file")
+    parser.add_argument('--runs', type=int, default=3, help="downloads per variant")
+    args = parser.parse_args()
+    size = args.size_mb * 1024 * 1024
+
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=run_server, args=(size, ready), daemon=True)
+    server.start()
+    try:
+        if not ready.wait(30):
+            raise RuntimeError("benchmark server did not start")
+        asyncio.run(run_benchmarks(size, args.runs))
+    finally:
+        server.terminate()
+        server.join()
+
+
+if __name__ == '__main__':
+    main()
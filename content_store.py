@@ -0,0 +1,184 @@
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+try:
+    import fcntl # Reflinks (FICLONE) are Linux-only
+except ImportError:
+    fcntl = None
+
+# --- Content Store Configuration ---
+LINK_TEMP_SUFFIX = ".link" # Link/copy is created under this name, then renamed into place
+FICLONE = 0x40049409 # ioctl cloning a whole file (btrfs, XFS, ...)
+PLACEMENT_LABELS = {'reflink': '写时复制', 'hardlink': '硬链接', 'copy': '复制'}
+
+
+def _reflink(source, target):
+    """Creates `target` as a copy-on-write clone of `source`. Returns False where unsupported."""
+    if fcntl is None:
+        return False
+    try:
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except OSError:
+        try:
+            os.remove(target)
+        except OSError:
+            pass
+        return False
+
+
+def _file_identity(path):
+    """Returns (size, mtime_ns, inode) of `path`; a file edited or replaced since it was recorded differs."""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+def _clone(source, target, allow_copy=False):
+    """
+    Creates `target` with the content of `source`: as a reflink, else a hard link, else (if
+    `allow_copy`) a plain copy. Returns 'reflink', 'hardlink', 'copy' or None.
+    """
+    if _reflink(source, target):
+        return 'reflink'
+    try:
+        os.link(source, target)
+        return 'hardlink'
+    except OSError: # Other volume, FAT/exFAT, SMB shares without link support, ...
+        pass
+    if allow_copy:
+        shutil.copyfile(source, target)
+        return 'copy'
+    return None
+
+
+class ContentStore:
+    """
+    SQLite index from content (SHA-256 and size) to the files on disk that hold it.
+
+    place() moves a finished, verified download into place; if the same bytes are already
+    stored elsewhere, the target becomes a reflink (copy-on-write clone) or hard link of that
+    file instead and the downloaded copy is dropped. materialize() creates a file from stored
+    content without any download. Both create the target under a temporary name and rename it
+    into place, so a target never exists half-written.
+
+    Hard links share one inode, so editing one of the linked files in place changes the others
+    (media files are not normally edited). Each file is recorded with its size, modification time
+    and inode; a file that was deleted, edited or replaced since then is dropped from the index when
+    it is looked up, and the new download is kept instead. Safe to use from worker threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS content ("
+                " sha256 TEXT NOT NULL, path TEXT NOT NULL, size INTEGER NOT NULL, added_at REAL NOT NULL,"
+                " mtime_ns INTEGER NOT NULL, inode INTEGER NOT NULL, PRIMARY KEY (sha256, path))")
+            self._conn.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Could not open content store {path}, deduplication disabled: {e}")
+            self._conn = None
+
+    def find(self, sha256, size):
+        """Returns the path of an existing file with this content, or None."""
+        if self._conn is None or not sha256:
+            return None
+        try:
+            with self._lock:
+                rows = self._conn.execute("SELECT path, mtime_ns, inode FROM content WHERE sha256 = ? AND size = ?",
+                                          (sha256, size)).fetchall()
+            for path, mtime_ns, inode in rows:
+                try:
+                    if _file_identity(path) == (size, mtime_ns, inode):
+                        return path
+                except OSError:
+                    pass
+                self._remove(sha256, path) # Gone, edited or replaced since it was recorded: its content is unknown
+        except sqlite3.Error as e:
+            logging.error(f"Content store lookup failed for {sha256}: {e}")
+        return None
+
+    def add(self, sha256, path, size):
+        """Records `path` as holding the content `sha256`."""
+        if self._conn is None or not sha256:
+            return
+        try:
+            actual_size, mtime_ns, inode = _file_identity(path)
+            if actual_size != size:
+                return
+            with self._lock:
+                self._conn.execute("INSERT OR REPLACE INTO content (sha256, path, size, added_at, mtime_ns, inode)"
+                                   " VALUES (?, ?, ?, ?, ?, ?)",
+                                   (sha256, os.path.abspath(path), size, time.time(), mtime_ns, inode))
+                self._conn.commit()
+        except (OSError, sqlite3.Error) as e:
+            logging.error(f"Could not record {path} in content store: {e}")
+
+    def _remove(self, sha256, path):
+        with self._lock:
+            self._conn.execute("DELETE FROM content WHERE sha256 = ? AND path = ?", (sha256, path))
+            self._conn.commit()
+
+    def _link_into_place(self, sha256, size, target, allow_copy):
+        existing = self.find(sha256, size)
+        if existing is None or os.path.abspath(existing) == os.path.abspath(target):
+            return None
+        temp_path = target + LINK_TEMP_SUFFIX
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        method = _clone(existing, temp_path, allow_copy)
+        if method is None:
+            return None
+        os.replace(temp_path, target)
+        self.add(sha256, target, size)
+        if method != 'copy':
+            self.bytes_saved += size
+        return method
+
+    def place(self, source, target, sha256, size):
+        """
+        Renames the finished file `source` to `target`, or links `target` to an existing file with
+        the same content and removes `source`. Returns 'reflink', 'hardlink' or 'new'.
+        """
+        try:
+            method = self._link_into_place(sha256, size, target, allow_copy=False)
+        except OSError as e:
+            logging.warning(f"Could not link {target} to existing content, keeping the download: {e}")
+            method = None
+        if method is None:
+            os.replace(source, target)
+            self.add(sha256, target, size)
+            return 'new'
+        os.remove(source)
+        return method
+
+    def materialize(self, sha256, size, target):
+        """
+        Creates `target` from an existing file with this content (reflink, hard link or copy) without
+        downloading anything. Returns the method used, or None if the content is not on disk.
+        """
+        try:
+            return self._link_into_place(sha256, size, target, allow_copy=True)
+        except OSError as e:
+            logging.warning(f"Could not create {target} from existing content: {e}")
+            return None
+
+    def summary(self):
+        """Returns a one-line summary for this run."""
+        return f"content store: {self.bytes_saved / 1024 / 1024:.1f} MB not stored twice"
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,257 @@
+import array
+import bisect
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+
+# --- History Configuration ---
+HISTORY_COMPACT_THRESHOLD = 50000 # Write-ahead log entries merged into the sorted ID table at once
+
+INDEX_FILE = "ids.bin" # Header, sorted aweme IDs (u64), then the matching data offsets (u64)
+DATA_FILE = "data.bin" # Append-only entry records
+WAL_FILE = "wal.bin" # (aweme ID, data offset) pairs added since the last compaction
+INDEX_MAGIC = b"TBHIDX01"
+INDEX_HEADER = struct.Struct("<8sQ") # magic, entry count
+WAL_RECORD = struct.Struct("<QQ") # aweme ID, data offset
+DATA_RECORD = struct.Struct("<Qd32s?H") # size, completed_at, sha256 (zeros if unknown), verified, path length; path (UTF-8) follows
+MAX_AWEME_ID = 2 ** 64 - 1
+
+
+def _native_u64(buffer):
+    """Returns the little-endian u64 values in `buffer` as a memoryview of ints (a swapped copy on big-endian hosts)."""
+    if sys.byteorder == 'little':
+        return memoryview(buffer).cast('Q')
+    values = array.array('Q')
+    values.frombytes(buffer)
+    values.byteswap()
+    return memoryview(values)
+
+
+def _little_endian_bytes(values):
+    """Returns a run of the u64 values from _native_u64 as little-endian bytes, as stored on disk."""
+    if sys.byteorder == 'little':
+        return values.tobytes()
+    swapped = array.array('Q', values)
+    swapped.byteswap()
+    return swapped.tobytes()
+
+
+def _parse_aweme_id(aweme_id):
+    """Returns the aweme ID as an int, or None if it is not a numeric ID that fits the table."""
+    try:
+        value = int(str(aweme_id).strip())
+    except (TypeError, ValueError):
+        return None
+    return value if 0 < value <= MAX_AWEME_ID else None
+
+
+class DownloadHistory:
+    """
+    Persistent index of finished downloads keyed by aweme ID, holding path, size, SHA-256 and
+    whether the content passed the integrity check while downloading.
+
+    Lookups never touch the entries themselves: the sorted ID table is memory-mapped and
+    binary searched in place, so memory use stays flat however large the archive grows
+    (16 bytes per entry on disk, nothing per entry in RAM). New entries are appended to the
+    data file and to a small write-ahead log, which is kept in memory and merged into the
+    sorted table once it reaches `compact_threshold` entries, so a run that adds a few
+    entries never rewrites a large table. A later entry for the same ID replaces the earlier one.
+
+    Writes are flushed to the OS after every entry; a torn last WAL record (e.g. after a crash)
+    is dropped on open. Like MetadataCache, an unreadable history disables itself rather than
+    failing the batch. Not thread-safe: lookups and writes share one file handle and compaction
+    remaps the table, so use an instance from one thread only (the event loop, with hashing and
+    file linking done in worker threads).
+    """
+
+    def __init__(self, directory, compact_threshold=HISTORY_COMPACT_THRESHOLD):
+        self.directory = directory
+        self.compact_threshold = compact_threshold
+        self.skipped = 0 # Inputs not resolved again because they are recorded here (counted by resolve_urls)
+        self._index_file = None
+        self._map = None
+        self._ids = None # memoryview of the sorted IDs (u64)
+        self._offsets = None # memoryview of the data offsets, same order
+        self._count = 0
+        self._wal = {} # aweme ID -> data offset, not yet in the sorted table
+        self._wal_file = None
+        self._data_file = None
+        self._enabled = False
+        try:
+            os.makedirs(directory, exist_ok=True)
+            self._open_index()
+            self._load_wal()
+            self._data_file = open(os.path.join(directory, DATA_FILE), 'a+b')
+            self._enabled = True
+        except (OSError, ValueError, struct.error) as e:
+            logging.error(f"Could not open download history in {directory}, history disabled: {e}")
+            self.close()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _open_index(self):
+        path = self._path(INDEX_FILE)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return
+        self._index_file = open(path, 'rb')
+        self._map = mmap.mmap(self._index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = INDEX_HEADER.unpack_from(self._map, 0)
+        if magic != INDEX_MAGIC or len(self._map) != INDEX_HEADER.size + 16 * count:
+            raise ValueError(f"{INDEX_FILE} is corrupt")
+        table = memoryview(self._map)[INDEX_HEADER.size:]
+        self._ids = _native_u64(table[:8 * count])
+        self._offsets = _native_u64(table[8 * count:])
+        self._count = count
+
+    def _close_index(self):
+        for view in (self._ids, self._offsets):
+            if view is not None:
+                view.release()
+        self._ids = self._offsets = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+        self._count = 0
+
+    def _load_wal(self):
+        path = self._path(WAL_FILE)
+        self._wal_file = open(path, 'a+b')
+        self._wal_file.seek(0)
+        data = self._wal_file.read()
+        usable = len(data) - len(data) % WAL_RECORD.size
+        if usable != len(data): # Torn record from an interrupted write
+            self._wal_file.truncate(usable)
+            logging.warning(f"Dropped a partial record from the download history log {path}.")
+        for aweme_id, offset in WAL_RECORD.iter_unpack(data[:usable]):
+            self._wal[aweme_id] = offset
+
+    def _find_offset(self, key):
+        offset = self._wal.get(key)
+        if offset is not None:
+            return offset
+        if self._count:
+            position = bisect.bisect_left(self._ids, key)
+            if position < self._count and self._ids[position] == key:
+                return self._offsets[position]
+        return None
+
+    def _read_entry(self, offset):
+        self._data_file.seek(offset)
+        size, completed_at, sha256, verified, path_length = DATA_RECORD.unpack(self._data_file.read(DATA_RECORD.size))
+        path = self._data_file.read(path_length).decode('utf-8')
+        return {'path': path, 'size': size, 'completed_at': completed_at,
+                'sha256': sha256.hex() if any(sha256) else None, 'verified': verified}
+
+    def __contains__(self, aweme_id):
+        key = _parse_aweme_id(aweme_id)
+        return self._enabled and key is not None and self._find_offset(key) is not None
+
+    def __len__(self):
+        if not self._enabled:
+            return 0
+        new_ids = sum(1 for key in self._wal if not self._in_table(key))
+        return self._count + new_ids
+
+    def _in_table(self, key):
+        if not self._count:
+            return False
+        position = bisect.bisect_left(self._ids, key)
+        return position < self._count and self._ids[position] == key
+
+    def get(self, aweme_id):
+        """Returns {'aweme_id', 'path', 'size', 'sha256', 'verified', 'completed_at'} for a finished download, or None."""
+        key = _parse_aweme_id(aweme_id)
+        if not self._enabled or key is None:
+            return None
+        offset = self._find_offset(key)
+        if offset is None:
+            return None
+        try:
+            entry = self._read_entry(offset)
+        except (OSError, ValueError, struct.error) as e:
+            logging.error(f"Could not read download history entry for {aweme_id}: {e}")
+            return None
+        entry['aweme_id'] = str(key)
+        return entry
+
+    def add(self, aweme_id, path, size, sha256=None, verified=False):
+        """Records a finished download. `sha256` is a hex digest or None; `verified` that its structure was checked."""
+        key = _parse_aweme_id(aweme_id)
+        if not self._enabled or key is None:
+            return
+        encoded_path = os.path.abspath(path).encode('utf-8')[:0xFFFF]
+        digest = bytes.fromhex(sha256) if sha256 else bytes(32)
+        try:
+            self._data_file.seek(0, os.SEEK_END)
+            offset = self._data_file.tell()
+            self._data_file.write(DATA_RECORD.pack(size, time.time(), digest, verified, len(encoded_path)) + encoded_path)
+            self._data_file.flush() # The entry must be readable before the log points at it
+            self._wal_file.write(WAL_RECORD.pack(key, offset))
+            self._wal_file.flush()
+        except OSError as e:
+            logging.error(f"Could not record download of {aweme_id} in history: {e}")
+            return
+        self._wal[key] = offset
+        if len(self._wal) >= self.compact_threshold:
+            self.compact()
+
+    def compact(self):
+        """Merges the write-ahead log into the sorted ID table and empties the log."""
+        if not self._enabled or not self._wal:
+            return
+        temp_path = self._path(INDEX_FILE + ".tmp")
+        try:
+            # Where each new ID goes in the existing table (replaced IDs keep their slot)
+            inserts = [] # (position, key, offset, replaces_existing)
+            for key in sorted(self._wal):
+                position = bisect.bisect_left(self._ids, key) if self._count else 0
+                replaces = position < self._count and self._ids[position] == key
+                inserts.append((position, key, self._wal[key], replaces))
+            new_count = self._count + sum(1 for insert in inserts if not insert[3])
+            with open(temp_path, 'wb') as out:
+                out.write(INDEX_HEADER.pack(INDEX_MAGIC, new_count))
+                for column in (0, 1): # IDs, then offsets, copying unchanged runs in bulk
+                    source = self._ids if column == 0 else self._offsets
+                    previous = 0
+                    for position, key, offset, replaces in inserts:
+                        if position > previous:
+                            out.write(_little_endian_bytes(source[previous:position]))
+                        out.write(struct.pack('<Q', key if column == 0 else offset))
+                        previous = position + 1 if replaces else position
+                    if self._count > previous:
+                        out.write(_little_endian_bytes(source[previous:self._count]))
+                out.flush()
+                os.fsync(out.fileno())
+            self._close_index() # The mapped file cannot be replaced while it is open on Windows
+            os.replace(temp_path, self._path(INDEX_FILE))
+            self._open_index()
+            self._wal_file.truncate(0)
+            self._wal_file.flush()
+            self._wal.clear()
+            logging.info(f"Download history compacted: {self._count} entries.")
+        except (OSError, ValueError, struct.error) as e:
+            logging.error(f"Could not compact download history in {self.directory}: {e}")
+            if self._map is None: # Reopen whatever table is on disk; the log still has every new entry
+                try:
+                    self._open_index()
+                except (OSError, ValueError, struct.error):
+                    self._close_index()
+
+    def summary(self):
+        """Returns a one-line summary for this run."""
+        return f"download history: {len(self)} entries, already downloaded skipped: {self.skipped}"
+
+    def close(self):
+        self._enabled = False
+        self._close_index()
+        for f in (self._wal_file, self._data_file):
+            if f is not None:
+                f.close()
+        self._wal_file = self._data_file = None
@@ -4,8 +4,14 @@ import requests
 import logging
 import re
 import asyncio # Import asyncio
-# Import the correct fetcher function
-from tiktok_fetcher import fetch_tiktok_video_info_rapidapi # Corrected function name
+import json
+# Import the shared fetcher function and API client pool
+from tiktok_fetcher import (resolve_urls, fetch_tiktok_info, apply_quality_policy, HttpClientPool, HedgePolicy,
+                            EndpointScoreboard, CircuitBreakerRegistry, RateLimiterRegistry, RetryPolicy, QualityPolicy)
+from metadata_cache import MetadataCache, signed_url_expired
+from download_history import DownloadHistory
+from integrity import StreamVerifier
+from content_store import ContentStore, PLACEMENT_LABELS
 # Define COMMON_HEADERS directly in this file instead of importing
 COMMON_HEADERS = {
     'user-agent': 'Mozilla/5.0 (Linux; Android 8.0; Pixel 2 Build/OPD3.170816.012) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.88 Mobile Safari/537.36 Edg/87.0.664.66'
@@ -13,10 +19,30 @@ COMMON_HEADERS = {
 
 # --- Configuration ---
 URL_FILE = "urls.txt"
+CONFIG_FILE = "config.json" # Same format as the GUI config (api_endpoints, active_api_name)
+ENDPOINT_STATS_FILE = "endpoint_stats.json" # Persisted API latency/success statistics used to rank endpoints
+METADATA_CACHE_FILE = "metadata_cache.sqlite3" # Resolved API results reused across runs (TTL + LRU)
+DOWNLOAD_HISTORY_DIR = "download_history" # Finished downloads by aweme ID; those posts are skipped before any API call
+CONTENT_STORE_FILE = "content_store.sqlite3" # Downloaded files by SHA-256; identical files are linked, not stored twice
+PART_SUFFIX = ".part" # Downloads are written under this name and renamed into place when complete
+NEGATIVE_CACHE_TTL_HOURS = 168 # Skip posts every API reported as deleted/private/unavailable for this long (0 = off)
+FORCE_RECHECK = False # Ignore cached results and known unavailable posts for this run
+VIDEO_QUALITY = "hd" # 'hd', 'sd' (fewer bytes), 'smallest' or 'hd_under' (HD only if at most MAX_HD_MB)
+MAX_HD_MB = 50 # Size limit for VIDEO_QUALITY = 'hd_under'
 DOWNLOAD_FOLDER = "downloads"
-REQUEST_DELAY_SECONDS = 3 # Delay between requests for info (seconds)
 DOWNLOAD_DELAY_SECONDS = 1 # Small delay between downloads (seconds)
 MAX_FILENAME_LENGTH = 100 # Limit filename length
+HEDGE_REQUESTS = False # Also ask the next API when the current one is slow (first valid result wins)
+HEDGE_PERCENTILE = 0.9 # Hedge after this latency percentile of recent successful API calls
+HEDGE_BUDGET = 100 # Maximum extra API calls hedging may spend per batch
+RETRY_MAX_ATTEMPTS = 3 # Attempts per API endpoint for timeouts, network/server errors and 429s
+URL_DEADLINE_SECONDS = 90 # Total time budget per URL across all endpoints and retries
+RESOLVE_CONCURRENCY = 4 # URLs whose metadata is fetched ahead of / alongside the current download
+ALBUM_IMAGE_CONCURRENCY = 4 # Images of an album downloaded at the same time
+IMAGE_ATTEMPTS = 3 # Attempts per album image before it counts as failed
+IMAGE_RETRY_DELAY = 1 # Seconds, multiplied by the attempt number
+BREAKER_FAILURE_THRESHOLD = 5 # Consecutive 401/403/5xx/timeout failures before an API is skipped
+BREAKER_COOLDOWN_SECONDS = 60 # How long a tripped API is skipped before a single probe request
 
 # Configure logging (same level as fetcher)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s') # Reverted level to INFO
@@ -34,8 +60,32 @@ def sanitize_filename(name):
     # Limit length
     return name[:MAX_FILENAME_LENGTH]
 
-def download_file(url, save_path, referer=None, stream=True):
-    """Downloads a file from a URL to a specified path."""
+def remove_incomplete_file(save_path):
+    if os.path.exists(save_path):
+        try:
+            os.remove(save_path)
+            logging.info(f"  Removed incomplete file: {save_path}")
+        except OSError as oe:
+            logging.error(f"  Error removing incomplete file {save_path}: {oe}")
+
+def place_file(part_path, save_path, report, content_store=None):
+    """Moves a verified file into place, as a link to identical existing content if `content_store` has it."""
+    if content_store is not None:
+        report['placement'] = content_store.place(part_path, save_path, report['sha256'], report['size'])
+    else:
+        os.replace(part_path, save_path)
+        report['placement'] = 'new'
+    if report['placement'] in PLACEMENT_LABELS:
+        logging.info(f"  Same content already on disk, {os.path.basename(save_path)} is a {report['placement']} of it")
+
+def download_file(url, save_path, referer=None, stream=True, verify=None, integrity=None, content_store=None):
+    """
+    Downloads a file from a URL to a specified path. Data is written to '<save_path>.part' and renamed
+    into place when complete (see place_file). The SHA-256 is computed and, with `verify` 'video' or
+    'image', the MP4/JPEG/WebP structure checked while writing; a file that fails the check or does not
+    have the announced size is removed. The verdict is stored into the `integrity` dict if one is passed.
+    """
+    part_path = save_path + PART_SUFFIX
     try:
         logging.info(f"  Downloading: {url[:80]}...")
         headers = COMMON_HEADERS.copy() # Start with common headers
@@ -50,31 +100,114 @@ def download_file(url, save_path, referer=None, stream=True):
             else:
                 logging.info("  File size: Unknown")
 
-            with open(save_path, 'wb') as f:
-                downloaded_size = 0
+            verifier = StreamVerifier(verify)
+            with open(part_path, 'wb') as f:
                 for chunk in r.iter_content(chunk_size=8192):
                     f.write(chunk)
-                    downloaded_size += len(chunk)
+                    verifier.update(chunk)
                     # Optional: Add progress indicator here if needed
-            logging.info(f"  Download complete: {os.path.basename(save_path)}")
+            # A compressed body is longer once decoded than its Content-Length
+            encoded = r.headers.get('content-encoding', 'identity').lower() != 'identity'
+            report = verifier.finish(0 if encoded else total_size)
+            if not report['ok']:
+                if integrity is not None:
+                    integrity.update(report)
+                logging.error(f"  Integrity check failed for {os.path.basename(save_path)}: {report['detail']}")
+                remove_incomplete_file(part_path)
+                return False
+            place_file(part_path, save_path, report, content_store)
+            if integrity is not None:
+                integrity.update(report)
+            logging.info(f"  Download complete: {os.path.basename(save_path)} (sha256 {report['sha256']})")
         return True
     except requests.exceptions.Timeout:
         logging.error(f"  Download timeout for: {url}")
         return False
     except requests.exceptions.RequestException as e:
         logging.error(f"  Download error for {url}: {e}")
-        # Clean up incomplete file
-        if os.path.exists(save_path):
-            try:
-                os.remove(save_path)
-                logging.info(f"  Removed incomplete file: {save_path}")
-            except OSError as oe:
-                logging.error(f"  Error removing incomplete file {save_path}: {oe}")
+        remove_incomplete_file(part_path) # Clean up incomplete file
         return False
     except Exception as e:
         logging.exception(f"  Unexpected download error for {url}: {e}")
+        remove_incomplete_file(part_path)
         return False
 
+async def download_album_image(img_url, save_path, referer, semaphore, content_store=None):
+    """Downloads one album image under `semaphore`, retrying up to IMAGE_ATTEMPTS times. Returns True on success."""
+    async with semaphore:
+        for attempt in range(1, IMAGE_ATTEMPTS + 1):
+            if await asyncio.to_thread(download_file, img_url, save_path, referer=referer, stream=False, # Images are usually small
+                                       verify='image', content_store=content_store):
+                return True
+            if attempt < IMAGE_ATTEMPTS:
+                logging.warning(f"  Retrying image {os.path.basename(save_path)} ({attempt}/{IMAGE_ATTEMPTS} failed)")
+                await asyncio.sleep(IMAGE_RETRY_DELAY * attempt)
+    return False
+
+async def place_from_history(download_history, content_store, post_id, save_path):
+    """
+    Creates `save_path` from the verified file of an earlier download of the same video (by aweme ID in
+    the history, then by content in the content store). Returns True if nothing needs to be downloaded.
+    The history is only used here on the event loop; just the link/copy runs in a thread.
+    """
+    if download_history is None or content_store is None or not post_id:
+        return False
+    record = download_history.get(post_id)
+    if not record or not record['verified'] or not record['sha256']:
+        return False
+    placement = await asyncio.to_thread(content_store.materialize, record['sha256'], record['size'], save_path)
+    if placement:
+        download_history.add(post_id, save_path, record['size'], record['sha256'], verified=True)
+    return placement is not None
+
+async def record_download(download_history, post_id, path, integrity=None, content_store=None):
+    """
+    Adds a post to the download history: a video with the size, SHA-256 and verdict from its download
+    (`integrity`), an album folder with its total size. A video found on disk is hashed and checked here
+    (in a thread; the history itself is only used on the event loop).
+    """
+    if download_history is None or not post_id:
+        return
+    if integrity:
+        download_history.add(post_id, path, integrity['size'], integrity['sha256'], verified=integrity['ok'])
+        return
+
+    def measure():
+        if os.path.isdir(path):
+            return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file()), None, False
+        verifier = StreamVerifier('video')
+        verifier.catch_up(path)
+        report = verifier.finish()
+        if not report['ok']:
+            logging.warning(f"Existing file {path} failed verification: {report['detail']}")
+        return report['size'], report['sha256'], report['ok']
+
+    try:
+        size, sha256, verified = await asyncio.to_thread(measure)
+    except OSError as e:
+        logging.warning(f"Could not record {path} in download history: {e}")
+        return
+    download_history.add(post_id, path, size, sha256, verified=verified)
+    if sha256 and verified and content_store is not None: # Later copies of these bytes can link to it
+        content_store.add(sha256, path, size)
+
+def load_api_endpoints(config_path=CONFIG_FILE):
+    """Loads API endpoint configs from the GUI-style config file, active API first."""
+    if not os.path.exists(config_path):
+        logging.error(f"Config file not found: {config_path}")
+        return []
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except (IOError, json.JSONDecodeError) as e:
+        logging.error(f"Failed to read config file {config_path}: {e}")
+        return []
+
+    endpoints = [ep for ep in config.get("api_endpoints", []) if isinstance(ep, dict) and ep.get('url')]
+    active_name = config.get("active_api_name")
+    active = [ep for ep in endpoints if ep.get('name') == active_name]
+    return active + [ep for ep in endpoints if ep.get('name') != active_name]
+
 # --- Main Logic ---
 
 async def main(): # Make main async
@@ -105,23 +238,97 @@ async def main(): # Make main async
 
     logging.info(f"Found {len(urls_to_process)} URLs to process.")
 
-    # Process each URL
-    for i, original_url in enumerate(urls_to_process):
-        print("-" * 40)
-        logging.info(f"Processing URL {i+1}/{len(urls_to_process)}: {original_url}")
+    api_endpoints = load_api_endpoints()
+    if not api_endpoints:
+        print(f"Error: No API endpoints configured. Add 'api_endpoints' to '{CONFIG_FILE}' (same format as the GUI config).")
+        return
+
+    hedge_policy = HedgePolicy(percentile=HEDGE_PERCENTILE, budget=HEDGE_BUDGET) if HEDGE_REQUESTS else None
+    scoreboard = EndpointScoreboard(ENDPOINT_STATS_FILE)
+    circuit_breakers = CircuitBreakerRegistry(BREAKER_FAILURE_THRESHOLD, BREAKER_COOLDOWN_SECONDS,
+                                              on_event=log_breaker_event)
+    # API calls are paced per endpoint from 'rate_per_second'/'burst' in config.json and 429 responses
+    rate_limiters = RateLimiterRegistry()
+    metadata_cache = MetadataCache(METADATA_CACHE_FILE, negative_ttl=NEGATIVE_CACHE_TTL_HOURS * 3600)
+    retry_policy = RetryPolicy(max_attempts=RETRY_MAX_ATTEMPTS, url_deadline=URL_DEADLINE_SECONDS)
+    quality_policy = QualityPolicy(mode=VIDEO_QUALITY, max_hd_mb=MAX_HD_MB)
+    download_history = DownloadHistory(DOWNLOAD_HISTORY_DIR)
+    content_store = ContentStore(CONTENT_STORE_FILE)
+
+    # One pooled API client registry for the whole batch
+    try:
+        async with HttpClientPool() as client_pool:
+            await process_urls(urls_to_process, api_endpoints, client_pool, hedge_policy, scoreboard, circuit_breakers,
+                               rate_limiters, metadata_cache, retry_policy, download_history, content_store, quality_policy)
+    finally:
+        scoreboard.save()
+        logging.info(metadata_cache.summary())
+        metadata_cache.close()
+        logging.info(download_history.summary())
+        download_history.close()
+        logging.info(content_store.summary())
+        content_store.close()
+
+    if hedge_policy:
+        logging.info(f"Hedged requests sent: {hedge_policy.hedges_sent}, won: {hedge_policy.hedges_won}")
 
-        # 1. Fetch video/album info using the correct fetcher (now async)
-        info = await fetch_tiktok_video_info_rapidapi(original_url) # Use await with corrected function name
+    print("--- Batch download process finished ---")
+
+def log_breaker_event(event):
+    """Logs circuit breaker trips and recoveries."""
+    logging.warning(f"API '{event['api_name']}' circuit breaker {event['event']} "
+                    f"(cool-down {event['cooldown']}s, reason: {event.get('reason')})")
+
+async def process_urls(urls_to_process, api_endpoints, client_pool, hedge_policy=None, scoreboard=None,
+                       circuit_breakers=None, rate_limiters=None, metadata_cache=None, retry_policy=None,
+                       download_history=None, content_store=None, quality_policy=None):
+    """
+    Resolves the batch RESOLVE_CONCURRENCY URLs at a time (in input order) while downloading
+    each unique URL in turn, so metadata for the next URLs is fetched during downloads.
+    """
+    total = len(urls_to_process)
+    # 1. Fetch video/album info using the shared bulk resolver and client pool
+    resolved = resolve_urls(urls_to_process, api_endpoints, concurrency=RESOLVE_CONCURRENCY, ordered=True,
+                            client_pool=client_pool, hedge_policy=hedge_policy, scoreboard=scoreboard,
+                            circuit_breakers=circuit_breakers, rate_limiters=rate_limiters,
+                            metadata_cache=metadata_cache, force_refresh=FORCE_RECHECK, retry_policy=retry_policy,
+                            download_history=download_history, quality_policy=quality_policy)
+    async for entry in resolved:
+        i = entry['index']
+        print("-" * 40)
+        if entry['status'] == 'rejected':
+            logging.warning(f"Skipping URL {i+1}/{total} ({entry['reason']}): {entry['input']}")
+            continue
+        if entry['status'] == 'duplicate':
+            logging.info(f"Skipping URL {i+1}/{total}, same post as URL {entry['duplicate_of'] + 1}: {entry['input']}")
+            continue
+        if entry['status'] == 'downloaded':
+            logging.info(f"Skipping URL {i+1}/{total}, already downloaded to {entry['history']['path']}: {entry['input']}")
+            continue
+        original_url = entry['url']
+        logging.info(f"Processing URL {i+1}/{total}: {original_url}")
+        info = entry['result']
 
         if not info or info.get('status') != 'success':
             logging.error(f"Failed to fetch info for {original_url}. Reason: {info.get('reason', 'Unknown')}")
-            logging.info(f"Waiting {REQUEST_DELAY_SECONDS} seconds before next URL...")
-            await asyncio.sleep(REQUEST_DELAY_SECONDS) # Use asyncio.sleep
             continue # Skip to the next URL
 
         # 2. Handle based on type (Video or Album)
         url_type = info.get('url_type')
 
+        media_urls = [info.get('nwm_video_url')] if url_type == 'video' else info.get('album_list') or []
+        if any(signed_url_expired(url) for url in media_urls if url):
+            # Waited too long (e.g. behind large downloads): resolve again instead of failing with 403
+            logging.info(f"Media URLs for {original_url} have expired, resolving it again.")
+            refreshed = await fetch_tiktok_info(original_url, api_endpoints, client_pool=client_pool, hedge_policy=hedge_policy,
+                                                scoreboard=scoreboard, circuit_breakers=circuit_breakers,
+                                                rate_limiters=rate_limiters, metadata_cache=metadata_cache,
+                                                force_refresh=True, retry_policy=retry_policy)
+            if refreshed.get('status') == 'success' and refreshed.get('url_type') == url_type:
+                info = await apply_quality_policy(refreshed, quality_policy, client_pool) if url_type == 'video' else refreshed
+            else:
+                logging.warning(f"Could not refresh the media URLs of {original_url}: {refreshed.get('reason')}")
+
         if url_type == 'video':
             video_bytes = info.get('video_bytes')
             video_url = info.get('nwm_video_url') # Fallback URL
@@ -137,14 +344,25 @@ async def main(): # Make main async
             filename = f"{author}_{video_id}.mp4"
             save_path = os.path.join(DOWNLOAD_FOLDER, filename)
 
+            download_success = False
+            integrity = {} # Hash and verdict of the video
             if os.path.exists(save_path):
                 logging.info(f"Video already exists, skipping: {filename}")
+                download_success = True # Recorded in the history below
+            elif await place_from_history(download_history, content_store, info.get('video_aweme_id'), save_path):
+                logging.info(f"Content already on disk, created without downloading: {filename}")
             elif video_bytes:
                 # Save directly from bytes
                 logging.info(f"Attempting to save video from fetched bytes: {filename}")
+                verifier = StreamVerifier('video')
+                verifier.update(video_bytes)
+                integrity = verifier.finish()
                 try:
-                    with open(save_path, 'wb') as f:
+                    if not integrity['ok']:
+                        raise ValueError(f"integrity check failed: {integrity['detail']}")
+                    with open(save_path + PART_SUFFIX, 'wb') as f:
                         f.write(video_bytes)
+                    place_file(save_path + PART_SUFFIX, save_path, integrity, content_store)
                     logging.info(f"Successfully saved video from bytes: {filename}")
                     download_success = True
                 except Exception as e_write:
@@ -155,13 +373,23 @@ async def main(): # Make main async
                 logging.warning(f"Attempting to download video from URL (fallback): {filename}")
                 # Use the original TikTok page as referer, might help
                 referer = f"https://www.tiktok.com/@{info.get('video_author_id', '')}/video/{video_id}"
-                download_success = download_file(video_url, save_path, referer=referer)
+                # Every URL the API returned (best quality first); the next one is tried if a URL fails
+                candidates = [candidate['url'] for candidate in info.get('video_url_candidates') or []] or [video_url]
+                for candidate_number, candidate_url in enumerate(candidates, 1):
+                    if candidate_number > 1:
+                        logging.warning(f"Trying video URL candidate {candidate_number}/{len(candidates)} for {filename}")
+                    download_success = await asyncio.to_thread(download_file, candidate_url, save_path, referer=referer, # Keeps prefetching running
+                                                               verify='video', integrity=integrity, content_store=content_store)
+                    if download_success:
+                        break
                 if download_success:
                     logging.info(f"Successfully downloaded video from URL: {filename}")
                 else:
                     logging.error(f"Failed to download video: {filename}")
                 # Small delay after each download attempt
                 await asyncio.sleep(DOWNLOAD_DELAY_SECONDS) # Use asyncio.sleep
+            if download_success:
+                await record_download(download_history, info.get('video_aweme_id'), save_path, integrity, content_store)
 
         elif url_type == 'album':
             image_urls = info.get('album_list')
@@ -184,6 +412,8 @@ async def main(): # Make main async
             # Use the author_id key from the new fetcher's return value
             referer = f"https://www.tiktok.com/@{info.get('album_author_id', '')}/photo/{album_id}"
 
+            image_semaphore = asyncio.Semaphore(ALBUM_IMAGE_CONCURRENCY)
+            image_jobs = []
             for idx, img_url in enumerate(image_urls):
                 # Generate filename like 01.jpg, 02.jpg etc.
                 # Try to guess extension, default to jpg
@@ -195,23 +425,24 @@ async def main(): # Make main async
                 if os.path.exists(img_save_path):
                     logging.info(f"  Image already exists, skipping: {img_filename}")
                 else:
-                    download_success = download_file(img_url, img_save_path, referer=referer, stream=False) # Images are usually small
-                    if not download_success:
-                        logging.error(f"  Failed to download image {idx+1}: {img_filename}")
-                    # Small delay after each download attempt
-                    await asyncio.sleep(DOWNLOAD_DELAY_SECONDS / 2) # Use asyncio.sleep
+                    image_jobs.append((img_filename, download_album_image(img_url, img_save_path, referer, image_semaphore,
+                                                                          content_store)))
+
+            # Images download in parallel; names keep the album order whatever order they finish in
+            results = await asyncio.gather(*(job for _, job in image_jobs))
+            failed = [img_filename for (img_filename, _), ok in zip(image_jobs, results) if not ok]
+            for img_filename in failed:
+                logging.error(f"  Failed to download image after {IMAGE_ATTEMPTS} attempts: {img_filename}")
+            if failed:
+                logging.error(f"{len(failed)}/{len(image_urls)} images failed for album: {album_folder_name}")
+            else:
+                await record_download(download_history, info.get('album_aweme_id'), album_save_dir)
 
             logging.info(f"Finished processing album: {album_folder_name}")
 
         else:
             logging.warning(f"Unknown URL type '{url_type}' returned for {original_url}")
 
-        # Wait before processing the next URL in the list
-        logging.info(f"Waiting {REQUEST_DELAY_SECONDS} seconds before next URL...")
-        await asyncio.sleep(REQUEST_DELAY_SECONDS) # Use asyncio.sleep
-
-    print("--- Batch download process finished ---")
-
 if __name__ == "__main__":
     # Ensure required libraries are installed: pip install -r requirements.txt
     asyncio.run(main()) # Run the async main function
@@ -8,6 +8,7 @@ import json # Import json for config
 # import requests # Keep commented out for now, import locally if needed (e.g., proxy test)
 import functools # Import functools for partial
 from datetime import datetime # Import datetime for template variables
+from collections import deque # Sliding-window samples for stall detection
 import aiohttp # Import aiohttp for async requests
 import aiofiles # Import aiofiles for async file writing
 import aiofiles.os # Import aiofiles.os for async file operations
@@ -18,7 +19,7 @@ from PySide6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout,
     QTextEdit, QPushButton, QTableWidget, QTableWidgetItem,
     QLineEdit, QLabel, QFileDialog, QMessageBox, QHeaderView,
-    QStyle, QProgressBar, QSpinBox, QFormLayout, QCheckBox,
+    QStyle, QProgressBar, QSpinBox, QDoubleSpinBox, QFormLayout, QCheckBox,
     QGroupBox, QRadioButton, QGridLayout, QMainWindow,
     QStackedWidget, QDialog, QDialogButtonBox, # Removed QListWidget, QListWidgetItem, Added QDialogButtonBox
     QComboBox # Import QComboBox
@@ -30,18 +31,59 @@ from PySide6.QtCore import Qt, QThread, Signal, Slot, QRunnable, QThreadPool, QO
 
 # Import necessary functions from our other modules
 # --- Updated Import: Use the new main fetcher function ---
-from tiktok_fetcher import fetch_tiktok_info
+from tiktok_fetcher import (resolve_urls, fetch_tiktok_info, apply_quality_policy, HttpClientPool, HedgePolicy, EndpointScoreboard, CircuitBreakerRegistry,
+                            RateLimiterRegistry, UrlNormalizer, SingleFlight,
+                            RetryPolicy, RETRY_MAX_ATTEMPTS, URL_DEADLINE_SECONDS, QualityPolicy)
+from metadata_cache import MetadataCache, result_aweme_id, signed_url_expired
+from download_history import DownloadHistory
+from integrity import StreamVerifier
+from content_store import ContentStore, PLACEMENT_LABELS
 # -------------------------------------------------------
 # Define COMMON_HEADERS directly or import if moved to a config file
 COMMON_HEADERS = {
     'user-agent': 'Mozilla/5.0 (Linux; Android 8.0; Pixel 2 Build/OPD3.170816.012) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.88 Mobile Safari/537.36 Edg/87.0.664.66'
 }
 MAX_FILENAME_LENGTH = 100 # From downloader.py config
-REQUEST_DELAY_SECONDS = 1 # Reduced delay for concurrency testing
 DOWNLOAD_DELAY_SECONDS = 0.5 # Reduced delay for concurrency testing
 PROGRESS_UPDATE_INTERVAL = 0.5 # Update progress display every 0.5 seconds
+PROGRESS_SAMPLE_BYTES = 256 * 1024 # Check the clock for a progress update after this many bytes
+READ_CHUNK_MIN = 64 * 1024 # First socket read size of a transfer
+READ_CHUNK_MAX = 1024 * 1024 # Reads double up to this size while the network keeps them full
+WRITE_BUFFER_SIZE = 2 * 1024 * 1024 # Received data is written to disk in blocks of this size
+PART_SUFFIX = ".part" # Downloads are written here and renamed when complete
+RESUME_META_SUFFIX = ".part.json" # URL, ETag/Last-Modified and size of a partial download
+DOWNLOAD_ATTEMPTS = 3 # Connection attempts per file; each one resumes where the last stopped
+DOWNLOAD_RETRY_DELAY = 1.0 # Seconds, multiplied by the attempt number
+DOWNLOAD_CONNECT_TIMEOUT = 30 # Seconds to connect to the CDN
+STALL_IDLE_TIMEOUT = 20 # Seconds without receiving any data before a transfer counts as stalled
+STALL_MIN_RATE_KBPS = 32 # Throughput floor (KB/s) over STALL_WINDOW seconds; slower transfers count as stalled (0 = off)
+STALL_WINDOW = 15 # Seconds of transfer the throughput floor is measured over
+STALL_MAX_RESTARTS = 5 # Restarts after stalls per file (or segment) before the download fails
+STALL_SAMPLE_INTERVAL = 1.0 # Seconds between throughput samples of a transfer
+CDN_PROBE_BYTES = 64 * 1024 # Ranged read used to time each video URL candidate
+CDN_PROBE_TIMEOUT = 5 # Seconds a candidate may take to deliver the probe before it loses the race
+URL_GONE_STATUSES = (403, 404, 410) # Answers that rule a video URL out (expired signature, removed from the edge)
+DEFAULT_MAX_HD_MB = 50 # Size limit of the 'HD only below N MB' quality mode
+URL_EXPIRED_STATUSES = (403, 410) # Answers of a CDN to a signed URL that was valid when resolved: the signature expired
+DOWNLOAD_STOPPED_MESSAGE = "用户请求停止 (已保留部分文件，可续传)"
+SEGMENT_MIN_SIZE = 16 * 1024 * 1024 # Files at least this large are downloaded over several connections
+SEGMENT_COUNT = 4 # Concurrent ranges per segmented download
+DOWNLOAD_HOST_CONNECTIONS = 8 # Connection cap per CDN host, shared by all transfers and segments
 DEFAULT_CONCURRENCY = 3 # Default number of concurrent downloads
+DEFAULT_RESOLVE_CONCURRENCY = 4 # Default number of URLs resolved (API lookups) at the same time
+PLAN_CONCURRENCY = 2 # Pipeline workers computing paths and saving covers/titles
+FINALIZE_CONCURRENCY = 1 # Pipeline workers reporting final row status
+PIPELINE_PREFETCH_FACTOR = 2 # Resolved items buffered per download slot
+SIDECAR_CONCURRENCY = 2 # Cover/title side tasks running at the same time
+DEFAULT_ALBUM_CONCURRENCY = 4 # Images of one album downloaded at the same time
+IMAGE_CONCURRENCY = 16 # Album images downloaded at the same time across all albums
+IMAGE_ATTEMPTS = 3 # Attempts per album image before it counts as failed
+IMAGE_RETRY_DELAY = 1.0 # Seconds, multiplied by the attempt number
 CONFIG_FILE = "config.json" # Define config file name
+ENDPOINT_STATS_FILE = "endpoint_stats.json" # Persisted API endpoint scoreboard (next to config.json)
+METADATA_CACHE_FILE = "metadata_cache.sqlite3" # Resolved API results reused across runs (next to config.json)
+DOWNLOAD_HISTORY_DIR = "download_history" # Finished downloads by aweme ID, checked before any API call (next to config.json)
+CONTENT_STORE_FILE = "content_store.sqlite3" # Downloaded files by SHA-256, linked instead of stored twice (next to config.json)
 DEFAULT_THEME = "light" # Default theme
 
 # --- QSS Themes (Moved to Module Level) ---
@@ -360,6 +402,10 @@ def get_user_config_path(): # Renamed for clarity
         # Use a different fallback filename to avoid conflict? Or just log clearly.
         return os.path.join(os.getcwd(), f"user_{CONFIG_FILE}") # Fallback to CWD with prefix
 
+def get_user_data_path(filename):
+    """Returns the absolute path of a data file stored next to the user config file."""
+    return os.path.join(os.path.dirname(get_user_config_path()), filename)
+
 def get_bundled_config_path():
     """
     Returns the path to the config file bundled with the application
@@ -388,105 +434,596 @@ def sanitize_filename(name):
 
 
 # --- NEW Async Download Function ---
-async def download_file_async(url, save_path, referer=None, progress_callback=None, row_index=-1, proxies=None, session=None):
+class RangeNotHonoured(Exception):
+    """The server answered a Range/If-Range request with the whole file (no range support, or the file changed)."""
+
+class TransferStalled(Exception):
+    """A transfer received nothing for the idle timeout or fell below the throughput floor."""
+
+class StallPolicy:
+    """
+    When a transfer counts as stuck: no data for `idle_timeout` seconds, or less than `min_rate_kbps`
+    KB/s over the last `window` seconds. A stalled transfer is abandoned and restarted on a fresh
+    connection from the bytes already received, up to `max_restarts` times per file or segment.
+    """
+
+    def __init__(self, idle_timeout=STALL_IDLE_TIMEOUT, min_rate_kbps=STALL_MIN_RATE_KBPS, window=STALL_WINDOW,
+                 max_restarts=STALL_MAX_RESTARTS):
+        self.idle_timeout = idle_timeout
+        self.min_rate = min_rate_kbps * 1024
+        self.window = window
+        self.max_restarts = max_restarts
+
+class ThroughputMonitor:
+    """Sliding-window throughput of one connection, checked against a StallPolicy after every read."""
+
+    def __init__(self, policy):
+        self.policy = policy
+        now = time.monotonic()
+        self.received = 0
+        self.samples = deque([(now, 0)]) # (time, bytes received by then), one per STALL_SAMPLE_INTERVAL
+
+    def add(self, size):
+        self.received += size
+        if self.policy.min_rate <= 0:
+            return
+        now = time.monotonic()
+        if now - self.samples[-1][0] >= STALL_SAMPLE_INTERVAL:
+            self.samples.append((now, self.received))
+        window_start = now - self.policy.window
+        while len(self.samples) > 1 and self.samples[1][0] <= window_start:
+            self.samples.popleft() # The oldest kept sample is the last one at or before the window start
+        since, received_then = self.samples[0]
+        elapsed = now - since
+        if elapsed >= self.policy.window and (self.received - received_then) / elapsed < self.policy.min_rate:
+            rate = (self.received - received_then) / elapsed / 1024
+            raise TransferStalled(f"速度过低 ({rate:.1f} KB/s, 最近 {elapsed:.0f} 秒)")
+
+class ProgressReporter:
+    """Aggregates bytes received (by one or several connections) and reports them through a progress callback."""
+
+    def __init__(self, callback, row_index, total_size, initial=0):
+        self.callback = callback
+        self.row_index = row_index
+        self.total_size = total_size
+        self.downloaded = initial
+        self.initial = initial
+        self.start_time = time.monotonic()
+        self.last_update_time = self.start_time
+        self.next_sample_at = initial + PROGRESS_SAMPLE_BYTES
+
+    def add(self, size):
+        self.downloaded += size
+        # The clock is only read every PROGRESS_SAMPLE_BYTES, not for every read
+        if not self.callback or self.downloaded < self.next_sample_at:
+            return
+        self.next_sample_at = self.downloaded + PROGRESS_SAMPLE_BYTES
+        current_time = time.monotonic()
+        if current_time - self.last_update_time < PROGRESS_UPDATE_INTERVAL:
+            return
+        elapsed_time_total = current_time - self.start_time
+        progress_percent = int(100 * self.downloaded / self.total_size) if self.total_size > 0 else 0
+        speed_bps = (self.downloaded - self.initial) / elapsed_time_total if elapsed_time_total > 0 else 0
+        # Called from the same async loop, so no thread-safety concerns here
+        self.callback(self.row_index, self.downloaded, self.total_size, progress_percent, speed_bps / 1024 / 1024)
+        self.last_update_time = current_time
+
+def _write_and_verify(f, block, verifier):
+    f.write(block)
+    if verifier is not None:
+        verifier.update(block) # Hashed in the same worker thread, while the block is still in memory
+
+async def _stream_to_file(response, f, reporter, stop_check=None, limit=None, on_flushed=None, verifier=None, stall_policy=None):
+    """
+    Copies the body of `response` into the open binary file `f` at its current position.
+
+    Reads start at READ_CHUNK_MIN bytes and double (up to READ_CHUNK_MAX) while the network keeps
+    them full. Received data is collected into WRITE_BUFFER_SIZE blocks, and each block is written by
+    a worker thread while the next one is being received, so the event loop never waits on the disk
+    per chunk. `limit` caps the bytes taken from the response; on_flushed(size) is called once a block
+    is on disk. Each block is also fed to `verifier` (a StreamVerifier) as it is written. Everything
+    received is written, also when stopping or on errors.
+
+    Returns:
+        bool: True when the body (or `limit` bytes) was copied, False if stop_check asked to stop.
+    Raises TransferStalled when the connection goes idle or falls below the floor of `stall_policy`.
+    """
+    monitor = ThroughputMonitor(stall_policy) if stall_policy else None
+    read_size = READ_CHUNK_MIN
+    buffer = []
+    buffered = 0
+    pending_write = None
+
+    async def write_block(block):
+        await asyncio.to_thread(_write_and_verify, f, block, verifier)
+        if on_flushed:
+            on_flushed(len(block))
+
+    try:
+        while limit is None or limit > 0:
+            if stop_check and stop_check():
+                return False
+            try:
+                data = await response.content.read(read_size if limit is None else min(read_size, limit))
+            except asyncio.TimeoutError: # sock_read: nothing received for the idle timeout
+                raise TransferStalled("连接无数据") from None
+            if not data:
+                break # End of body
+            if len(data) == read_size and read_size < READ_CHUNK_MAX:
+                read_size *= 2 # The network keeps up: read bigger blocks
+            if limit is not None:
+                limit -= len(data)
+            buffer.append(data)
+            buffered += len(data)
+            reporter.add(len(data))
+            if monitor:
+                monitor.add(len(data)) # After buffering, so the data is still written if this stalls
+            if buffered >= WRITE_BUFFER_SIZE:
+                if pending_write is not None:
+                    await pending_write # At most one block in flight
+                pending_write = asyncio.create_task(write_block(b''.join(buffer)))
+                buffer, buffered = [], 0
+        return True
+    finally:
+        if pending_write is not None:
+            await pending_write
+        if buffer:
+            await write_block(b''.join(buffer))
+
+def _content_range_total(content_range):
+    """Returns the total size from a 'bytes start-end/total' (or 'bytes */total') Content-Range header, or 0."""
+    match = re.match(r'bytes\s+(?:\d+-\d+|\*)/(\d+)', content_range or '')
+    return int(match.group(1)) if match else 0
+
+def _plan_segments(total_size, segment_count):
+    """Splits [0, total_size) into `segment_count` [start, end (inclusive), received] ranges."""
+    segment_size = -(-total_size // segment_count) # Ceiling division
+    return [[start, min(start + segment_size, total_size) - 1, 0] for start in range(0, total_size, segment_size)]
+
+async def load_resume_state(save_path):
+    """
+    Returns (received_bytes, state) for a partial download of `save_path`, where state is the saved
+    resume metadata (url, etag, last_modified, total_size and, for segmented downloads, 'segments').
+    A partial file without a validator (ETag/Last-Modified) cannot be resumed safely and counts as 0 bytes.
+    """
+    part_path = save_path + PART_SUFFIX
+    meta_path = save_path + RESUME_META_SUFFIX
+    try:
+        if not await aiofiles.os.path.exists(part_path):
+            return 0, {}
+        async with aiofiles.open(meta_path, 'r', encoding='utf-8') as f:
+            state = json.loads(await f.read())
+        if not (state.get('etag') or state.get('last_modified')):
+            return 0, {}
+        if state.get('segments'): # Preallocated file: its size says nothing about what was received
+            return sum(segment[2] for segment in state['segments']), state
+        return await aiofiles.os.path.getsize(part_path), state
+    except (OSError, ValueError, TypeError, IndexError):
+        return 0, {}
+
+async def save_resume_state(save_path, state):
+    """Writes the resume metadata of a partial download next to its .part file."""
+    try:
+        async with aiofiles.open(save_path + RESUME_META_SUFFIX, 'w', encoding='utf-8') as f:
+            await f.write(json.dumps(state, ensure_ascii=False))
+    except OSError as e:
+        logger.warning(f"无法保存续传信息 {save_path}{RESUME_META_SUFFIX}: {e}")
+
+async def discard_partial_download(save_path):
+    """Removes the .part file and resume metadata of `save_path`."""
+    for path in (save_path + PART_SUFFIX, save_path + RESUME_META_SUFFIX):
+        try:
+            if await aiofiles.os.path.exists(path):
+                await aiofiles.os.remove(path)
+        except OSError as e:
+            logger.warning(f"无法删除不完整文件 {path}: {e}")
+
+async def _download_segments(session, urls, save_path, state, base_headers, timeout, proxy_url, reporter, stop_check, row_index,
+                             verifier=None, stall_policy=None, transfer_stats=None, gone_urls=None):
+    """
+    Fetches the missing bytes of every segment in state['segments'] concurrently, each over its own
+    Range request, and writes them at their offsets into the preallocated .part file. Segments are
+    retried individually (up to DOWNLOAD_ATTEMPTS times, continuing where they stopped) and their
+    progress is saved to the resume metadata, also when the download fails or is stopped.
+    A segment that stalls (see StallPolicy) is restarted at once on a new connection, taking the next
+    of `urls` (the URL, then its alternates), without using up an attempt. A URL that answers one of
+    URL_GONE_STATUSES is added to `gone_urls` (shared with the caller and the other segments) and the
+    segment moves on to the next one; once none is left, the ClientResponseError is raised with the
+    failing URL as its `candidate_url`. Stalls, restarts and switches are counted in `transfer_stats`.
+    A segment that continues exactly where `verifier` stopped is fed to it as it streams (normally the
+    first one); the caller catches the verifier up with the rest of the file afterwards.
+
+    Returns None when every segment is complete, otherwise an error message.
+    Raises RangeNotHonoured if the server stops answering with partial content.
+    """
+    part_path = save_path + PART_SUFFIX
+    validator = state.get('etag') or state.get('last_modified')
+
+    async def fetch_segment(segment):
+        error_msg = None
+        stalls = 0
+        attempt = 0
+        url_position = 0 # Index in `urls` of the URL this segment uses
+        while attempt < DOWNLOAD_ATTEMPTS:
+            attempt += 1
+            start, end, received = segment
+            if start + received > end:
+                return None
+            if urls[url_position] in gone_urls: # Found gone by another segment meanwhile
+                next_position = _next_url_index(urls, url_position, gone_urls)
+                if next_position is not None:
+                    url_position = next_position
+            segment_url = urls[url_position]
+            headers = dict(base_headers, Range=f"bytes={start + received}-{end}")
+            headers['If-Range'] = validator
+            try:
+                async with session.get(segment_url, headers=headers, timeout=timeout, proxy=proxy_url) as response:
+                    response.raise_for_status()
+                    if response.status != 206:
+                        raise RangeNotHonoured(f"HTTP {response.status} for bytes {start + received}-{end}")
+                    in_order = verifier is not None and verifier.position == start + received
+                    f = await asyncio.to_thread(open, part_path, 'r+b')
+                    try:
+                        await asyncio.to_thread(f.seek, start + received)
+                        completed = await _stream_to_file(response, f, reporter, stop_check,
+                                                          limit=end + 1 - start - received, # Never write past the segment
+                                                          on_flushed=lambda size: segment.__setitem__(2, segment[2] + size),
+                                                          verifier=verifier if in_order else None,
+                                                          stall_policy=stall_policy)
+                    finally:
+                        await asyncio.to_thread(f.close)
+                    if not completed:
+                        return DOWNLOAD_STOPPED_MESSAGE
+                if start + segment[2] > end:
+                    await save_resume_state(save_path, state)
+                    return None
+                error_msg = "分段数据不完整"
+            except aiohttp.ClientResponseError as e:
+                if e.status not in URL_GONE_STATUSES:
+                    raise
+                gone_urls.add(segment_url)
+                next_position = _next_url_index(urls, url_position, gone_urls)
+                if next_position is None:
+                    e.candidate_url = segment_url # The caller blacklists the URL that actually failed
+                    raise
+                transfer_stats['switches'] += 1
+                attempt -= 1 # Bounded by the number of URLs
+                url_position = next_position
+                logger.warning(f"  [Row {row_index}] Segment {start}-{end}: {segment_url[:80]} answered HTTP {e.status}, "
+                               f"moving to URL candidate {url_position + 1}/{len(urls)}")
+                continue
+            except TransferStalled as e:
+                stalls += 1
+                transfer_stats['stalls'] += 1
+                if stall_policy is None or stalls > stall_policy.max_restarts:
+                    return f"下载卡顿 ({e})"
+                transfer_stats['restarts'] += 1
+                attempt -= 1 # Restart at once; a stall does not use up an attempt
+                next_position = _next_url_index(urls, url_position, gone_urls)
+                if next_position is not None and next_position != url_position: # Try the next URL for the file
+                    transfer_stats['switches'] += 1
+                    url_position = next_position
+                logger.warning(f"  [Row {row_index}] Segment {start}-{end} stalled ({e}), restart {stalls}/{stall_policy.max_restarts}")
+                continue
+            except (aiohttp.ClientPayloadError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error_msg = "下载超时" if isinstance(e, asyncio.TimeoutError) else f"网络连接错误: {e}"
+            logger.warning(f"  [Row {row_index}] Segment {start}-{end} attempt {attempt}/{DOWNLOAD_ATTEMPTS} failed: {error_msg}")
+            if attempt < DOWNLOAD_ATTEMPTS:
+                transfer_stats['restarts'] += 1
+                await asyncio.sleep(DOWNLOAD_RETRY_DELAY * attempt)
+        return error_msg
+
+    if transfer_stats is None:
+        transfer_stats = {'stalls': 0, 'restarts': 0, 'switches': 0}
+    if gone_urls is None:
+        gone_urls = set()
+    tasks = [asyncio.create_task(fetch_segment(segment)) for segment in state['segments']]
+    try:
+        for task in asyncio.as_completed(tasks):
+            error_msg = await task
+            if error_msg:
+                return error_msg # The finally block stops the other segments
+        return None
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await save_resume_state(save_path, state)
+
+def _next_url_index(urls, index, gone_urls):
+    """Returns the index of the next URL after `index` (wrapping around) that is not in gone_urls, or None."""
+    for step in range(1, len(urls) + 1):
+        candidate = (index + step) % len(urls)
+        if urls[candidate] not in gone_urls:
+            return candidate
+    return None
+
+async def _probe_url(session, url, headers, proxy_url):
+    """
+    Times how long `url` takes to deliver its first CDN_PROBE_BYTES (a ranged read).
+    Returns (seconds, status); seconds is None if the URL failed, timed out or answered an error.
+    A complete probe leaves its connection in the pool, warm for the download that may follow.
+    """
+    start = time.monotonic()
+    try:
+        async with session.get(url, headers=dict(headers, Range=f"bytes=0-{CDN_PROBE_BYTES - 1}"), proxy=proxy_url,
+                               timeout=aiohttp.ClientTimeout(total=CDN_PROBE_TIMEOUT)) as response:
+            if response.status not in (200, 206):
+                return None, response.status
+            if response.status == 206:
+                await response.read() # Small: read it all so the connection can be reused
+            else: # Range ignored: the first bytes are enough, the rest is dropped with the connection
+                await response.content.read(CDN_PROBE_BYTES)
+            return time.monotonic() - start, response.status
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return None, None
+
+async def rank_video_urls(session, candidates, referer=None, proxies=None, row_index=-1):
+    """
+    Orders the video URL candidates of a post ([{'url', 'quality'}], best quality first, as returned
+    by the fetcher) for downloading.
+
+    The candidates of the best quality are probed in parallel (a small ranged read) and the first
+    one to deliver wins; candidates answering 403/404/410 are dropped, and if a whole quality is
+    gone the next one is probed. The remaining candidates follow in their original order, as
+    fallbacks for download_file_async. Nothing is probed for a single candidate.
+
+    Returns the list of URLs to try, fastest first.
+    """
+    urls = []
+    tiers = {} # quality -> URLs, in order of first appearance
+    for candidate in candidates:
+        url = candidate.get('url')
+        if url and url not in urls:
+            urls.append(url)
+            tiers.setdefault(candidate.get('quality', 'default'), []).append(url)
+    if len(urls) < 2:
+        return urls
+    proxy_url = (proxies.get('https') or proxies.get('http')) if proxies else None
+    headers = {'Referer': referer} if referer else {}
+    gone = set()
+    winner = None
+    tier_list = list(tiers.items())
+    for position, (quality, tier) in enumerate(tier_list):
+        if len(tier) == 1 and position == len(tier_list) - 1:
+            break # Nothing left to choose from
+        probes = {asyncio.create_task(_probe_url(session, url, headers, proxy_url)): url for url in tier}
+        pending = set(probes)
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=lambda task: tier.index(probes[task])):
+                    seconds, status = task.result()
+                    if seconds is not None and winner is None:
+                        winner = probes[task]
+                        logger.info(f"  [Row {row_index}] Fastest {quality} video URL ({tier.index(winner) + 1}/{len(tier)}): "
+                                    f"{seconds * 1000:.0f} ms to first {CDN_PROBE_BYTES // 1024} KB")
+                    elif status in URL_GONE_STATUSES:
+                        gone.add(probes[task])
+        finally:
+            for task in pending: # Slower edges lost the race
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        if winner is not None or not all(url in gone for url in tier):
+            break # A winner, or candidates that are only slow/unreachable: keep the order
+        logger.warning(f"  [Row {row_index}] Every {quality} video URL was refused, trying the next quality.")
+    ranked = ([winner] if winner else []) + [url for url in urls if url != winner and url not in gone]
+    return ranked or urls # All refused: the download reports the error
+
+async def download_file_async(url, save_path, referer=None, progress_callback=None, row_index=-1, proxies=None, session=None,
+                              stop_check=None, segments=SEGMENT_COUNT, verify=None, integrity=None, content_store=None,
+                              stall_policy=None, transfer_stats=None, alternate_urls=()):
     """
     Asynchronous version of download_file using aiohttp and aiofiles.
     Includes progress reporting via callback, passing row_index, and proxy support.
     Accepts an optional aiohttp.ClientSession.
+
+    Data is written to '<save_path>.part' and renamed to save_path only when complete. The server's
+    ETag/Last-Modified are kept in '<save_path>.part.json', so a dropped connection (retried here up to
+    DOWNLOAD_ATTEMPTS times) or a later run continues with a Range request instead of starting over.
+    Files of at least SEGMENT_MIN_SIZE bytes from servers that accept ranges are fetched as `segments`
+    concurrent ranges (1 disables this); the per-host connection cap of the session still applies.
+    If `stop_check` returns True the transfer stops and the partial file is kept for resuming.
+
+    The SHA-256 is computed as the data is written (only a resumed prefix or the later segments of a
+    segmented download are read back) and, with `verify` 'video' or 'image', the MP4/JPEG/WebP structure
+    is checked on the way (see integrity.StreamVerifier). A file that fails the check or does not have
+    the announced size is discarded and the download fails; it is never moved into place. The verdict
+    ({'sha256', 'size', 'format', 'ok', 'detail'}) is stored into the `integrity` dict if one is passed.
+
+    With a `content_store`, a file whose content is already on disk elsewhere is put in place as a
+    reflink/hard link of that file instead ('placement' in the verdict: 'reflink', 'hardlink' or 'new').
+
+    Instead of a fixed timeout, a transfer that stalls (no data for the idle timeout, or slower than the
+    throughput floor of `stall_policy`, default StallPolicy()) is abandoned and restarted at once from
+    the bytes already received, on a new connection and, if `alternate_urls` are given, the next URL
+    for the same file. A URL that answers 403/404/410 is dropped in favour of the next alternate. Stalls,
+    restarts (also after dropped connections) and URL switches are counted in the `transfer_stats`
+    dict ({'stalls', 'restarts', 'switches'}) while the download runs; if the download fails on an HTTP
+    error, its status is left there as 'http_status'.
     """
+    # aiohttp uses the proxy URL string directly, not a dict like requests
+    proxy_url = (proxies.get('https') or proxies.get('http')) if proxies else None
     close_session = False
     if session is None:
-        # Create a connector that respects proxy settings if provided
-        # Note: aiohttp uses proxy URL string directly, not dict like requests
-        proxy_url = None
-        if proxies:
-            # Assuming proxies dict has 'http' or 'https' key with the full proxy URL
-            proxy_url = proxies.get('https') or proxies.get('http')
-
-        # Use TrustEnvironment=True to potentially pick up system proxies if proxy_url is None
         # Explicitly disable SSL verification if needed (not recommended generally)
         # connector = aiohttp.TCPConnector(ssl=False) if disable_ssl else aiohttp.TCPConnector()
-        connector = aiohttp.TCPConnector() # Default connector
+        connector = aiohttp.TCPConnector(limit_per_host=DOWNLOAD_HOST_CONNECTIONS)
         session = aiohttp.ClientSession(connector=connector, headers=COMMON_HEADERS)
         close_session = True
         logger.debug(f"  [Row {row_index}] Created new aiohttp session. Proxy URL: {proxy_url}")
 
+    part_path = save_path + PART_SUFFIX
+    if stall_policy is None:
+        stall_policy = StallPolicy()
+    if transfer_stats is None:
+        transfer_stats = {}
+    transfer_stats.setdefault('stalls', 0)
+    transfer_stats.setdefault('restarts', 0)
+    transfer_stats.setdefault('switches', 0)
+    # sock_read is the idle timeout: a read that waits longer raises and counts as a stall
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=DOWNLOAD_CONNECT_TIMEOUT, sock_read=stall_policy.idle_timeout)
+    candidate_urls = [url] + [alternate for alternate in alternate_urls if alternate and alternate != url]
+    base_headers = {} # Start fresh, session might have base headers
+    if referer:
+        base_headers['Referer'] = referer
+    error_msg = None
+    gone_urls = set() # Candidates that answered with one of URL_GONE_STATUSES
+    url_index = 0
+    stalls = 0
+    attempt = 0
     try:
-        headers = {} # Start fresh, session might have base headers
-        if referer:
-            headers['Referer'] = referer
-
-        # Use proxy_url in the get request if specified
-        proxy_arg = proxy_url if proxies else None # Use the extracted proxy URL string
-
-        async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=60), proxy=proxy_arg) as response:
-            response.raise_for_status()
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded_size = 0
-            last_update_time = time.time()
-            start_time = last_update_time
-
-            async with aiofiles.open(save_path, 'wb') as f:
-                async for chunk in response.content.iter_chunked(8192):
-                    if chunk:
-                        await f.write(chunk)
-                        downloaded_size += len(chunk)
-                        current_time = time.time()
-                        elapsed_time_total = current_time - start_time
-                        elapsed_time_update = current_time - last_update_time
-
-                        # --- Progress and Speed Calculation ---
-                        if progress_callback and elapsed_time_update >= PROGRESS_UPDATE_INTERVAL:
-                            progress_percent = int(100 * downloaded_size / total_size) if total_size > 0 else 0
-                            speed_bps = downloaded_size / elapsed_time_total if elapsed_time_total > 0 else 0
-                            speed_mbps = speed_bps / 1024 / 1024
-                            # Call the callback (ensure it's thread-safe if needed, but here it's called from the same async loop)
-                            progress_callback(row_index, downloaded_size, total_size, progress_percent, speed_mbps)
-                            last_update_time = current_time
-                        # ------------------------------------
-                    # Yield control briefly to allow other tasks to run
-                    await asyncio.sleep(0.001)
-
-
-            logger.info(f"  [Row {row_index}] Async download complete: {os.path.basename(save_path)}")
-            # --- File Size Validation (Basic) ---
-            # Use aiofiles for async stat
-            stat_result = await aiofiles.os.stat(save_path)
-            actual_size = stat_result.st_size
-            if total_size > 0 and actual_size != total_size:
-                size_mismatch_msg = f"文件大小不匹配. 预期: {total_size}, 实际: {actual_size}"
-                logger.warning(f"  [Row {row_index}] {size_mismatch_msg} for {save_path}")
-                return True, size_mismatch_msg # Return success=True but with a warning message
-            # ------------------------------------
+        while attempt < DOWNLOAD_ATTEMPTS:
+            attempt += 1
+            url = candidate_urls[url_index]
+            offset, state = await load_resume_state(save_path)
+            verifier = StreamVerifier(verify)
+            encoded = False # A compressed body is longer once decoded than its Content-Length
+            try:
+                if not state.get('segments'):
+                    headers = dict(base_headers)
+                    if offset > 0:
+                        # If-Range: the server only honours the range if the file is unchanged, otherwise sends it whole
+                        headers['Range'] = f"bytes={offset}-"
+                        headers['If-Range'] = state.get('etag') or state.get('last_modified')
+                        logger.info(f"  [Row {row_index}] Resuming {os.path.basename(save_path)} from byte {offset}")
+                    async with session.get(url, headers=headers, timeout=timeout, proxy=proxy_url) as response:
+                        if response.status == 416 and offset > 0:
+                            # Requested range starts at/after the end: the part may already be complete
+                            if _content_range_total(response.headers.get('Content-Range')) == offset:
+                                total_size = offset
+                                break
+                            await discard_partial_download(save_path)
+                            continue
+                        response.raise_for_status()
+                        if response.status == 206 and offset > 0:
+                            mode = 'ab'
+                            total_size = (_content_range_total(response.headers.get('Content-Range'))
+                                          or offset + int(response.headers.get('content-length', 0)))
+                        else: # Full body (no range support, or the file changed): start over
+                            mode, offset = 'wb', 0
+                            total_size = int(response.headers.get('content-length', 0))
+                        encoded = response.headers.get('Content-Encoding', 'identity').lower() != 'identity'
+                        state = {'url': url, 'etag': response.headers.get('ETag'),
+                                 'last_modified': response.headers.get('Last-Modified'), 'total_size': total_size}
+
+                        if (mode == 'wb' and segments > 1 and total_size >= SEGMENT_MIN_SIZE
+                                and response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+                                and (state['etag'] or state['last_modified'])):
+                            # Large file from a range-capable server: drop this stream, fetch in segments
+                            response.close()
+                            state['segments'] = _plan_segments(total_size, segments)
+                            async with aiofiles.open(part_path, 'wb') as f:
+                                await f.truncate(total_size) # Preallocate so segments can write at their offsets
+                            await save_resume_state(save_path, state)
+                            logger.info(f"  [Row {row_index}] Downloading {os.path.basename(save_path)} in {len(state['segments'])} segments")
+                        else:
+                            await save_resume_state(save_path, state)
+                            reporter = ProgressReporter(progress_callback, row_index, total_size, offset)
+                            if offset > 0: # The resumed prefix is on disk only
+                                await asyncio.to_thread(verifier.catch_up, part_path, offset)
+                            f = await asyncio.to_thread(open, part_path, mode)
+                            try:
+                                completed = await _stream_to_file(response, f, reporter, stop_check, verifier=verifier,
+                                                                  stall_policy=stall_policy)
+                            finally:
+                                await asyncio.to_thread(f.close)
+                            if not completed:
+                                logger.info(f"  [Row {row_index}] Download stopped at {reporter.downloaded} bytes, kept {part_path} for resuming.")
+                                return False, DOWNLOAD_STOPPED_MESSAGE
+                            break # Body complete
+
+                # --- Segmented transfer (new, or resumed from the metadata) ---
+                total_size = state['total_size']
+                reporter = ProgressReporter(progress_callback, row_index, total_size,
+                                            sum(segment[2] for segment in state['segments']))
+                segment_urls = [candidate for candidate in candidate_urls[url_index:] + candidate_urls[:url_index]
+                                if candidate not in gone_urls] # Segments start on the URL in use and rotate from there
+                error_msg = await _download_segments(session, segment_urls, save_path, state,
+                                                     base_headers, timeout, proxy_url, reporter, stop_check, row_index,
+                                                     verifier, stall_policy, transfer_stats, gone_urls)
+                if error_msg is None:
+                    break
+                return False, error_msg # Each segment was already retried
+            except RangeNotHonoured as e:
+                logger.warning(f"  [Row {row_index}] Server stopped honouring ranges ({e}), downloading as a single stream.")
+                await discard_partial_download(save_path)
+                segments = 1
+            except TransferStalled as e:
+                # Leaving the response drops the connection (its body is unfinished); continue from the part
+                stalls += 1
+                transfer_stats['stalls'] += 1
+                if stalls > stall_policy.max_restarts:
+                    logger.error(f"  [Row {row_index}] Download of {os.path.basename(save_path)} kept stalling ({e}), giving up after {stalls - 1} restarts.")
+                    return False, f"下载卡顿 ({e}), 已重连 {stalls - 1} 次"
+                transfer_stats['restarts'] += 1
+                attempt -= 1 # Restart at once; a stall does not use up a connection attempt
+                next_index = _next_url_index(candidate_urls, url_index, gone_urls)
+                if next_index != url_index: # After a stall, try the next URL for the file
+                    transfer_stats['switches'] += 1
+                    url_index = next_index
+                logger.warning(f"  [Row {row_index}] Transfer of {os.path.basename(save_path)} stalled ({e}), restart {stalls}/{stall_policy.max_restarts}"
+                               f"{f' via URL candidate {url_index + 1}/{len(candidate_urls)}' if len(candidate_urls) > 1 else ''}")
+            except aiohttp.ClientResponseError as e:
+                if e.status not in URL_GONE_STATUSES:
+                    raise
+                failed_url = getattr(e, 'candidate_url', url) # A segment may have failed on another candidate
+                gone_urls.add(failed_url)
+                next_index = _next_url_index(candidate_urls, url_index, gone_urls)
+                if next_index is None:
+                    raise # No candidate left
+                logger.warning(f"  [Row {row_index}] {failed_url[:80]} answered HTTP {e.status}, "
+                               f"falling back to URL candidate {next_index + 1}/{len(candidate_urls)}")
+                transfer_stats['switches'] += 1
+                url_index = next_index
+                attempt -= 1 # Bounded by the number of candidates
+            except (aiohttp.ClientPayloadError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                # Connection dropped mid-transfer: keep the part and continue from where it stopped
+                if isinstance(e, aiohttp.ClientProxyConnectionError):
+                    error_msg = f"代理连接错误: {e}" # More user-friendly
+                elif isinstance(e, asyncio.TimeoutError):
+                    error_msg = "下载超时" # More user-friendly
+                else:
+                    error_msg = f"网络连接错误: {e}" # More user-friendly
+                logger.warning(f"  [Row {row_index}] Download attempt {attempt}/{DOWNLOAD_ATTEMPTS} for {url} failed: {error_msg}")
+                if attempt == DOWNLOAD_ATTEMPTS:
+                    return False, error_msg
+                transfer_stats['restarts'] += 1
+                await asyncio.sleep(DOWNLOAD_RETRY_DELAY * attempt)
+        else:
+            return False, error_msg or "下载失败 (未知错误)"
+
+        # --- Verify (hash and structure), then atomically move the part into place ---
+        await asyncio.to_thread(verifier.catch_up, part_path) # Bytes not seen while streaming, if any
+        report = verifier.finish(0 if encoded else total_size)
+        if not report['ok']:
+            if integrity is not None:
+                integrity.update(report)
+            logger.error(f"  [Row {row_index}] Integrity check failed for {os.path.basename(save_path)}: {report['detail']}")
+            await discard_partial_download(save_path) # Resuming a bad file would only keep it bad
+            return False, f"完整性校验失败: {report['detail']}"
+        if content_store is not None:
+            report['placement'] = await asyncio.to_thread(content_store.place, part_path, save_path,
+                                                          report['sha256'], report['size'])
+        else:
+            await aiofiles.os.replace(part_path, save_path)
+            report['placement'] = 'new'
+        if integrity is not None:
+            integrity.update(report)
+        if await aiofiles.os.path.exists(save_path + RESUME_META_SUFFIX):
+            await aiofiles.os.remove(save_path + RESUME_META_SUFFIX)
+        logger.info(f"  [Row {row_index}] Async download complete: {os.path.basename(save_path)} (sha256 {report['sha256']})")
         return True, None # Return success, no error message
 
     # --- Improved Error Handling ---
-    except aiohttp.ClientProxyConnectionError as e:
-        error_msg = f"代理连接错误: {e}" # More user-friendly
-        logger.error(f"  [Row {row_index}] Proxy connection error for {url}: {e}")
-        return False, error_msg
-    except asyncio.TimeoutError:
-        error_msg = "下载超时" # More user-friendly
-        logger.error(f"  [Row {row_index}] Download timeout for {url}")
-        return False, error_msg
     except aiohttp.ClientResponseError as e: # Specific HTTP errors
+        transfer_stats['http_status'] = e.status
         error_msg = f"HTTP 错误 {e.status}: {e.message}" # More user-friendly
         logger.error(f"  [Row {row_index}] HTTP error {e.status} for {url}: {e.message}")
         return False, error_msg
-    except aiohttp.ClientConnectionError as e: # Specific connection errors
-        error_msg = f"网络连接错误: {e}" # More user-friendly
-        logger.error(f"  [Row {row_index}] Connection error for {url}: {e}")
-        return False, error_msg
     except aiohttp.ClientError as e: # Catch other aiohttp client errors
         error_msg = f"下载客户端错误: {e}" # More user-friendly
         logger.error(f"  [Row {row_index}] Client error for {url}: {e}")
-        # Attempt to remove incomplete file asynchronously
-        if await aiofiles.os.path.exists(save_path):
-            try:
-                await aiofiles.os.remove(save_path)
-                logger.info(f"  [Row {row_index}] 已移除不完整文件: {save_path}")
-            except OSError as oe:
-                 logger.error(f"  [Row {row_index}] 移除不完整文件错误 {save_path}: {oe}")
         return False, error_msg
     except Exception as e:
         error_msg = f"发生意外错误: {e}" # More user-friendly
@@ -605,7 +1142,22 @@ def load_config():
             "port": "",
             "username": "",
             "password": ""
-        }
+        },
+        "hedging": { # Opt-in hedged API requests (see tiktok_fetcher.HedgePolicy)
+            "enabled": False,
+            "percentile": 90, # Hedge after this latency percentile (%)
+            "budget": 100 # Maximum extra API calls per batch
+        },
+        "retry": { # Per-URL retry policy (see tiktok_fetcher.RetryPolicy)
+            "max_attempts": 3, # Attempts per API endpoint for transient errors
+            "deadline_seconds": 90 # Total time budget per URL across all endpoints and retries
+        },
+        "stall": { # Stall detection of media transfers (see StallPolicy)
+            "idle_timeout": STALL_IDLE_TIMEOUT, # Seconds without data before a transfer is restarted
+            "min_kbps": STALL_MIN_RATE_KBPS, # Throughput floor in KB/s (0 = off)
+            "window_seconds": STALL_WINDOW # Seconds the throughput floor is measured over
+        },
+        "negative_cache_ttl_hours": 168 # Skip posts every API reported as gone for this long (0 = off)
     }
 
     logger.info(f"[Config] 尝试从用户路径加载: {user_config_path}")
@@ -646,6 +1198,8 @@ def load_config():
                     ep.setdefault('host', '')
                     ep.setdefault('param_name', 'url')
                     ep.setdefault('method', 'GET')
+                    ep.setdefault('rate_per_second', 0) # 0 = no client-side limit
+                    ep.setdefault('burst', 1)
                     validated_endpoints.append(ep)
                 else:
                     logger.warning(f"配置文件中发现无效的 API 端点条目，已忽略: {ep}")
@@ -670,6 +1224,20 @@ def load_config():
                 logger.warning(f"配置文件中的代理类型 '{final_config['proxy_config'].get('type')}' 无效，已重置为 'none'。")
             final_config["proxy_config"]["type"] = "none"
 
+        # Validate hedging structure (merge with defaults like proxy_config)
+        if not isinstance(final_config.get("hedging"), dict):
+            final_config["hedging"] = default_config["hedging"].copy()
+        else:
+            final_config["hedging"] = {**default_config["hedging"], **final_config["hedging"]}
+        if not isinstance(final_config.get("retry"), dict):
+            final_config["retry"] = default_config["retry"].copy()
+        else:
+            final_config["retry"] = {**default_config["retry"], **final_config["retry"]}
+        if not isinstance(final_config.get("stall"), dict):
+            final_config["stall"] = default_config["stall"].copy()
+        else:
+            final_config["stall"] = {**default_config["stall"], **final_config["stall"]}
+
         # --- Add Default APIs if list is empty ---
         if not final_config.get("api_endpoints"):
             logger.info("[Config] API 端点列表为空，正在添加默认 API 配置...")
@@ -808,6 +1376,18 @@ class ApiEditDialog(QDialog):
         self.param_name_input = QLineEdit()
         self.method_combo = QComboBox()
         self.method_combo.addItems(["GET", "POST"]) # Add common methods
+        self.rate_spinbox = QDoubleSpinBox()
+        self.rate_spinbox.setRange(0, 1000)
+        self.rate_spinbox.setDecimals(2)
+        self.rate_spinbox.setSingleStep(0.5)
+        self.rate_spinbox.setSpecialValueText(self.tr("不限制")) # Shown for 0
+        self.rate_spinbox.setToolTip(self.tr("按套餐配额填写，遇到 429 时会自动降低速率"))
+        self.burst_spinbox = QSpinBox()
+        self.burst_spinbox.setRange(1, 100)
+        self.burst_spinbox.setToolTip(self.tr("允许连续发出的最大请求数"))
+        self.field_map_input = QLineEdit()
+        self.field_map_input.setPlaceholderText('{"nwm_video_url": "result.play", "title": "desc"}')
+        self.field_map_input.setToolTip(self.tr("可选。JSON 对象: 字段名 -> 响应中的路径 (相对于 data，可用 . 分隔，列表用数字下标)"))
 
         self.layout.addRow(self.tr("名称:"), self.name_input) # Wrapped
         self.layout.addRow(self.tr("URL:"), self.url_input) # Wrapped
@@ -815,7 +1395,12 @@ class ApiEditDialog(QDialog):
         self.layout.addRow(self.tr("API Host:"), self.host_input) # Wrapped
         self.layout.addRow(self.tr("参数名称:"), self.param_name_input) # Wrapped
         self.layout.addRow(self.tr("请求方法:"), self.method_combo) # Wrapped
+        self.layout.addRow(self.tr("速率 (请求/秒):"), self.rate_spinbox)
+        self.layout.addRow(self.tr("突发请求数:"), self.burst_spinbox)
+        self.layout.addRow(self.tr("字段映射:"), self.field_map_input)
 
+        self.api_data = dict(api_data or {}) # Keep fields the dialog doesn't edit
+        self.burst_spinbox.setValue(1)
         # Populate fields if editing
         if api_data:
             self.name_input.setText(api_data.get('name', ''))
@@ -826,6 +1411,10 @@ class ApiEditDialog(QDialog):
             method_index = self.method_combo.findText(api_data.get('method', 'GET').upper())
             if method_index != -1:
                 self.method_combo.setCurrentIndex(method_index)
+            self.rate_spinbox.setValue(float(api_data.get('rate_per_second', 0) or 0))
+            self.burst_spinbox.setValue(int(api_data.get('burst', 1) or 1))
+            if api_data.get('field_map'):
+                self.field_map_input.setText(json.dumps(api_data['field_map'], ensure_ascii=False))
 
         # Standard buttons
         self.button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
@@ -841,6 +1430,7 @@ class ApiEditDialog(QDialog):
         host = self.host_input.text().strip()
         param_name = self.param_name_input.text().strip() or 'url' # Default to 'url' if empty
         method = self.method_combo.currentText()
+        field_map_text = self.field_map_input.text().strip()
 
         # Basic validation
         if not name or not url:
@@ -858,15 +1448,34 @@ class ApiEditDialog(QDialog):
                                           QMessageBox.StandardButton.No)
              if reply == QMessageBox.StandardButton.No:
                  return None # User chose not to proceed
-
-        return {
+        field_map = {}
+        if field_map_text:
+            try:
+                field_map = json.loads(field_map_text)
+            except json.JSONDecodeError:
+                field_map = None
+            if not isinstance(field_map, dict) or not all(
+                    isinstance(paths, str) or (isinstance(paths, list) and all(isinstance(p, str) for p in paths))
+                    for paths in field_map.values()):
+                QMessageBox.warning(self, self.tr("输入错误"), self.tr("字段映射必须是 JSON 对象，值为路径字符串或路径列表。"))
+                return None
+
+        api_data = dict(self.api_data)
+        api_data.update({
             'name': name,
             'url': url,
             'key': key,
             'host': host,
             'param_name': param_name,
-            'method': method
-        }
+            'method': method,
+            'rate_per_second': self.rate_spinbox.value(),
+            'burst': self.burst_spinbox.value()
+        })
+        if field_map:
+            api_data['field_map'] = field_map
+        else:
+            api_data.pop('field_map', None)
+        return api_data
 
     # Override accept to perform validation before closing
     def accept(self):
@@ -889,10 +1498,10 @@ class ApiSettingsWidget(QWidget):
 
         # Create Table Widget
         self.api_table_widget = QTableWidget()
-        self.api_table_widget.setColumnCount(7) # Name, URL, Key, Host, Param, Method, Active
+        self.api_table_widget.setColumnCount(8) # Name, URL, Key, Host, Param, Method, Active, Stats
         self.api_table_headers = [
             self.tr("名称"), self.tr("URL"), self.tr("Key"), self.tr("Host"),
-            self.tr("参数名"), self.tr("方法"), self.tr("活动")
+            self.tr("参数名"), self.tr("方法"), self.tr("活动"), self.tr("统计")
         ]
         self.api_table_widget.setHorizontalHeaderLabels(self.api_table_headers)
         self.api_table_widget.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
@@ -908,6 +1517,7 @@ class ApiSettingsWidget(QWidget):
         header.setSectionResizeMode(4, QHeaderView.ResizeMode.ResizeToContents) # Param Name
         header.setSectionResizeMode(5, QHeaderView.ResizeMode.ResizeToContents) # Method
         header.setSectionResizeMode(6, QHeaderView.ResizeMode.ResizeToContents) # Active indicator
+        header.setSectionResizeMode(7, QHeaderView.ResizeMode.ResizeToContents) # Live statistics
         self.api_table_widget.setColumnWidth(0, 120)
         self.api_table_widget.setColumnWidth(2, 100)
         self.api_table_widget.setColumnWidth(3, 150)
@@ -953,6 +1563,71 @@ class ApiSettingsWidget(QWidget):
         # -----------------------------
 
         layout.addWidget(self.api_group)
+
+        # --- Hedged Requests Section ---
+        self.hedging_group = QGroupBox(self.tr("请求对冲"))
+        hedging_layout = QFormLayout(self.hedging_group)
+        self.hedging_checkbox = QCheckBox(self.tr("启用对冲请求"))
+        self.hedging_checkbox.setToolTip(self.tr("当前 API 响应过慢时，同时向下一个 API 发送相同请求，采用最先返回的有效结果。"))
+        hedging_layout.addRow(self.hedging_checkbox)
+        self.hedging_percentile_label = QLabel(self.tr("延迟百分位:"))
+        self.hedging_percentile_spinbox = QSpinBox()
+        self.hedging_percentile_spinbox.setRange(50, 99)
+        self.hedging_percentile_spinbox.setSuffix("%")
+        self.hedging_percentile_spinbox.setToolTip(self.tr("请求耗时超过近期成功请求的该百分位延迟后发送对冲请求。"))
+        hedging_layout.addRow(self.hedging_percentile_label, self.hedging_percentile_spinbox)
+        self.hedging_budget_label = QLabel(self.tr("每批额外请求上限:"))
+        self.hedging_budget_spinbox = QSpinBox()
+        self.hedging_budget_spinbox.setRange(0, 100000)
+        self.hedging_budget_spinbox.setToolTip(self.tr("每次批量下载中对冲请求最多可消耗的额外 API 调用次数。"))
+        hedging_layout.addRow(self.hedging_budget_label, self.hedging_budget_spinbox)
+        layout.addWidget(self.hedging_group)
+
+        self.retry_group = QGroupBox(self.tr("重试策略"))
+        retry_layout = QFormLayout(self.retry_group)
+        self.retry_attempts_label = QLabel(self.tr("每个 API 尝试次数:"))
+        self.retry_attempts_spinbox = QSpinBox()
+        self.retry_attempts_spinbox.setRange(1, 10)
+        self.retry_attempts_spinbox.setToolTip(self.tr("超时、网络错误、限流或服务器错误时，同一 API 最多尝试的次数 (指数退避加随机抖动)。"))
+        retry_layout.addRow(self.retry_attempts_label, self.retry_attempts_spinbox)
+        self.retry_deadline_label = QLabel(self.tr("单个链接时间预算 (秒):"))
+        self.retry_deadline_spinbox = QSpinBox()
+        self.retry_deadline_spinbox.setRange(10, 3600)
+        self.retry_deadline_spinbox.setToolTip(self.tr("一个链接在所有 API 和重试上最多花费的时间，超出后放弃该链接。"))
+        retry_layout.addRow(self.retry_deadline_label, self.retry_deadline_spinbox)
+        layout.addWidget(self.retry_group)
+
+        self.stall_group = QGroupBox(self.tr("下载卡顿检测"))
+        stall_layout = QFormLayout(self.stall_group)
+        self.stall_idle_label = QLabel(self.tr("无数据超时 (秒):"))
+        self.stall_idle_spinbox = QSpinBox()
+        self.stall_idle_spinbox.setRange(5, 300)
+        self.stall_idle_spinbox.setToolTip(self.tr("连接在此时长内未收到任何数据时，断开并从已下载的位置重新连接。"))
+        stall_layout.addRow(self.stall_idle_label, self.stall_idle_spinbox)
+        self.stall_rate_label = QLabel(self.tr("最低速度 (KB/s):"))
+        self.stall_rate_spinbox = QSpinBox()
+        self.stall_rate_spinbox.setRange(0, 10240)
+        self.stall_rate_spinbox.setSpecialValueText(self.tr("不限制"))
+        self.stall_rate_spinbox.setToolTip(self.tr("下载速度在统计时段内低于此值时，视为卡顿并重新连接 (可能换用备用地址)。"))
+        stall_layout.addRow(self.stall_rate_label, self.stall_rate_spinbox)
+        self.stall_window_label = QLabel(self.tr("速度统计时段 (秒):"))
+        self.stall_window_spinbox = QSpinBox()
+        self.stall_window_spinbox.setRange(3, 120)
+        self.stall_window_spinbox.setToolTip(self.tr("最低速度按最近这段时间的平均速度判断。"))
+        stall_layout.addRow(self.stall_window_label, self.stall_window_spinbox)
+        layout.addWidget(self.stall_group)
+
+        self.negative_cache_group = QGroupBox(self.tr("失效链接"))
+        negative_cache_layout = QFormLayout(self.negative_cache_group)
+        self.negative_cache_ttl_label = QLabel(self.tr("记住失效链接 (小时):"))
+        self.negative_cache_ttl_spinbox = QSpinBox()
+        self.negative_cache_ttl_spinbox.setRange(0, 24 * 365)
+        self.negative_cache_ttl_spinbox.setSpecialValueText(self.tr("不记住"))
+        self.negative_cache_ttl_spinbox.setToolTip(self.tr("所有 API 都报告已删除、私密或无视频链接的作品，在此时长内再次下载时直接跳过。"))
+        negative_cache_layout.addRow(self.negative_cache_ttl_label, self.negative_cache_ttl_spinbox)
+        layout.addWidget(self.negative_cache_group)
+        # -----------------------------
+
         layout.addStretch() # Push API group to the top
 
         # --- Connect Signals (API specific) ---
@@ -967,6 +1642,24 @@ class ApiSettingsWidget(QWidget):
 
         # Load initial state (API specific)
         self.load_api_list()
+        self.load_hedging_settings()
+        self.hedging_checkbox.stateChanged.connect(self.save_hedging_settings)
+        self.hedging_percentile_spinbox.valueChanged.connect(self.save_hedging_settings)
+        self.hedging_budget_spinbox.valueChanged.connect(self.save_hedging_settings)
+        retry = self.config.get("retry", {})
+        self.retry_attempts_spinbox.setValue(int(retry.get("max_attempts", 3)))
+        self.retry_deadline_spinbox.setValue(int(retry.get("deadline_seconds", 90)))
+        self.retry_attempts_spinbox.valueChanged.connect(self.save_retry_settings)
+        self.retry_deadline_spinbox.valueChanged.connect(self.save_retry_settings)
+        stall = self.config.get("stall", {})
+        self.stall_idle_spinbox.setValue(int(stall.get("idle_timeout", STALL_IDLE_TIMEOUT)))
+        self.stall_rate_spinbox.setValue(int(stall.get("min_kbps", STALL_MIN_RATE_KBPS)))
+        self.stall_window_spinbox.setValue(int(stall.get("window_seconds", STALL_WINDOW)))
+        self.stall_idle_spinbox.valueChanged.connect(self.save_stall_settings)
+        self.stall_rate_spinbox.valueChanged.connect(self.save_stall_settings)
+        self.stall_window_spinbox.valueChanged.connect(self.save_stall_settings)
+        self.negative_cache_ttl_spinbox.setValue(int(self.config.get("negative_cache_ttl_hours", 168)))
+        self.negative_cache_ttl_spinbox.valueChanged.connect(self.save_negative_cache_ttl)
         self.update_button_states()
         self.retranslate_ui() # Apply initial translations
 
@@ -976,7 +1669,7 @@ class ApiSettingsWidget(QWidget):
         # Retranslate table headers
         self.api_table_headers = [
             self.tr("名称"), self.tr("URL"), self.tr("Key"), self.tr("Host"),
-            self.tr("参数名"), self.tr("方法"), self.tr("活动")
+            self.tr("参数名"), self.tr("方法"), self.tr("活动"), self.tr("统计")
         ]
         self.api_table_widget.setHorizontalHeaderLabels(self.api_table_headers)
         # Retranslate buttons
@@ -994,6 +1687,30 @@ class ApiSettingsWidget(QWidget):
                     "建议访问 <a href='https://rapidapi.com/hub'>RapidAPI Hub</a> 搜索 'TikTok'，"
                     "查找并添加新的 API 配置。")
         )
+        self.hedging_group.setTitle(self.tr("请求对冲"))
+        self.hedging_checkbox.setText(self.tr("启用对冲请求"))
+        self.hedging_checkbox.setToolTip(self.tr("当前 API 响应过慢时，同时向下一个 API 发送相同请求，采用最先返回的有效结果。"))
+        self.hedging_percentile_label.setText(self.tr("延迟百分位:"))
+        self.hedging_percentile_spinbox.setToolTip(self.tr("请求耗时超过近期成功请求的该百分位延迟后发送对冲请求。"))
+        self.hedging_budget_label.setText(self.tr("每批额外请求上限:"))
+        self.hedging_budget_spinbox.setToolTip(self.tr("每次批量下载中对冲请求最多可消耗的额外 API 调用次数。"))
+        self.retry_group.setTitle(self.tr("重试策略"))
+        self.retry_attempts_label.setText(self.tr("每个 API 尝试次数:"))
+        self.retry_attempts_spinbox.setToolTip(self.tr("超时、网络错误、限流或服务器错误时，同一 API 最多尝试的次数 (指数退避加随机抖动)。"))
+        self.retry_deadline_label.setText(self.tr("单个链接时间预算 (秒):"))
+        self.retry_deadline_spinbox.setToolTip(self.tr("一个链接在所有 API 和重试上最多花费的时间，超出后放弃该链接。"))
+        self.stall_group.setTitle(self.tr("下载卡顿检测"))
+        self.stall_idle_label.setText(self.tr("无数据超时 (秒):"))
+        self.stall_idle_spinbox.setToolTip(self.tr("连接在此时长内未收到任何数据时，断开并从已下载的位置重新连接。"))
+        self.stall_rate_label.setText(self.tr("最低速度 (KB/s):"))
+        self.stall_rate_spinbox.setSpecialValueText(self.tr("不限制"))
+        self.stall_rate_spinbox.setToolTip(self.tr("下载速度在统计时段内低于此值时，视为卡顿并重新连接 (可能换用备用地址)。"))
+        self.stall_window_label.setText(self.tr("速度统计时段 (秒):"))
+        self.stall_window_spinbox.setToolTip(self.tr("最低速度按最近这段时间的平均速度判断。"))
+        self.negative_cache_group.setTitle(self.tr("失效链接"))
+        self.negative_cache_ttl_label.setText(self.tr("记住失效链接 (小时):"))
+        self.negative_cache_ttl_spinbox.setSpecialValueText(self.tr("不记住"))
+        self.negative_cache_ttl_spinbox.setToolTip(self.tr("所有 API 都报告已删除、私密或无视频链接的作品，在此时长内再次下载时直接跳过。"))
 
         logger.debug("ApiSettingsWidget UI retranslated.")
 
@@ -1012,6 +1729,7 @@ class ApiSettingsWidget(QWidget):
         self.api_table_widget.setRowCount(0) # Clear existing rows
         endpoints = self.config.get("api_endpoints", [])
         active_api_name = self.config.get("active_api_name")
+        scoreboard = EndpointScoreboard(get_user_data_path(ENDPOINT_STATS_FILE)) # Read-only view of live stats
 
         self.api_table_widget.blockSignals(True) # Block signals during population
         for row, api_data in enumerate(endpoints):
@@ -1029,6 +1747,7 @@ class ApiSettingsWidget(QWidget):
             method_item = QTableWidgetItem(api_data.get('method', 'GET'))
             active_item = QTableWidgetItem("✔" if is_active else "")
             active_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
+            stats_item = self.create_stats_item(scoreboard.get_stats(api_data.get('name', '')))
 
             # Set tooltips (e.g., show full URL)
             url_item.setToolTip(api_data.get('url', ''))
@@ -1043,6 +1762,7 @@ class ApiSettingsWidget(QWidget):
             self.api_table_widget.setItem(row, 4, param_item)
             self.api_table_widget.setItem(row, 5, method_item)
             self.api_table_widget.setItem(row, 6, active_item)
+            self.api_table_widget.setItem(row, 7, stats_item)
 
             # Style active row
             if is_active:
@@ -1059,6 +1779,20 @@ class ApiSettingsWidget(QWidget):
         self.update_button_states() # Update buttons after loading
         logger.info(f"从配置加载了 {len(endpoints)} 个 API 配置。当前活动: {active_api_name or '未设置'}")
 
+    def create_stats_item(self, stats):
+        """Creates the table item summarising an endpoint's live statistics (latency, success, 429 rate)."""
+        if not stats:
+            item = QTableWidgetItem("-")
+            item.setToolTip(self.tr("暂无统计数据"))
+            return item
+        item = QTableWidgetItem(f"{stats['latency_ewma']:.2f}s | {stats['success_ratio']:.0%}")
+        item.setToolTip(
+            self.tr("平均延迟: {0:.2f}s\n成功率: {1:.0%}\n成功但缺少数据: {2:.0%}\n429 速率限制: {3:.0%}\n调用次数: {4}").format(
+                stats['latency_ewma'], stats['success_ratio'], stats['missing_data_ratio'],
+                stats['rate_limit_ratio'], stats['calls'])
+        )
+        return item
+
     def save_api_config(self):
         """Saves the current API list (including order) and active API back to the config file."""
         endpoints = []
@@ -1222,6 +1956,65 @@ class ApiSettingsWidget(QWidget):
         else:
             logger.info(f"API '{new_active_api_name}' 已经是活动状态。")
 
+    def load_hedging_settings(self):
+        """Loads hedged request settings from the config."""
+        hedging = self.config.get("hedging", {})
+        self.hedging_checkbox.setChecked(bool(hedging.get("enabled", False)))
+        self.hedging_percentile_spinbox.setValue(int(hedging.get("percentile", 90)))
+        self.hedging_budget_spinbox.setValue(int(hedging.get("budget", 100)))
+
+    @Slot()
+    def save_hedging_settings(self):
+        """Saves hedged request settings to the config."""
+        self.config["hedging"] = self.get_hedging_settings()
+        save_config(self.config)
+        logger.info(f"保存对冲请求设置: {self.config['hedging']}")
+
+    def get_hedging_settings(self):
+        """Returns the hedged request settings as a dict (enabled, percentile, budget)."""
+        return {
+            "enabled": self.hedging_checkbox.isChecked(),
+            "percentile": self.hedging_percentile_spinbox.value(),
+            "budget": self.hedging_budget_spinbox.value()
+        }
+
+    @Slot()
+    def save_retry_settings(self):
+        """Saves the retry policy settings to the config."""
+        self.config["retry"] = self.get_retry_settings()
+        save_config(self.config)
+
+    def get_retry_settings(self):
+        """Returns the retry policy settings as a dict (max_attempts, deadline_seconds)."""
+        return {
+            "max_attempts": self.retry_attempts_spinbox.value(),
+            "deadline_seconds": self.retry_deadline_spinbox.value()
+        }
+
+    @Slot()
+    def save_stall_settings(self):
+        """Saves the stall detection settings to the config."""
+        self.config["stall"] = self.get_stall_settings()
+        save_config(self.config)
+
+    def get_stall_settings(self):
+        """Returns the stall detection settings as a dict (idle_timeout, min_kbps, window_seconds)."""
+        return {
+            "idle_timeout": self.stall_idle_spinbox.value(),
+            "min_kbps": self.stall_rate_spinbox.value(),
+            "window_seconds": self.stall_window_spinbox.value()
+        }
+
+    @Slot()
+    def save_negative_cache_ttl(self):
+        """Saves how long unavailable posts are remembered."""
+        self.config["negative_cache_ttl_hours"] = self.negative_cache_ttl_spinbox.value()
+        save_config(self.config)
+
+    def get_negative_cache_ttl_hours(self):
+        """Returns how many hours posts reported as unavailable are skipped (0 = never)."""
+        return self.negative_cache_ttl_spinbox.value()
+
     def get_api_endpoints(self):
         """Returns the list of API config dictionaries in the current display order."""
         return self.config.get("api_endpoints", [])
@@ -2534,336 +3327,701 @@ class DownloadWorker(QThread):
     # Signal: row_index, status_text, progress_percent, info_text, title_text, local_cover_path, speed_mbps
     update_progress = Signal(int, str, int, str, str, str, float)
     task_finished = Signal()
+    endpoint_event = Signal(str) # Circuit breaker trips/recoveries, shown in the status bar
 
     def __init__(self, urls, parent_path, subfolder_template, custom_text, concurrency_limit,
                  proxies=None, api_endpoints=None, # Added api_endpoints
-                 download_cover_title=False, cover_title_path=""): # Added cover/title params
+                 download_cover_title=False, cover_title_path="", # Added cover/title params
+                 hedging=None, # Hedged request settings dict (enabled, percentile, budget)
+                 retry=None, # Retry policy settings dict (max_attempts, deadline_seconds)
+                 stall=None, # Stall detection settings dict (idle_timeout, min_kbps, window_seconds)
+                 force_refresh=False, negative_cache_ttl_hours=168, # Ignore caches / how long dead posts are remembered
+                 resolve_concurrency=DEFAULT_RESOLVE_CONCURRENCY, plan_concurrency=PLAN_CONCURRENCY,
+                 finalize_concurrency=FINALIZE_CONCURRENCY, # Pipeline stage concurrency (transfer uses concurrency_limit)
+                 album_concurrency=DEFAULT_ALBUM_CONCURRENCY, image_concurrency=IMAGE_CONCURRENCY, # Album images per album / overall
+                 quality=None): # Video quality settings dict (mode, max_hd_mb), see tiktok_fetcher.QualityPolicy
         super().__init__()
         self.urls = urls
         self.parent_path = parent_path
         self.subfolder_template = subfolder_template
         self.custom_text = custom_text
-        self.concurrency_limit = concurrency_limit
+        self.concurrency_limit = concurrency_limit # Parallel transfers
+        self.resolve_concurrency = resolve_concurrency
+        self.plan_concurrency = plan_concurrency
+        self.finalize_concurrency = finalize_concurrency
+        self.album_concurrency = album_concurrency
+        self.image_concurrency = image_concurrency
         self.proxies = proxies # Store proxies
         self.api_endpoints = api_endpoints if api_endpoints else [] # Store API endpoints
         self.download_cover_title = download_cover_title
         self.cover_title_path = cover_title_path
         self.is_running = True # Flag to control thread execution
-        self.session = None # To hold the shared aiohttp session
-
-    async def process_url(self, original_url, row_index, total_urls, semaphore, session):
-        """Processes a single URL: fetches info, downloads video/album."""
-        async with semaphore: # Acquire semaphore before processing
-            if not self.is_running: # Check if stopped before starting work
-                logger.info(f"[Row {row_index}] Stop requested before processing URL.")
-                self.update_progress.emit(row_index, "已取消", 0, "用户请求停止", "", "", 0.0)
-                return
+        self.session = None # Shared aiohttp session, used by the transfer stage
+        self.client_pool = None # Shared httpx client pool for API calls (one per batch)
+        self.hedging = hedging or {}
+        retry = retry or {}
+        self.retry_policy = RetryPolicy(max_attempts=retry.get("max_attempts", RETRY_MAX_ATTEMPTS),
+                                        url_deadline=retry.get("deadline_seconds", URL_DEADLINE_SECONDS))
+        quality = quality or {}
+        self.quality_policy = QualityPolicy(mode=quality.get("mode", "hd"), max_hd_mb=quality.get("max_hd_mb", DEFAULT_MAX_HD_MB))
+        stall = stall or {}
+        self.stall_policy = StallPolicy(idle_timeout=stall.get("idle_timeout", STALL_IDLE_TIMEOUT),
+                                        min_rate_kbps=stall.get("min_kbps", STALL_MIN_RATE_KBPS),
+                                        window=stall.get("window_seconds", STALL_WINDOW))
+        self.force_refresh = force_refresh
+        self.negative_cache_ttl_hours = negative_cache_ttl_hours
+        self.hedge_policy = None # Created per batch in run_async when hedging is enabled
+        self.scoreboard = None # Live endpoint statistics, loaded and saved around each batch
+        self.circuit_breakers = None # Per-endpoint circuit breakers, created per batch in run_async
+        self.rate_limiters = None # Per-endpoint token buckets, created per batch in run_async
+        self.metadata_cache = None # Opened per batch in run_async (SQLite connections stay on the worker thread)
+        self.download_history = None # Opened per batch in run_async
+        self.content_store = None # Opened per batch in run_async
+        self.cache_hits = 0 # Metadata cache statistics of the last batch, read by the main window
+        self.cache_misses = 0
+        self.row_followers = {} # Leader row -> rows for the same post that mirror its progress
+        self.metadata_flights = SingleFlight() # Coalesces concurrent API lookups for the same post
+        self.download_flights = {} # Post key -> leader row of downloads queued or in progress
+        self.row_progress = {} # Row -> last (status, progress, info, title), to re-show it with a late cover
+        self.row_covers = {} # Row -> saved cover path
+        self.sidecar_semaphore = None # Limits cover/title side tasks, created per batch in run_async
+        self.image_semaphore = None # Limits album images across all albums, created per batch in run_async
+        self.sidecar_tasks = set() # Cover/title side tasks still running
+        self.sidecar_names = set() # Cover/title file names claimed by a side task in this batch
+
+    def emit_progress(self, row_index, status_text, progress_percent, info_text, title_text, local_cover_path, speed_mbps):
+        """
+        Emits a progress update for a row and every row coalesced into it.
+        Once a cover has been saved for the row, it is shown with every later update.
+        """
+        local_cover_path = local_cover_path or self.row_covers.get(row_index, "")
+        self.row_progress[row_index] = (status_text, progress_percent, info_text, title_text)
+        self.update_progress.emit(row_index, status_text, progress_percent, info_text, title_text, local_cover_path, speed_mbps)
+        for follower_row in self.row_followers.get(row_index, ()):
+            self.emit_progress(follower_row, status_text, progress_percent, info_text, title_text, local_cover_path, speed_mbps)
 
-            logger.info(f"--- [Row {row_index}] Processing URL: {original_url} ---")
-            self.update_progress.emit(row_index, "获取信息...", 5, "", "", "", 0.0) # Initial status
-
-            # --- Define variables for template ---
-            now = datetime.now()
-            date_str = now.strftime("%Y%m%d")
-            time_str = now.strftime("%H%M%S")
-            author_id_str = "UnknownAuthor" # Default
-            # -----------------------------------
-
-            # --- Fetch Info using tiktok_fetcher ---
-            # Pass the ordered list of endpoints and proxies
-            fetch_success, result_data = await fetch_tiktok_info(
-                original_url,
-                self.api_endpoints,
-                proxies=self.proxies,
-                session=session # Pass the shared session
-            )
-            # -------------------------------------
+    def follow_row(self, row_index, leader_row, info_text, title_text=""):
+        """
+        Makes `row_index` mirror `leader_row` from now on. If the leader already has a state (it may
+        even have finished or failed), the row shows that state at once instead of waiting for it.
+        """
+        self.row_followers.setdefault(leader_row, []).append(row_index)
+        leader_state = self.row_progress.get(leader_row)
+        if leader_state is None:
+            self.emit_progress(row_index, "等待 (合并)", 0, info_text, title_text, "", 0.0)
+            return
+        status_text, progress_percent, leader_info, leader_title = leader_state
+        self.emit_progress(row_index, status_text, progress_percent, leader_info, leader_title,
+                           self.row_covers.get(leader_row, ""), 0.0)
 
-            if not self.is_running: # Check again after potentially long fetch
-                logger.info(f"[Row {row_index}] Stop requested after fetching info.")
-                self.update_progress.emit(row_index, "已取消", 0, "用户请求停止", "", "", 0.0)
-                return
+    def on_cover_saved(self, row_index, local_cover_path):
+        """Shows a cover saved by the side task, keeping the row's current status."""
+        self.row_covers[row_index] = local_cover_path
+        status_text, progress_percent, info_text, title_text = self.row_progress.get(row_index, ("处理中", 15, "", ""))
+        self.emit_progress(row_index, status_text, progress_percent, info_text, title_text, local_cover_path, 0.0)
 
-            if not fetch_success:
-                error_msg = result_data or "获取信息失败 (未知错误)"
-                logger.error(f"[Row {row_index}] Failed to fetch info for {original_url}: {error_msg}")
-                self.update_progress.emit(row_index, "失败 (API)", 0, error_msg, "", "", 0.0) # Error in info, empty title/cover_path
-                return # Stop processing this URL
-
-            # --- Process successful fetch result ---
-            url_type = result_data.get("type")
-            item_title = result_data.get("title", "") # Get title
-            author_id = result_data.get("author_id")
-            if author_id: author_id_str = sanitize_filename(author_id) # Update for template
-            cover_url = result_data.get("cover_url") # Get cover URL
-            referer = result_data.get("referer") # Get referer if provided by API
-
-            # --- Update subfolder path with actual author_id ---
-            try:
-                subfolder_name = self.subfolder_template.format(
-                    DATE=date_str,
-                    TIME=time_str,
-                    AUTHOR_ID=author_id_str,
-                    CUSTOM_TEXT=sanitize_filename(self.custom_text) # Sanitize custom text too
-                ).replace("/", os.sep).replace("\\", os.sep) # Replace slashes with OS separator
-                # Remove potentially problematic leading/trailing separators or spaces
-                subfolder_name = subfolder_name.strip(os.sep + " ")
-                # Prevent creating folders named just "." or ".." or empty
-                if not subfolder_name or subfolder_name in [".", ".."]:
-                    logger.warning(f"[Row {row_index}] 无效的子文件夹模板结果 '{subfolder_name}'，将使用默认名称。")
-                    subfolder_name = f"{date_str}_{author_id_str}" # Fallback
-
-                save_directory = os.path.join(self.parent_path, subfolder_name)
-            except KeyError as e:
-                 logger.error(f"[Row {row_index}] 子文件夹模板 '{self.subfolder_template}' 中使用了无效变量: {e}")
-                 self.update_progress.emit(row_index, "失败 (模板错误)", 0, f"模板变量错误: {e}", item_title, "", 0.0)
-                 return
-            except Exception as e: # Catch other potential formatting errors
-                 logger.error(f"[Row {row_index}] 创建子文件夹路径时出错: {e}")
-                 self.update_progress.emit(row_index, "失败 (路径错误)", 0, f"路径创建错误: {e}", item_title, "", 0.0)
-                 return
-
-            # --- Create Save Directory (Async) ---
+    async def save_cover_and_title(self, row_index, item_title, author_id_str, cover_url, referer):
+        """
+        Side task started by the plan stage: saves the cover image and the title text file into
+        cover_title_path over the shared session. At most SIDECAR_CONCURRENCY run at a time and
+        the transfer of the post never waits for them.
+        """
+        async with self.sidecar_semaphore:
+            if not self.is_running:
+                return
             try:
-                # Use aiofiles.os.makedirs for async directory creation
-                await aiofiles.os.makedirs(save_directory, exist_ok=True)
-                logger.info(f"  [Row {row_index}] Save directory: {save_directory}")
+                await aiofiles.os.makedirs(self.cover_title_path, exist_ok=True)
             except OSError as e:
-                logger.error(f"  [Row {row_index}] Failed to create directory {save_directory}: {e}")
-                self.update_progress.emit(row_index, "失败 (目录错误)", 0, f"无法创建目录: {e}", item_title, "", 0.0)
+                logger.error(f"无法创建封面/标题目录 {self.cover_title_path}: {e}")
                 return
-            # -----------------------------------
+            filename_base = sanitize_filename(item_title) or f"tiktok_{author_id_str}_{int(time.time())}"
+            if filename_base in self.sidecar_names:
+                return # Another row of this batch already saves these files
+            self.sidecar_names.add(filename_base)
+
+            # --- Download Cover ---
+            if cover_url:
+                cover_ext = os.path.splitext(cover_url.split('?')[0])[-1] or ".jpg"
+                if len(cover_ext) > 6: cover_ext = ".jpg" # Sanity check extension
+                local_cover_path = os.path.join(self.cover_title_path, f"{filename_base}{cover_ext}")
+                if await aiofiles.os.path.exists(local_cover_path):
+                    logger.info(f"  [Row {row_index}] Cover already exists: {local_cover_path}")
+                    self.on_cover_saved(row_index, local_cover_path)
+                else:
+                    logger.info(f"  [Row {row_index}] Downloading cover to: {local_cover_path}")
+                    cover_success, cover_error = await download_file_async(
+                        cover_url, local_cover_path, referer=referer, row_index=row_index,
+                        proxies=self.proxies, session=self.session, stop_check=lambda: not self.is_running, segments=1,
+                        verify='image'
+                    )
+                    if cover_success:
+                        self.on_cover_saved(row_index, local_cover_path)
+                    else:
+                        logger.warning(f"  [Row {row_index}] Failed to download cover: {cover_error}")
+            else:
+                logger.warning(f"  [Row {row_index}] No cover URL found in API response.")
 
-            # --- Handle Cover/Title Download (if enabled) ---
-            local_cover_path = ""
-            if self.download_cover_title and self.cover_title_path:
-                # Create cover/title directory if it doesn't exist (sync is ok here, happens once)
+            # --- Save Title ---
+            if item_title:
+                title_save_path = os.path.join(self.cover_title_path, f"{filename_base}.txt")
+                if await aiofiles.os.path.exists(title_save_path):
+                    logger.info(f"  [Row {row_index}] Title file already exists: {title_save_path}")
+                    return
                 try:
-                    os.makedirs(self.cover_title_path, exist_ok=True)
-                except OSError as e:
-                    logger.error(f"无法创建封面/标题目录 {self.cover_title_path}: {e}")
-                    # Proceed without cover/title download if directory fails
-                    self.update_progress.emit(row_index, "处理中 (无封面)", 10, "无法创建封面目录", item_title, "", 0.0) # Update status
-                else:
-                    # --- Download Cover ---
-                    if cover_url:
-                        cover_filename_base = sanitize_filename(item_title) or f"tiktok_{author_id_str}_{int(time.time())}"
-                        cover_ext = os.path.splitext(cover_url.split('?')[0])[-1] or ".jpg"
-                        if len(cover_ext) > 6: cover_ext = ".jpg" # Sanity check extension
-                        cover_filename = f"{cover_filename_base}{cover_ext}"
-                        local_cover_path = os.path.join(self.cover_title_path, cover_filename)
-
-                        if not os.path.exists(local_cover_path): # Check sync before async download
-                            logger.info(f"  [Row {row_index}] Downloading cover to: {local_cover_path}")
-                            # Use SYNC download for cover for simplicity within async worker?
-                            # Or use download_file_async if preferred
-                            cover_success, cover_error = download_file_sync( # Using sync for simplicity
-                                cover_url, local_cover_path, referer=referer,
-                                row_index=row_index, proxies=self.proxies
-                            )
-                            if not cover_success:
-                                logger.warning(f"  [Row {row_index}] Failed to download cover: {cover_error}")
-                                local_cover_path = "" # Reset path if download failed
-                            else:
-                                # Emit progress update with cover path *after* successful download
-                                self.update_progress.emit(row_index, "处理中", 15, "", item_title, local_cover_path, 0.0)
-                        else:
-                            logger.info(f"  [Row {row_index}] Cover already exists: {local_cover_path}")
-                            # Emit progress update with existing cover path
-                            self.update_progress.emit(row_index, "处理中", 15, "", item_title, local_cover_path, 0.0)
+                    async with aiofiles.open(title_save_path, 'w', encoding='utf-8') as tf:
+                        await tf.write(item_title)
+                    logger.info(f"  [Row {row_index}] Title saved to: {title_save_path}")
+                except Exception as e:
+                    logger.error(f"  [Row {row_index}] Failed to save title file {title_save_path}: {e}")
+
+    def on_api_attempt(self, row_index, attempt):
+        """Shows which API attempt a row is on and how much of its time budget is left."""
+        info_text = (f"API '{attempt['api_name']}' 第 {attempt['attempt']}/{attempt['max_attempts']} 次"
+                     f" · 剩余 {attempt['remaining']:.0f} 秒")
+        if attempt.get('last_error') is not None:
+            info_text += f" · 上次: {attempt['last_error'].kind}"
+        self.emit_progress(row_index, "获取信息...", 5, info_text, "", "", 0.0)
+
+    def on_breaker_event(self, event):
+        """Turns a circuit breaker event into a status bar message."""
+        api_name = event.get('api_name')
+        messages = {
+            'tripped': f"API '{api_name}' 连续失败，已熔断 {event.get('cooldown', 0):.0f} 秒: {event.get('reason')}",
+            'reopened': f"API '{api_name}' 探测失败，继续熔断 {event.get('cooldown', 0):.0f} 秒",
+            'half_open': f"API '{api_name}' 熔断冷却结束，正在探测...",
+            'recovered': f"API '{api_name}' 已恢复",
+        }
+        message = messages.get(event.get('event'))
+        if message:
+            self.endpoint_event.emit(message)
+
+    async def run_stage(self, stage_name, handler, inbox, outbox=None, workers=1, next_workers=1):
+        """
+        Runs `workers` consumers of `inbox`, passing each job to `handler` and forwarding
+        whatever it returns (unless None) to `outbox`. A None job is the end-of-stream marker;
+        once every consumer has seen one, `next_workers` markers are sent on to `outbox`.
+        """
+        async def consume():
+            while True:
+                job = await inbox.get()
+                if job is None:
+                    return
+                try:
+                    job = await handler(job)
+                except Exception as e:
+                    logger.exception(f"[Row {job['row']}] Unexpected error in {stage_name} stage for {job['url']}: {e}")
+                    self.emit_progress(job['row'], "失败 (内部错误)", 0, str(e), "", "", 0.0)
+                    self.release_download(job)
+                    continue
+                if job is not None and outbox is not None:
+                    await outbox.put(job) # Blocks while the next stage is saturated (backpressure)
+
+        await asyncio.gather(*(consume() for _ in range(max(1, workers))))
+        logger.debug(f"Pipeline stage '{stage_name}' drained.")
+        if outbox is not None:
+            for _ in range(max(1, next_workers)):
+                await outbox.put(None)
+
+    async def resolve_stage(self, normalizer, plan_queue):
+        """
+        Stage 1: normalizes and resolves the URLs (resolve_concurrency API lookups at a time) and
+        queues successful results for planning. Runs ahead of the downloads as far as the queues allow.
+        """
+        resolved = resolve_urls(
+            self.urls,
+            self.api_endpoints,
+            concurrency=self.resolve_concurrency,
+            normalizer=normalizer,
+            client_pool=self.client_pool,
+            on_attempt=self.on_api_attempt,
+            download_history=self.download_history,
+            quality_policy=self.quality_policy,
+            proxies=self.proxies,
+            hedge_policy=self.hedge_policy,
+            scoreboard=self.scoreboard,
+            circuit_breakers=self.circuit_breakers,
+            rate_limiters=self.rate_limiters,
+            metadata_cache=self.metadata_cache,
+            single_flight=self.metadata_flights,
+            force_refresh=self.force_refresh,
+            retry_policy=self.retry_policy
+        )
+        resolved_rows = set()
+        try:
+            async for entry in resolved:
+                row_index = entry['index']
+                if not self.is_running:
+                    logger.info("Stop requested, no further URLs are resolved.")
+                    break
+                resolved_rows.add(row_index)
+                if entry['status'] == 'rejected':
+                    logger.warning(f"Skipping invalid input on row {row_index}: {entry['input']}")
+                    self.update_progress.emit(row_index, "失败 (无效链接)", 0, entry['reason'], "", "", 0.0)
+                    continue
+                if entry['status'] == 'duplicate':
+                    # Same post as another row: no second pipeline, the row mirrors that one
+                    leader_row = entry['duplicate_of']
+                    logger.info(f"Row {row_index} is the same post as row {leader_row}, mirroring it: {entry['input']}")
+                    self.follow_row(row_index, leader_row, f"与第 {leader_row + 1} 行重复")
+                    continue
+                if entry['status'] == 'downloaded':
+                    record = entry['history']
+                    logger.info(f"[Row {row_index}] Already downloaded to {record['path']}, skipping: {entry['input']}")
+                    self.emit_progress(row_index, "已跳过 (已下载)", 100, record['path'], "", "", 0.0)
+                    continue
+
+                result_data = entry['result']
+                if result_data.get("status") != "success":
+                    error_msg = result_data.get("reason") or "获取信息失败 (未知错误)"
+                    logger.error(f"[Row {row_index}] Failed to fetch info for {entry['url']}: {error_msg}")
+                    if result_data.get("known_unavailable"):
+                        self.emit_progress(row_index, "已跳过 (已知失效)", 0, error_msg, "", "", 0.0)
+                    elif result_data.get("failure_class"):
+                        self.emit_progress(row_index, "失败 (作品不可用)", 0, error_msg, "", "", 0.0)
                     else:
-                        logger.warning(f"  [Row {row_index}] No cover URL found in API response.")
-
-                    # --- Save Title ---
-                    if item_title:
-                        title_filename_base = sanitize_filename(item_title) or f"tiktok_{author_id_str}_{int(time.time())}"
-                        title_filename = f"{title_filename_base}.txt"
-                        title_save_path = os.path.join(self.cover_title_path, title_filename)
-                        if not os.path.exists(title_save_path): # Check sync before async write
-                            try:
-                                async with aiofiles.open(title_save_path, 'w', encoding='utf-8') as tf:
-                                    await tf.write(item_title)
-                                logger.info(f"  [Row {row_index}] Title saved to: {title_save_path}")
-                            except Exception as e:
-                                logger.error(f"  [Row {row_index}] Failed to save title file {title_save_path}: {e}")
-                        else:
-                             logger.info(f"  [Row {row_index}] Title file already exists: {title_save_path}")
-            # ------------------------------------------------
-
-            # --- Download Based on Type ---
-            try: # Add try block specifically around download logic
-                if url_type == "video":
-                    video_url = result_data.get("video_url")
-                    if not video_url:
-                        logger.error(f"[Row {row_index}] No video URL found in result for {original_url}")
-                        self.update_progress.emit(row_index, "失败 (无链接)", 0, "未找到视频链接", item_title, local_cover_path, 0.0)
-                        return
+                        self.emit_progress(row_index, "失败 (API)", 0, error_msg, "", "", 0.0)
+                    continue
 
-                    # --- Determine Filename ---
-                    # Use title if available and valid, otherwise fallback
-                    base_filename = sanitize_filename(item_title) or f"tiktok_{author_id_str}_{int(time.time())}"
-                    # Try to get extension from URL, default to .mp4
-                    file_ext = os.path.splitext(video_url.split('?')[0])[-1] or ".mp4"
-                    if len(file_ext) > 5: file_ext = ".mp4" # Basic sanity check for extension
-                    filename = f"{base_filename}{file_ext}"
-                    save_path = os.path.join(save_directory, filename)
-                    # ------------------------
-
-                    # Check if file exists (async)
-                    if await aiofiles.os.path.exists(save_path):
-                        logger.info(f"[Row {row_index}] Video already exists, skipping: {filename}")
-                        self.update_progress.emit(row_index, "已跳过 (已存在)", 100, "文件已存在", item_title, local_cover_path, 0.0)
-                        return
+                item_title = result_data.get("video_title") or result_data.get("album_title") or ""
+                self.emit_progress(row_index, "等待下载", 10, "信息已获取", item_title, "", 0.0)
+                await plan_queue.put({'row': row_index, 'url': entry['url'], 'result': result_data,
+                                      'item_title': item_title})
+        finally:
+            await resolved.aclose()
+            if not self.is_running: # Rows still waiting for (or in the middle of) an API lookup
+                for row_index in range(len(self.urls)):
+                    if row_index not in resolved_rows:
+                        self.update_progress.emit(row_index, "已取消", 0, "用户请求停止", "", "", 0.0)
+            for _ in range(self.plan_concurrency):
+                await plan_queue.put(None)
+
+    async def plan_item(self, job):
+        """
+        Stage 2: works out where the post goes (subfolder template, file or album folder name),
+        creates the directories, saves cover/title and joins downloads of the same post.
+        Returns the job for the transfer stage, or None if there is nothing to download.
+        """
+        row_index = job['row']
+        result_data = job['result']
+        item_title = job['item_title']
+        if not self.is_running:
+            self.emit_progress(row_index, "已取消", 0, "用户请求停止", item_title, "", 0.0)
+            return None
 
-                    # --- Perform Async Download ---
-                    logger.info(f"  [Row {row_index}] Starting async download for: {filename}")
-                    # Define progress callback function specific to this download
-                    def progress_update_handler(r_idx, downloaded, total, percent, speed):
-                        # Ensure signal is emitted only for the correct row
-                        if r_idx == row_index and self.is_running: # Check is_running flag
-                            self.update_progress.emit(r_idx, "下载中", percent, "", item_title, local_cover_path, speed)
-
-                    # Call the async download function
-                    download_success, error_msg = await download_file_async(
-                        video_url, save_path, referer=referer,
-                        progress_callback=progress_update_handler,
-                        row_index=row_index,
-                        proxies=self.proxies, # Pass proxies
-                        session=session # Pass shared session
-                    )
-                    # --------------------------
-
-                    if not self.is_running: # Check if stopped during download
-                        logger.info(f"[Row {row_index}] Stop requested during video download.")
-                        self.update_progress.emit(row_index, "已取消", 0, "用户请求停止", item_title, local_cover_path, 0.0)
-                        # Attempt to remove incomplete file
-                        if await aiofiles.os.path.exists(save_path):
-                            try: await aiofiles.os.remove(save_path); logger.info(f"  [Row {row_index}] Removed incomplete file: {save_path}")
-                            except OSError as e: logger.error(f"  [Row {row_index}] Error removing incomplete file {save_path}: {e}")
-                        return
+        # --- Define variables for template ---
+        now = datetime.now()
+        date_str = now.strftime("%Y%m%d")
+        time_str = now.strftime("%H%M%S")
+        author_id_str = "UnknownAuthor" # Default
+        # -----------------------------------
+
+        url_type = result_data.get("url_type")
+        author_id = result_data.get("video_author_id") or result_data.get("album_author_id")
+        if author_id: author_id_str = sanitize_filename(str(author_id)) # Update for template
+        cover_url = result_data.get("cover_url") # Get cover URL
+        job.update(url_type=url_type, author_id_str=author_id_str,
+                   referer=result_data.get("referer")) # Referer if provided by API
+
+        # --- Update subfolder path with actual author_id ---
+        try:
+            subfolder_name = self.subfolder_template.format(
+                DATE=date_str,
+                TIME=time_str,
+                AUTHOR_ID=author_id_str,
+                CUSTOM_TEXT=sanitize_filename(self.custom_text) # Sanitize custom text too
+            ).replace("/", os.sep).replace("\\", os.sep) # Replace slashes with OS separator
+            # Remove potentially problematic leading/trailing separators or spaces
+            subfolder_name = subfolder_name.strip(os.sep + " ")
+            # Prevent creating folders named just "." or ".." or empty
+            if not subfolder_name or subfolder_name in [".", ".."]:
+                logger.warning(f"[Row {row_index}] 无效的子文件夹模板结果 '{subfolder_name}'，将使用默认名称。")
+                subfolder_name = f"{date_str}_{author_id_str}" # Fallback
+
+            save_directory = os.path.join(self.parent_path, subfolder_name)
+        except KeyError as e:
+             logger.error(f"[Row {row_index}] 子文件夹模板 '{self.subfolder_template}' 中使用了无效变量: {e}")
+             self.emit_progress(row_index, "失败 (模板错误)", 0, f"模板变量错误: {e}", item_title, "", 0.0)
+             return None
+        except Exception as e: # Catch other potential formatting errors
+             logger.error(f"[Row {row_index}] 创建子文件夹路径时出错: {e}")
+             self.emit_progress(row_index, "失败 (路径错误)", 0, f"路径创建错误: {e}", item_title, "", 0.0)
+             return None
+        job['save_directory'] = save_directory
+
+        # --- Create Save Directory (Async) ---
+        try:
+            await aiofiles.os.makedirs(save_directory, exist_ok=True)
+            logger.info(f"  [Row {row_index}] Save directory: {save_directory}")
+        except OSError as e:
+            logger.error(f"  [Row {row_index}] Failed to create directory {save_directory}: {e}")
+            self.emit_progress(row_index, "失败 (目录错误)", 0, f"无法创建目录: {e}", item_title, "", 0.0)
+            return None
+        # -----------------------------------
+
+        # --- Cover/Title are saved by a side task; the transfer does not wait for them ---
+        if self.download_cover_title and self.cover_title_path:
+            task = asyncio.create_task(self.save_cover_and_title(row_index, item_title, author_id_str, cover_url, job['referer']))
+            self.sidecar_tasks.add(task)
+            task.add_done_callback(self.sidecar_tasks.discard)
+        # ------------------------------------------------
+
+        # --- Work out the target file / folder ---
+        if url_type == "video":
+            video_url = result_data.get("nwm_video_url")
+            if not video_url:
+                logger.error(f"[Row {row_index}] No video URL found in result for {job['url']}")
+                self.emit_progress(row_index, "失败 (无链接)", 0, "未找到视频链接", item_title, "", 0.0)
+                return None
+            # Use title if available and valid, otherwise fallback
+            base_filename = sanitize_filename(item_title) or f"tiktok_{author_id_str}_{int(time.time())}"
+            # Try to get extension from URL, default to .mp4
+            file_ext = os.path.splitext(video_url.split('?')[0])[-1] or ".mp4"
+            if len(file_ext) > 5: file_ext = ".mp4" # Basic sanity check for extension
+            filename = f"{base_filename}{file_ext}"
+            save_path = os.path.join(save_directory, filename)
+            if await aiofiles.os.path.exists(save_path):
+                logger.info(f"[Row {row_index}] Video already exists, skipping: {filename}")
+                self.emit_progress(row_index, "已跳过 (已存在)", 100, "文件已存在", item_title, "", 0.0)
+                await self.record_download(result_data, save_path) # Known from now on without an API call
+                return None
+            placement = await self.place_from_history(result_data, save_path)
+            if placement:
+                logger.info(f"[Row {row_index}] Content already on disk, created {filename} by {placement} without downloading.")
+                self.emit_progress(row_index, "已完成", 100, f"内容已存在，未重新下载 ({PLACEMENT_LABELS[placement]})",
+                                   item_title, "", 0.0)
+                return None
+            # Older cached results only carry the one URL
+            video_candidates = result_data.get("video_url_candidates") or [{'url': video_url, 'quality': 'default'}]
+            job.update(video_url=video_url, video_candidates=video_candidates, filename=filename, save_path=save_path)
+        elif url_type == "album":
+            image_urls = result_data.get("album_list", [])
+            if not image_urls:
+                logger.error(f"[Row {row_index}] No image URLs found in result for album {job['url']}")
+                self.emit_progress(row_index, "失败 (无链接)", 0, "未找到图片链接", item_title, "", 0.0)
+                return None
+            # Use title for album folder name, fallback if needed
+            album_folder_name = sanitize_filename(item_title) or f"tiktok_album_{author_id_str}_{int(time.time())}"
+            album_save_dir = os.path.join(save_directory, album_folder_name)
+            try:
+                await aiofiles.os.makedirs(album_save_dir, exist_ok=True)
+                logger.info(f"  [Row {row_index}] Album save directory: {album_save_dir}")
+            except OSError as e:
+                logger.error(f"  [Row {row_index}] Failed to create album directory {album_save_dir}: {e}")
+                self.emit_progress(row_index, "失败 (目录错误)", 0, f"无法创建图集目录: {e}", item_title, "", 0.0)
+                return None
+            job.update(image_urls=image_urls, album_folder_name=album_folder_name, album_save_dir=album_save_dir)
+        else:
+            logger.warning(f"[Row {row_index}] Unknown URL type '{url_type}' returned for {job['url']}")
+            self.emit_progress(row_index, "失败 (未知类型)", 0, f"无法处理的类型: {url_type}", "", "", 0.0)
+            return None
 
-                    # --- Final Status Update ---
-                    if download_success:
-                        final_status = "已完成"
-                        final_progress = 100
-                        final_info = error_msg or "" # Show warning if size mismatch occurred
-                        logger.info(f"[Row {row_index}] Download successful: {filename}")
-                    else:
-                        final_status = "失败 (下载)"
-                        final_progress = 0 # Or keep last known progress? Resetting to 0 for failure.
-                        final_info = error_msg or "下载失败 (未知错误)"
-                        logger.error(f"[Row {row_index}] Download failed: {filename} - {final_info}")
-
-                    self.update_progress.emit(row_index, final_status, final_progress, final_info, item_title, local_cover_path, 0.0)
-                    # -------------------------
-
-                elif url_type == "album":
-                    image_urls = result_data.get("image_urls", [])
-                    if not image_urls:
-                        logger.error(f"[Row {row_index}] No image URLs found in result for album {original_url}")
-                        self.update_progress.emit(row_index, "失败 (无链接)", 0, "未找到图片链接", item_title, local_cover_path, 0.0)
-                        return
+        # --- Coalesce with a download of the same post that is already queued or running ---
+        post_id = result_data.get("video_aweme_id") or result_data.get("album_aweme_id")
+        download_key = (url_type, str(post_id)) if post_id else (url_type, save_directory, item_title)
+        leader_row = self.download_flights.get(download_key)
+        if leader_row is not None:
+            logger.info(f"[Row {row_index}] Same post is already downloading in row {leader_row}, sharing its result.")
+            self.follow_row(row_index, leader_row, f"与第 {leader_row + 1} 行为同一作品", item_title)
+            return None
+        self.download_flights[download_key] = row_index
+        job['download_key'] = download_key
 
-                    # --- Create Album Subdirectory ---
-                    # Use title for album folder name, fallback if needed
-                    album_folder_name = sanitize_filename(item_title) or f"tiktok_album_{author_id_str}_{int(time.time())}"
-                    album_save_dir = os.path.join(save_directory, album_folder_name)
-                    try:
-                        await aiofiles.os.makedirs(album_save_dir, exist_ok=True)
-                        logger.info(f"  [Row {row_index}] Album save directory: {album_save_dir}")
-                    except OSError as e:
-                        logger.error(f"  [Row {row_index}] Failed to create album directory {album_save_dir}: {e}")
-                        self.update_progress.emit(row_index, "失败 (目录错误)", 0, f"无法创建图集目录: {e}", item_title, local_cover_path, 0.0)
-                        return
-                    # -------------------------------
-
-                    # --- Download Images Sequentially (within the async task) ---
-                    logger.info(f"  [Row {row_index}] Starting album download ({len(image_urls)} images) for: {album_folder_name}")
-                    self.update_progress.emit(row_index, "下载图集中...", 30, f"0/{len(image_urls)}", item_title, local_cover_path, 0.0) # Initial album status
-
-                    # --- This block was previously misplaced ---
-                    all_images_success = True
-                    downloaded_count = 0
-                    first_img_error = ""
-                    # -----------------------------------------
-
-                    # --- Download Images Loop (Re-indented with 4 spaces) ---
-                    for idx, img_url in enumerate(image_urls):
-                        # Check if stop requested before processing each image
-                        if not self.is_running:
-                            logger.info(f"[Row {row_index}] Stop requested during album download (image {idx+1}).")
-                            first_img_error = "用户请求停止"
-                            all_images_success = False
-                            break # Exit the image download loop
-
-                        # Calculate approximate progress within the album download phase (30% to 90%)
-                        img_progress = 30 + int((idx + 1) / len(image_urls) * 60)
-                        # Update progress for the overall album task
-                        self.update_progress.emit(row_index, "下载图集中", img_progress, f"{idx+1}/{len(image_urls)}", item_title, local_cover_path, 0.0)
-
-                        # Determine image filename and save path
-                        file_ext = os.path.splitext(img_url.split('?')[0])[-1] or ".jpg"
-                        if len(file_ext) > 5: file_ext = ".jpg" # Basic sanity check for extension
-                        img_filename = f"{idx+1:02d}{file_ext}" # Format as 01.jpg, 02.jpg, etc.
-                        img_save_path = os.path.join(album_save_dir, img_filename)
-
-                        # Check if image already exists (async)
-                        if await aiofiles.os.path.exists(img_save_path):
-                            # logger.info(f"  [Row {row_index}] Image already exists, skipping: {img_filename}") # Less verbose
-                            downloaded_count += 1
-                            continue # Skip download if exists
-
-                        # Download the image asynchronously
-                        # No specific progress callback for individual images
-                        img_success, img_error_msg = await download_file_async(
-                            img_url, img_save_path, referer=referer,
-                            row_index=row_index,
-                            proxies=self.proxies, # Pass proxies
-                            session=session # Pass shared session
-                        )
-
-                        # Handle image download result
-                        if not img_success:
-                            logger.error(f"  [Row {row_index}] Failed to download image {idx+1}: {img_filename} - {img_error_msg}")
-                            all_images_success = False
-                            # Store the first image error encountered
-                            if not first_img_error:
-                                # Try to categorize the error type for a slightly better message
-                                if "写入" in (img_error_msg or ""): img_fail_type = "写入"
-                                elif "下载" in (img_error_msg or "") or "HTTP" in (img_error_msg or "") or "连接" in (img_error_msg or "") or "超时" in (img_error_msg or ""): img_fail_type = "下载"
-                                else: img_fail_type = "处理"
-                                first_img_error = f"图片 {idx+1} 失败 ({img_fail_type}): {img_error_msg or '未知错误'}"
-                        else:
-                            downloaded_count += 1
+        self.emit_progress(row_index, "等待下载", 20, "排队中", item_title, "", 0.0)
+        return job
 
-                        # Small delay between image downloads
-                        await asyncio.sleep(DOWNLOAD_DELAY_SECONDS / 2)
-                    # --- End of Re-indented Block ---
+    async def transfer_item(self, job):
+        """
+        Stage 3: downloads the video or album images of a planned job. Always returns the job,
+        with 'final_status', 'final_progress' and 'final_info' set, for the finalize stage.
+        """
+        row_index = job['row']
+        item_title = job['item_title']
+        referer = job['referer']
+        session = self.session
+        if not self.is_running:
+            job.update(final_status="已取消", final_progress=0, final_info="用户请求停止")
+            return job
+        # Counted while downloading, shown in the row
+        job['transfer_stats'] = {'stalls': 0, 'restarts': 0, 'switches': 0, 'refreshes': 0}
+        media_urls = [job['video_url']] if job['url_type'] == "video" else job['image_urls']
+        if any(signed_url_expired(url) for url in media_urls): # Waited in the queue until the signature (nearly) ran out
+            await self.refresh_media_urls(job, "链接即将过期")
+
+        if job['url_type'] == "video":
+            # --- Perform Async Download ---
+            logger.info(f"  [Row {row_index}] Starting async download for: {job['filename']}")
+            # Define progress callback function specific to this download
+            def progress_update_handler(r_idx, downloaded, total, percent, speed):
+                # Ensure signal is emitted only for the correct row
+                if r_idx == row_index and self.is_running: # Check is_running flag
+                    self.emit_progress(r_idx, "下载中", percent, self.transfer_stats_text(job), item_title, "", speed)
+
+            job['integrity'] = {} # Hash and verdict, filled in while downloading
+            refreshed = False
+            while True:
+                if len(job['video_candidates']) > 1:
+                    self.emit_progress(row_index, "下载中", 20, "正在选择最快的线路", item_title, "", 0.0)
+                video_urls = await rank_video_urls(session, job['video_candidates'], referer=referer, proxies=self.proxies,
+                                                   row_index=row_index) or [job['video_url']]
+                job['transfer_stats'].pop('http_status', None)
+                download_success, error_msg = await download_file_async(
+                    video_urls[0], job['save_path'], referer=referer,
+                    progress_callback=progress_update_handler,
+                    row_index=row_index,
+                    proxies=self.proxies, # Pass proxies
+                    session=session, # Pass shared session
+                    stop_check=lambda: not self.is_running,
+                    verify='video',
+                    integrity=job['integrity'],
+                    content_store=self.content_store,
+                    stall_policy=self.stall_policy,
+                    transfer_stats=job['transfer_stats'],
+                    alternate_urls=video_urls[1:] # Fallbacks: other mirrors, then lower qualities
+                )
+                # Every URL refused although the API just handed them out: their signature expired.
+                # Resolve the post again (once) and continue from the bytes already received.
+                if (download_success or refreshed or not self.is_running
+                        or job['transfer_stats'].get('http_status') not in URL_EXPIRED_STATUSES):
+                    break
+                refreshed = True
+                if not await self.refresh_media_urls(job, f"链接已失效 (HTTP {job['transfer_stats']['http_status']})"):
+                    break
+            stats_text = self.transfer_stats_text(job)
+            if error_msg and stats_text:
+                error_msg = f"{error_msg} ({stats_text})"
+            if not download_success and not self.is_running: # Stopped: the .part file is kept for the next run
+                job.update(final_status="已取消", final_progress=0, final_info=error_msg)
+            elif download_success:
+                logger.info(f"[Row {row_index}] Download successful: {job['filename']}")
+                final_info = f"已校验 MP4 · SHA-256 {job['integrity']['sha256'][:12]}"
+                if job['integrity']['placement'] in PLACEMENT_LABELS: # Same bytes were already on disk
+                    final_info += f" · 与已有文件相同 ({PLACEMENT_LABELS[job['integrity']['placement']]})"
+                if stats_text:
+                    final_info += f" · {stats_text}"
+                job.update(final_status="已完成", final_progress=100, final_info=final_info)
+            elif job['integrity'] and not job['integrity']['ok']: # Truncated, HTML error page, ...
+                job.update(final_status="失败 (校验)", final_progress=0, final_info=error_msg)
+                logger.error(f"[Row {row_index}] Downloaded file failed verification: {job['filename']} - {error_msg}")
+            else:
+                job.update(final_status="失败 (下载)", final_progress=0, final_info=error_msg or "下载失败 (未知错误)")
+                logger.error(f"[Row {row_index}] Download failed: {job['filename']} - {job['final_info']}")
+            return job
+
+        # --- Album: images download in parallel (album_concurrency per album, image_concurrency overall) ---
+        image_urls = job['image_urls']
+        album_save_dir = job['album_save_dir']
+        total_images = len(image_urls)
+        logger.info(f"  [Row {row_index}] Starting album download ({total_images} images) for: {job['album_folder_name']}")
+        self.emit_progress(row_index, "下载图集中...", 30, f"0/{total_images}", item_title, "", 0.0) # Initial album status
+        album_semaphore = asyncio.Semaphore(self.album_concurrency)
+        downloaded_count = 0
+        image_errors = {} # Image number -> last error after all retries
+        job['album_verified'] = True # Until an image is kept without having been checked
+
+        async def fetch_image(idx, img_url):
+            nonlocal downloaded_count
+            # Determine image filename and save path (01.jpg, 02.jpg, ... in album order)
+            file_ext = os.path.splitext(img_url.split('?')[0])[-1] or ".jpg"
+            if len(file_ext) > 5: file_ext = ".jpg" # Basic sanity check for extension
+            img_save_path = os.path.join(album_save_dir, f"{idx+1:02d}{file_ext}")
+            async with album_semaphore, self.image_semaphore: # Always in this order
+                img_error_msg = await self.download_image(row_index, idx + 1, img_url, img_save_path, referer, job)
+            if img_error_msg:
+                image_errors[idx + 1] = img_error_msg
+                return
+            downloaded_count += 1
+            # Album download phase runs from 30% to 100% as images complete
+            img_progress = 30 + int(downloaded_count / total_images * 70)
+            self.emit_progress(row_index, "下载图集中", img_progress, f"{downloaded_count}/{total_images}", item_title, "", 0.0)
+
+        await asyncio.gather(*(fetch_image(idx, img_url) for idx, img_url in enumerate(image_urls)))
+        if image_errors and self.is_running and job.get('images_expired'):
+            # Resolve the album again (once) and fetch the refused images from their fresh URLs
+            if await self.refresh_media_urls(job, "图片链接已失效"):
+                retry_numbers = sorted(image_errors)
+                image_errors.clear()
+                await asyncio.gather(*(fetch_image(number - 1, job['image_urls'][number - 1]) for number in retry_numbers))
+
+        if not self.is_running and image_errors:
+            job.update(final_status="已取消", final_progress=0, final_info=f"用户请求停止 ({downloaded_count}/{total_images})")
+        elif image_errors:
+            first_failed = min(image_errors)
+            img_error_msg = image_errors[first_failed]
+            # Try to categorize the error type for a slightly better message
+            if "写入" in img_error_msg: img_fail_type = "写入"
+            elif "校验" in img_error_msg: img_fail_type = "校验"
+            elif "下载" in img_error_msg or "HTTP" in img_error_msg or "连接" in img_error_msg or "超时" in img_error_msg: img_fail_type = "下载"
+            else: img_fail_type = "处理"
+            # Show 100% even if partially failed, status indicates failure
+            job.update(final_status="图集部分失败", final_progress=100,
+                       final_info=f"{len(image_errors)}/{total_images} 张失败; 图片 {first_failed} 失败 ({img_fail_type}): {img_error_msg}")
+        else:
+            job.update(final_status="图集完成", final_progress=100, final_info=self.transfer_stats_text(job))
+        return job
 
-                    # Determine final status and progress after loop finishes or breaks
-                    final_album_status = "图集完成" if all_images_success else "图集部分失败"
-                    final_progress = 100 # Show 100% even if partially failed, status indicates failure
-                    # Emit final update for the album
-                    self.update_progress.emit(row_index, final_album_status, final_progress, first_img_error if not all_images_success else "", item_title, local_cover_path, 0.0)
+    async def refresh_media_urls(self, job, reason):
+        """
+        Resolves the post of a job again through the APIs, bypassing the metadata cache, because its
+        signed media URLs expired (`reason` is shown in the row). On success the job's URLs (and the
+        cache entry) are replaced so the transfer can continue, and True is returned.
+        """
+        row_index = job['row']
+        logger.info(f"[Row {row_index}] {reason}, resolving {job['url']} again for fresh media URLs.")
+        self.emit_progress(row_index, "刷新链接", 25, f"{reason}，正在重新获取", job['item_title'], "", 0.0)
+        result = await fetch_tiktok_info(job['url'], self.api_endpoints, proxies=self.proxies, client_pool=self.client_pool,
+                                         hedge_policy=self.hedge_policy, scoreboard=self.scoreboard,
+                                         circuit_breakers=self.circuit_breakers, rate_limiters=self.rate_limiters,
+                                         metadata_cache=self.metadata_cache, aweme_id=result_aweme_id(job['result']),
+                                         force_refresh=True, retry_policy=self.retry_policy)
+        if result.get('status') == 'success' and result.get('url_type') == job['url_type']:
+            if job['url_type'] == "video":
+                result = await apply_quality_policy(result, self.quality_policy, self.client_pool, self.proxies)
+                if result.get('nwm_video_url'):
+                    job.update(video_url=result['nwm_video_url'], result=result,
+                               video_candidates=result.get('video_url_candidates') or [{'url': result['nwm_video_url'], 'quality': 'default'}])
+                    job['transfer_stats']['refreshes'] += 1
+                    return True
+            elif len(result.get('album_list') or []) == len(job['image_urls']): # Same images, same numbering
+                job.update(image_urls=result['album_list'], result=result)
+                job['transfer_stats']['refreshes'] += 1
+                return True
+        logger.warning(f"[Row {row_index}] Could not refresh the media URLs of {job['url']}: {result.get('reason', 'unexpected result')}")
+        if self.metadata_cache is not None:
+            self.metadata_cache.invalidate(url=job['url'], aweme_id=result_aweme_id(job['result'])) # Never reuse the expired URLs
+        return False
+
+    @staticmethod
+    def transfer_stats_text(job):
+        """Returns e.g. '卡顿 2 次 · 重连 3 次' for the stalls, restarts, URL switches and refreshes of a job's transfer, or ''."""
+        stats = job.get('transfer_stats') or {}
+        parts = []
+        if stats.get('stalls'):
+            parts.append(f"卡顿 {stats['stalls']} 次")
+        if stats.get('restarts'):
+            parts.append(f"重连 {stats['restarts']} 次")
+        if stats.get('switches'):
+            parts.append(f"切换线路 {stats['switches']} 次")
+        if stats.get('refreshes'):
+            parts.append(f"刷新过期链接 {stats['refreshes']} 次")
+        return " · ".join(parts)
+
+    async def download_image(self, row_index, image_number, img_url, img_save_path, referer, job):
+        """
+        Downloads one album image, retrying any failure (HTTP errors and failed JPEG/WebP checks included)
+        up to IMAGE_ATTEMPTS times with a growing delay. Returns None on success (or if the image already
+        exists), otherwise the last error message. A URL refused with 403/410 is not retried: the album's
+        signed URLs have expired, which is flagged in job['images_expired'] for the caller.
+        """
+        if await aiofiles.os.path.exists(img_save_path):
+            job['album_verified'] = False # Kept from an earlier run without being checked now
+            return None # Skip download if exists
+        img_error_msg = None
+        for attempt in range(1, IMAGE_ATTEMPTS + 1):
+            if not self.is_running:
+                return img_error_msg or "用户请求停止"
+            image_stats = {}
+            img_success, img_error_msg = await download_file_async(
+                img_url, img_save_path, referer=referer,
+                row_index=row_index,
+                proxies=self.proxies, # Pass proxies
+                session=self.session, # Pass shared session
+                stop_check=lambda: not self.is_running,
+                segments=1,
+                verify='image',
+                content_store=self.content_store,
+                stall_policy=self.stall_policy,
+                transfer_stats=image_stats
+            )
+            if img_success:
+                return None
+            img_error_msg = img_error_msg or "未知错误"
+            if image_stats.get('http_status') in URL_EXPIRED_STATUSES:
+                job['images_expired'] = True # Same URL again would only be refused again
+                logger.warning(f"  [Row {row_index}] Image {image_number} refused ({img_error_msg}), its URL has probably expired.")
+                return img_error_msg
+            logger.warning(f"  [Row {row_index}] Image {image_number} attempt {attempt}/{IMAGE_ATTEMPTS} failed: {img_error_msg}")
+            if attempt < IMAGE_ATTEMPTS and self.is_running:
+                await asyncio.sleep(IMAGE_RETRY_DELAY * attempt)
+        logger.error(f"  [Row {row_index}] Failed to download image {image_number}: {img_save_path} - {img_error_msg}")
+        return img_error_msg
+
+    async def finalize_item(self, job):
+        """Stage 4: records finished posts in the download history, reports the final status and releases the post."""
+        row_index = job['row']
+        if job['final_status'] == "已完成":
+            await self.record_download(job['result'], job['save_path'], job['integrity'])
+        elif job['final_status'] == "图集完成":
+            await self.record_download(job['result'], job['album_save_dir'], verified=job['album_verified'])
+        self.emit_progress(row_index, job['final_status'], job['final_progress'], job['final_info'],
+                           job['item_title'], "", 0.0)
+        self.release_download(job)
+        return None
+
+    async def record_download(self, result_data, path, integrity=None, verified=False):
+        """
+        Adds a post to the download history: a video with the size, SHA-256 and verdict from its download
+        (`integrity`), an album folder with its total size. A video found on disk is hashed and checked here.
+        """
+        post_id = result_data.get("video_aweme_id") or result_data.get("album_aweme_id")
+        if not post_id or self.download_history is None:
+            return
+        if integrity:
+            self.download_history.add(post_id, path, integrity['size'], integrity['sha256'], verified=integrity['ok'])
+            return
 
-                else: # Ensure this else aligns with the 'if' and 'elif' above it (Handling unknown type)
-                    logger.warning(f"[Row {row_index}] Unknown URL type '{url_type}' returned for {original_url}")
-                    self.update_progress.emit(row_index, "失败 (未知类型)", 0, f"无法处理的类型: {url_type}", "", "", 0.0) # Error in info, empty title/cover_path
+        def measure():
+            if os.path.isdir(path):
+                return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file()), None, verified
+            verifier = StreamVerifier('video')
+            verifier.catch_up(path)
+            report = verifier.finish()
+            if not report['ok']:
+                logger.warning(f"Existing file {path} failed verification: {report['detail']}")
+            return report['size'], report['sha256'], report['ok']
 
-            except Exception as e: # Ensure alignment with the outer try
-                 logger.exception(f"[Row {row_index}] Unexpected error processing URL {original_url}: {e}")
-                 self.update_progress.emit(row_index, "失败 (内部错误)", 0, str(e), "", "", 0.0) # Error in info, empty title/cover_path
+        try:
+            size, sha256, verified = await asyncio.to_thread(measure)
+        except OSError as e:
+            logger.warning(f"Could not record {path} in download history: {e}")
+            return
+        self.download_history.add(post_id, path, size, sha256, verified=verified)
+        if sha256 and verified and self.content_store is not None: # Later copies of these bytes can link to it
+            self.content_store.add(sha256, path, size)
 
-            # logger.info(f"--- [Row {row_index}] Finished processing ---") # More verbose log if needed
-            # Small delay before releasing semaphore and allowing next task
-            await asyncio.sleep(REQUEST_DELAY_SECONDS)
+    async def place_from_history(self, result_data, save_path):
+        """
+        Creates `save_path` from the verified file of an earlier download of the same video (found by
+        aweme ID in the history, then by content in the content store), so nothing is transferred.
+        Returns the method used ('reflink', 'hardlink' or 'copy'), or None if the video must be downloaded.
+        """
+        post_id = result_data.get("video_aweme_id")
+        if not post_id or self.download_history is None or self.content_store is None:
+            return None
+        record = self.download_history.get(post_id)
+        if not record or not record['verified'] or not record['sha256']:
+            return None
+        placement = await asyncio.to_thread(self.content_store.materialize, record['sha256'], record['size'], save_path)
+        if placement:
+            self.download_history.add(post_id, save_path, record['size'], record['sha256'], verified=True)
+        return placement
+
+    def release_download(self, job):
+        """Lets later rows for the same post download it again (e.g. after a failure)."""
+        download_key = job.get('download_key')
+        if download_key is not None and self.download_flights.get(download_key) == job['row']:
+            del self.download_flights[download_key]
 
 
     async def run_async(self):
-        """Runs the async processing loop with concurrency."""
+        """
+        Runs the download pipeline: resolve -> plan -> transfer -> finalize. The stages are connected
+        by bounded queues and have their own concurrency, so metadata for upcoming rows is fetched
+        while earlier rows download, and a slow API never holds a download slot (or vice versa).
+        """
         logger.info("DownloadWorker run_async method started.")
         total_urls = len(self.urls)
-        logger.info(f"Worker thread processing {total_urls} URLs with concurrency limit {self.concurrency_limit}.")
+        logger.info(f"Worker thread processing {total_urls} URLs: {self.resolve_concurrency} resolving, "
+                    f"{self.concurrency_limit} downloading.")
 
         # Add rows to table first
         logger.info("Adding rows to table...")
@@ -2871,37 +4029,67 @@ class DownloadWorker(QThread):
              self.add_table_row.emit(url, i)
         logger.info("Finished adding rows to table.")
 
-        # --- Create a single aiohttp session for this worker ---
-        # Use TrustEnvironment=True to potentially pick up system proxies if manual proxy is not set
-        # connector = aiohttp.TCPConnector(ssl=False) if disable_ssl else aiohttp.TCPConnector()
-        connector = aiohttp.TCPConnector() # Default connector
-        async with aiohttp.ClientSession(connector=connector, headers=COMMON_HEADERS) as session:
-            self.session = session # Store session reference if needed for cancellation (though not strictly needed now)
-            logger.info("Created shared aiohttp ClientSession for worker.")
-
-            # --- Concurrent processing using Semaphore and gather ---
-            semaphore = asyncio.Semaphore(self.concurrency_limit)
-            tasks = []
-            logger.info("Creating concurrent tasks...")
-            for i, url in enumerate(self.urls):
-                if not self.is_running: # Check before creating task
-                    logger.info(f"Stop requested before creating task for URL {i+1}")
-                    break
-                logger.info(f"  Creating task for URL {i+1}/{total_urls}: {url}")
-                # Create a task for each URL, passing the semaphore AND the session
-                task = asyncio.create_task(self.process_url(url, i, total_urls, semaphore, session))
-                tasks.append(task)
-
-            if tasks: # Only gather if tasks were created
-                logger.info(f"Starting execution of {len(tasks)} tasks...")
-                # Wait for all tasks to complete
-                await asyncio.gather(*tasks)
-                logger.info("Worker thread finished processing all tasks.")
-            else:
-                logger.info("No tasks were created or executed (likely stopped early).")
+        if self.hedging.get("enabled"):
+            self.hedge_policy = HedgePolicy(
+                percentile=self.hedging.get("percentile", 90) / 100.0,
+                budget=self.hedging.get("budget")
+            )
+            logger.info(f"Hedged API requests enabled: {self.hedging}")
+        self.scoreboard = EndpointScoreboard(get_user_data_path(ENDPOINT_STATS_FILE))
+        self.circuit_breakers = CircuitBreakerRegistry(on_event=self.on_breaker_event)
+        self.rate_limiters = RateLimiterRegistry() # Replaces the old fixed delay between URLs
+        self.metadata_cache = MetadataCache(get_user_data_path(METADATA_CACHE_FILE),
+                                            negative_ttl=self.negative_cache_ttl_hours * 3600)
+        self.download_history = DownloadHistory(get_user_data_path(DOWNLOAD_HISTORY_DIR))
+        self.content_store = ContentStore(get_user_data_path(CONTENT_STORE_FILE))
 
-        self.session = None # Clear session reference after closing
-        logger.info("Closed shared aiohttp ClientSession.")
+        try:
+            # --- Create a single aiohttp session for this worker ---
+            # Use TrustEnvironment=True to potentially pick up system proxies if manual proxy is not set
+            # connector = aiohttp.TCPConnector(ssl=False) if disable_ssl else aiohttp.TCPConnector()
+            connector = aiohttp.TCPConnector(limit_per_host=DOWNLOAD_HOST_CONNECTIONS) # Segments share the per-host cap
+            async with aiohttp.ClientSession(connector=connector, headers=COMMON_HEADERS) as session, \
+                    HttpClientPool() as client_pool:
+                self.session = session # Shared by every transfer in this batch
+                self.client_pool = client_pool # Reused by every API call in this batch
+                self.sidecar_semaphore = asyncio.Semaphore(SIDECAR_CONCURRENCY)
+                self.image_semaphore = asyncio.Semaphore(self.image_concurrency)
+                logger.info("Created shared aiohttp ClientSession and API client pool for worker.")
+
+                # Short links are resolved, non-TikTok input rejected and duplicates dropped before any API call
+                normalizer = UrlNormalizer(client_pool, self.proxies)
+                # Resolved items waiting for a download slot; this is how far metadata is prefetched
+                plan_queue = asyncio.Queue(maxsize=self.concurrency_limit * PIPELINE_PREFETCH_FACTOR)
+                transfer_queue = asyncio.Queue(maxsize=self.concurrency_limit)
+                finalize_queue = asyncio.Queue(maxsize=self.concurrency_limit)
+                await asyncio.gather(
+                    self.resolve_stage(normalizer, plan_queue),
+                    self.run_stage("plan", self.plan_item, plan_queue, transfer_queue,
+                                   self.plan_concurrency, self.concurrency_limit),
+                    self.run_stage("transfer", self.transfer_item, transfer_queue, finalize_queue,
+                                   self.concurrency_limit, self.finalize_concurrency),
+                    self.run_stage("finalize", self.finalize_item, finalize_queue, None, self.finalize_concurrency)
+                )
+                if self.sidecar_tasks: # Covers/titles still being saved need the session
+                    await asyncio.gather(*self.sidecar_tasks, return_exceptions=True)
+                logger.info("Worker thread finished processing all rows.")
+        finally: # Also when the pipeline fails: keep the statistics and release the SQLite connections and mmap
+            self.session = None # Clear session reference after closing
+            self.client_pool = None
+            self.scoreboard.save() # Persist endpoint statistics for the next run and the API settings page
+            self.cache_hits, self.cache_misses = self.metadata_cache.hits, self.metadata_cache.misses
+            logger.info(self.metadata_cache.summary())
+            self.metadata_cache.close()
+            self.metadata_cache = None
+            logger.info(self.download_history.summary())
+            self.download_history.close()
+            self.download_history = None
+            logger.info(self.content_store.summary())
+            self.content_store.close()
+            self.content_store = None
+            if self.hedge_policy:
+                logger.info(f"Hedged requests sent: {self.hedge_policy.hedges_sent}, won: {self.hedge_policy.hedges_won}")
+            logger.info("Closed shared aiohttp ClientSession and API client pool.")
 
 
     def run(self):
@@ -3071,6 +4259,44 @@ class DownloaderWindow(QMainWindow): # Inherit from QMainWindow
         self.concurrency_spinbox.setValue(DEFAULT_CONCURRENCY)
         self.concurrency_spinbox.setToolTip(self.tr("同时下载的任务数量 (建议 3-5)")) # Wrapped
         settings_form_layout.addRow(self.concurrency_label, self.concurrency_spinbox) # Use label var
+        self.resolve_concurrency_label = QLabel(self.tr("并发解析数:"))
+        self.resolve_concurrency_spinbox = QSpinBox()
+        self.resolve_concurrency_spinbox.setRange(1, 20)
+        self.resolve_concurrency_spinbox.setValue(DEFAULT_RESOLVE_CONCURRENCY)
+        self.resolve_concurrency_spinbox.setToolTip(self.tr("同时通过 API 获取信息的链接数量，下载进行时会提前获取后续链接的信息"))
+        settings_form_layout.addRow(self.resolve_concurrency_label, self.resolve_concurrency_spinbox)
+        self.album_concurrency_label = QLabel(self.tr("图集并发图片数:"))
+        self.album_concurrency_spinbox = QSpinBox()
+        self.album_concurrency_spinbox.setRange(1, 16)
+        self.album_concurrency_spinbox.setValue(DEFAULT_ALBUM_CONCURRENCY)
+        self.album_concurrency_spinbox.setToolTip(self.tr("每个图集同时下载的图片数量，失败的图片会单独重试"))
+        settings_form_layout.addRow(self.album_concurrency_label, self.album_concurrency_spinbox)
+
+        # Video quality policy for this batch
+        self.quality_label = QLabel(self.tr("视频画质:"))
+        self.quality_combo = QComboBox()
+        self.quality_combo.addItem(self.tr("高清优先 (HD)"), "hd")
+        self.quality_combo.addItem(self.tr("标清优先 (SD, 节省流量)"), "sd")
+        self.quality_combo.addItem(self.tr("最小文件"), "smallest")
+        self.quality_combo.addItem(self.tr("高清 (仅当小于上限)"), "hd_under")
+        self.quality_combo.setToolTip(self.tr("API 返回多个清晰度时下载哪一个；其余的作为备用线路。"))
+        self.max_hd_mb_spinbox = QSpinBox()
+        self.max_hd_mb_spinbox.setRange(1, 4096)
+        self.max_hd_mb_spinbox.setValue(DEFAULT_MAX_HD_MB)
+        self.max_hd_mb_spinbox.setSuffix(" MB")
+        self.max_hd_mb_spinbox.setToolTip(self.tr("高清文件超过此大小时改为下载标清 (下载前先查询文件大小)。"))
+        self.max_hd_mb_spinbox.setEnabled(False)
+        self.quality_combo.currentIndexChanged.connect(
+            lambda: self.max_hd_mb_spinbox.setEnabled(self.quality_combo.currentData() == "hd_under"))
+        quality_hbox = QHBoxLayout()
+        quality_hbox.addWidget(self.quality_combo)
+        quality_hbox.addWidget(self.max_hd_mb_spinbox)
+        settings_form_layout.addRow(self.quality_label, quality_hbox)
+
+        # Force recheck of cached / known unavailable posts
+        self.force_recheck_checkbox = QCheckBox(self.tr("强制重新检查 (忽略缓存和已知失效链接)"))
+        self.force_recheck_checkbox.setToolTip(self.tr("本次下载不使用缓存的解析结果，重新调用 API 检查所有链接。"))
+        settings_form_layout.addRow(self.force_recheck_checkbox)
 
         # --- Status Table (on download page) ---
         self.status_label = QLabel(self.tr("下载状态:")) # Created var, Wrapped
@@ -3251,6 +4477,19 @@ class DownloaderWindow(QMainWindow): # Inherit from QMainWindow
         self.custom_text_input.setPlaceholderText(self.tr("用于 {CUSTOM_TEXT} 变量"))
         self.concurrency_label.setText(self.tr("并发下载数:"))
         self.concurrency_spinbox.setToolTip(self.tr("同时下载的任务数量 (建议 3-5)"))
+        self.resolve_concurrency_label.setText(self.tr("并发解析数:"))
+        self.resolve_concurrency_spinbox.setToolTip(self.tr("同时通过 API 获取信息的链接数量，下载进行时会提前获取后续链接的信息"))
+        self.album_concurrency_label.setText(self.tr("图集并发图片数:"))
+        self.album_concurrency_spinbox.setToolTip(self.tr("每个图集同时下载的图片数量，失败的图片会单独重试"))
+        self.quality_label.setText(self.tr("视频画质:"))
+        self.quality_combo.setItemText(0, self.tr("高清优先 (HD)"))
+        self.quality_combo.setItemText(1, self.tr("标清优先 (SD, 节省流量)"))
+        self.quality_combo.setItemText(2, self.tr("最小文件"))
+        self.quality_combo.setItemText(3, self.tr("高清 (仅当小于上限)"))
+        self.quality_combo.setToolTip(self.tr("API 返回多个清晰度时下载哪一个；其余的作为备用线路。"))
+        self.max_hd_mb_spinbox.setToolTip(self.tr("高清文件超过此大小时改为下载标清 (下载前先查询文件大小)。"))
+        self.force_recheck_checkbox.setText(self.tr("强制重新检查 (忽略缓存和已知失效链接)"))
+        self.force_recheck_checkbox.setToolTip(self.tr("本次下载不使用缓存的解析结果，重新调用 API 检查所有链接。"))
         self.status_label.setText(self.tr("下载状态:"))
         self.clear_input_button.setText(self.tr("清空")) # Retranslate clear button
         self.clear_input_button.setToolTip(self.tr("清空上方输入框中的所有链接"))
@@ -3455,11 +4694,20 @@ class DownloaderWindow(QMainWindow): # Inherit from QMainWindow
             proxies=proxies, # Pass proxies
             api_endpoints=ordered_endpoints, # Pass ordered API list
             download_cover_title=download_cover_title, # Pass cover setting
-            cover_title_path=cover_title_path # Pass cover path
+            cover_title_path=cover_title_path, # Pass cover path
+            hedging=self.api_settings_page.get_hedging_settings(),
+            retry=self.api_settings_page.get_retry_settings(),
+            stall=self.api_settings_page.get_stall_settings(),
+            force_refresh=self.force_recheck_checkbox.isChecked(),
+            negative_cache_ttl_hours=self.api_settings_page.get_negative_cache_ttl_hours(),
+            resolve_concurrency=self.resolve_concurrency_spinbox.value(),
+            album_concurrency=self.album_concurrency_spinbox.value(),
+            quality={"mode": self.quality_combo.currentData(), "max_hd_mb": self.max_hd_mb_spinbox.value()}
         )
         self.worker.add_table_row.connect(self.add_table_row_slot)
         self.worker.update_progress.connect(self.update_progress_slot)
         self.worker.task_finished.connect(self.download_finished)
+        self.worker.endpoint_event.connect(lambda message: self.statusBar().showMessage(message, 10000))
         self.worker.start()
 
     @Slot()
@@ -3478,11 +4726,15 @@ class DownloaderWindow(QMainWindow): # Inherit from QMainWindow
     def download_finished(self):
         """Called when the worker thread finishes."""
         logger.info("下载任务已完成或停止。")
-        self.statusBar().showMessage(self.tr("下载完成"), 5000) # Show "Download Complete" for 5 seconds
+        message = self.tr("下载完成")
+        if self.worker and (self.worker.cache_hits or self.worker.cache_misses):
+            message += self.tr(" (元数据缓存 命中 {0} / 未命中 {1})").format(self.worker.cache_hits, self.worker.cache_misses)
+        self.statusBar().showMessage(message, 5000) # Show "Download Complete" for 5 seconds
         self.start_button.setEnabled(True)
         self.stop_button.setEnabled(False)
         self.url_input.setReadOnly(False) # Make input editable again
         self.worker = None # Clear worker reference
+        self.api_settings_page.load_api_list() # Refresh endpoint statistics
 
     @Slot()
     def load_urls_from_file(self):
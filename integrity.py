@@ -0,0 +1,153 @@
+import hashlib
+import struct
+
+# --- Verification Configuration ---
+CATCH_UP_READ_SIZE = 1024 * 1024 # Read size when hashing bytes that were not seen while streaming
+SNIFF_SIZE = 16 # Leading bytes used to recognise the format
+MP4_REQUIRED_BOXES = (b'moov', b'mdat') # Without these an MP4 cannot be played
+VERIFY_KINDS = ('video', 'image')
+
+
+class StreamVerifier:
+    """
+    Checks a file while it is being downloaded, from the bytes passed to update() in file order.
+
+    Computes the SHA-256 incrementally (and the size) and, for `kind` 'video' or 'image', checks the structure
+    as the data goes by: MP4 files must start with 'ftyp', contain 'moov' and 'mdat', and their
+    top-level boxes must end exactly at the end of the file; JPEG files must end with the EOI
+    marker and WebP files must be as long as their RIFF header says. HTML/text bodies (error pages
+    served with status 200) and empty files always fail. Other image formats are only hashed.
+
+    Nothing is buffered beyond a box header and the last two bytes. Bytes that were not streamed in
+    order (a resumed prefix, or segments fetched in parallel) are read back with catch_up().
+    """
+
+    def __init__(self, kind=None):
+        self.kind = kind
+        self.position = 0 # Bytes seen so far, i.e. the file offset update() expects next
+        self.format = None
+        self._hash = hashlib.sha256()
+        self._head = b''
+        self._tail = b''
+        self._error = None
+        # MP4 top-level box walk
+        self._next_box = 0 # File offset of the next box header
+        self._box_header = b''
+        self._box_types = set()
+        self._first_box = None
+        self._box_to_end = False # A box with size 0 runs to the end of the file
+
+    def update(self, data):
+        """Feeds the next bytes of the file. Safe to call from a worker thread (one caller at a time)."""
+        if not data:
+            return
+        self._hash.update(data)
+        offset = self.position
+        self.position += len(data)
+        self._tail = (self._tail + data[-2:])[-2:]
+        if self.kind not in VERIFY_KINDS:
+            return
+        if self.format is None:
+            self._head += data[:SNIFF_SIZE - len(self._head)]
+            if len(self._head) < SNIFF_SIZE:
+                return # Too little to tell yet; finish() sniffs short files
+            self.format = self._sniff()
+            if self.format == 'mp4': # Walk from the start of the file, which may lie in earlier blocks
+                self._walk_boxes(self._head, 0)
+                data, offset = data[SNIFF_SIZE - offset:], SNIFF_SIZE
+        if self.format == 'mp4' and self._error is None and not self._box_to_end:
+            self._walk_boxes(data, offset)
+
+    def catch_up(self, path, upto=None):
+        """Reads `path` from the current position up to `upto` (default: the end of the file) and feeds it."""
+        with open(path, 'rb') as f:
+            f.seek(self.position)
+            while upto is None or self.position < upto:
+                size = CATCH_UP_READ_SIZE if upto is None else min(CATCH_UP_READ_SIZE, upto - self.position)
+                data = f.read(size)
+                if not data:
+                    break
+                self.update(data)
+
+    def _sniff(self):
+        head = self._head
+        if head[4:8] == b'ftyp':
+            return 'mp4'
+        if head[:3] == b'\xff\xd8\xff':
+            return 'jpeg'
+        if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+            return 'webp'
+        if head.lstrip()[:1] in (b'<', b'{'):
+            return 'text'
+        return 'unknown'
+
+    def _walk_boxes(self, data, offset):
+        end = offset + len(data)
+        while self._next_box + len(self._box_header) < end:
+            start = self._next_box + len(self._box_header) - offset
+            header_size = 16 if len(self._box_header) >= 8 and self._box_header[:4] == b'\x00\x00\x00\x01' else 8
+            self._box_header += data[start:start + header_size - len(self._box_header)]
+            if len(self._box_header) < header_size:
+                return # Header continues in the next block
+            size, box_type = struct.unpack('>I4s', self._box_header[:8])
+            if size == 1:
+                if header_size == 8:
+                    continue # 64-bit size follows
+                size = struct.unpack('>Q', self._box_header[8:16])[0]
+            if not all(32 <= byte < 127 for byte in box_type):
+                self._error = f"MP4 结构损坏 (偏移 {self._next_box} 处的数据不是有效的 box)"
+                return
+            if self._first_box is None:
+                self._first_box = box_type
+            self._box_types.add(box_type)
+            if size == 0:
+                self._box_to_end = True
+                return
+            if size < header_size:
+                self._error = f"MP4 结构损坏 (box '{box_type.decode()}' 的大小无效)"
+                return
+            self._next_box += size
+            self._box_header = b''
+
+    def finish(self, expected_size=None):
+        """
+        Returns the verdict for everything fed so far:
+        {'sha256', 'size', 'format', 'ok', 'detail'}, where 'detail' explains a failed check.
+        """
+        if self.format is None and self._head:
+            self.format = self._sniff()
+        detail = self._problem(expected_size)
+        return {'sha256': self._hash.hexdigest(), 'size': self.position, 'format': self.format,
+                'ok': detail is None, 'detail': detail}
+
+    def _problem(self, expected_size):
+        if expected_size and self.position != expected_size:
+            return f"文件大小不匹配. 预期: {expected_size}, 实际: {self.position}"
+        if self.kind not in VERIFY_KINDS:
+            return None
+        if self.position == 0:
+            return "文件为空"
+        if self.format == 'text':
+            return "服务器返回的是网页/文本，不是媒体文件"
+        if self.kind == 'video' and self.format != 'mp4':
+            return "不是有效的 MP4 视频"
+        if self.format == 'mp4':
+            if self._error:
+                return self._error
+            if self._first_box != b'ftyp':
+                return "MP4 缺少 ftyp 头"
+            missing = [box.decode() for box in MP4_REQUIRED_BOXES if box not in self._box_types]
+            if missing:
+                return f"MP4 缺少 {'/'.join(missing)} (文件不完整或已损坏)"
+            if not self._box_to_end and self._next_box > self.position:
+                return f"MP4 数据被截断 (缺少 {self._next_box - self.position} 字节)"
+            if not self._box_to_end and (self._next_box < self.position or self._box_header):
+                return "MP4 末尾有不完整的数据"
+        elif self.format == 'jpeg':
+            if self._tail != b'\xff\xd9':
+                return "JPEG 数据被截断 (缺少结束标记)"
+        elif self.format == 'webp':
+            riff_size = struct.unpack('<I', self._head[4:8])[0]
+            if riff_size + 8 != self.position:
+                return f"WebP 数据不完整 (预期 {riff_size + 8} 字节, 实际 {self.position})"
+        return None
@@ -0,0 +1,285 @@
+import logging
+import os
+import time
+import json
+import sqlite3
+from urllib.parse import urlsplit, urlunsplit, parse_qs
+
+# --- Cache Configuration ---
+METADATA_CACHE_TTL = 24 * 3600 # Seconds a resolved result is reused
+METADATA_CACHE_MAX_ENTRIES = 5000 # Least recently used entries beyond this are evicted
+NEGATIVE_CACHE_TTL = 7 * 24 * 3600 # Seconds a post that every API reported as gone is skipped
+SIGNED_URL_SAFETY_MARGIN = 300 # Treat signed CDN URLs as expired this many seconds early
+SIGNED_URL_EXPIRY_PARAMS = ('x-expires', 'expires', 'expire', 'x-signature-expires') # Unix timestamps in CDN query strings
+UNCACHED_RESULT_KEYS = ('rate_limit',) # Per-response details that must not be replayed from the cache
+
+
+def canonical_url(url):
+    """
+    Returns a canonical form of a TikTok URL for use as a cache key:
+    lower-case scheme/host, no query string, fragment or trailing slash.
+    """
+    if not url:
+        return ''
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    path = parts.path.rstrip('/')
+    return urlunsplit(((parts.scheme or 'https').lower(), host, path, '', ''))
+
+
+def _url_expiry(url):
+    """Returns the expiry timestamp encoded in a signed CDN URL, or None."""
+    if not isinstance(url, str):
+        return None
+    query = parse_qs(urlsplit(url).query)
+    for param in SIGNED_URL_EXPIRY_PARAMS:
+        for value in query.get(param, []):
+            try:
+                return float(value)
+            except ValueError:
+                continue
+    return None
+
+
+def signed_url_expired(url, margin=SIGNED_URL_SAFETY_MARGIN):
+    """True if `url` is a signed CDN URL whose expiry is less than `margin` seconds away (or past)."""
+    expiry = _url_expiry(url)
+    return expiry is not None and expiry - margin <= time.time()
+
+
+def signed_url_expiry(result):
+    """
+    Returns the earliest expiry timestamp among the media URLs of a fetcher result
+    (video URL candidates, album images and cover), or None if none of them is signed with an expiry.
+    """
+    urls = [result.get('nwm_video_url'), result.get('cover_url')]
+    urls.extend(candidate.get('url') for candidate in result.get('video_url_candidates') or [])
+    urls.extend(result.get('album_list') or [])
+    expiries = [expiry for expiry in (_url_expiry(url) for url in urls) if expiry is not None]
+    return min(expiries) if expiries else None
+
+
+def result_aweme_id(result):
+    """Returns the aweme ID of a fetcher result as a string, or None."""
+    aweme_id = result.get('video_aweme_id') or result.get('album_aweme_id')
+    return str(aweme_id) if aweme_id else None
+
+
+class MetadataCache:
+    """
+    SQLite-backed cache of successful fetch_tiktok_info results.
+
+    Results are stored once per aweme ID; every URL that resolved to it (canonicalised)
+    points at that entry. An entry expires after `ttl` seconds or when the first signed
+    CDN URL in it expires, whichever comes first. Beyond `max_entries`, the least recently
+    used entries are evicted. Hit/miss counts are kept per instance (i.e. per run).
+
+    A hit does not write to the database: access times are collected in memory and written
+    in one transaction before an eviction and on close(). The eviction scan only runs once the
+    entry count (tracked per instance, counting a replaced entry as new) exceeds `max_entries`.
+
+    Posts that failed permanently on every endpoint (deleted, private, region-locked, no
+    media URL) are remembered separately for `negative_ttl` seconds, keyed by aweme ID or
+    canonical URL, so later runs can skip them without an API call.
+    """
+
+    def __init__(self, path, ttl=METADATA_CACHE_TTL, max_entries=METADATA_CACHE_MAX_ENTRIES,
+                 negative_ttl=NEGATIVE_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self._conn = None
+        self._accessed = {} # aweme ID -> last access time not yet written
+        self._count = 0 # Upper bound of the entries in the table (see put())
+        try:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(path)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS metadata ("
+                " aweme_id TEXT PRIMARY KEY, result TEXT NOT NULL,"
+                " created_at REAL NOT NULL, expires_at REAL NOT NULL, last_access REAL NOT NULL)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS url_index (url TEXT PRIMARY KEY, aweme_id TEXT NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS metadata_last_access ON metadata (last_access)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS unavailable ("
+                " key TEXT PRIMARY KEY, failure_class TEXT NOT NULL, reason TEXT,"
+                " created_at REAL NOT NULL, expires_at REAL NOT NULL)")
+            self._conn.commit()
+            self._count = self._conn.execute("SELECT COUNT(*) FROM metadata").fetchone()[0]
+        except sqlite3.Error as e:
+            logging.error(f"Could not open metadata cache {path}, caching disabled: {e}")
+            self._conn = None
+
+    def get(self, url=None, aweme_id=None):
+        """
+        Returns a cached result for `aweme_id` or for the canonical form of `url`, or None.
+        Expired entries are deleted on lookup.
+        """
+        if self._conn is None:
+            return None
+        try:
+            if not aweme_id and url:
+                row = self._conn.execute("SELECT aweme_id FROM url_index WHERE url = ?", (canonical_url(url),)).fetchone()
+                aweme_id = row[0] if row else None
+            row = None
+            if aweme_id:
+                row = self._conn.execute("SELECT result, expires_at FROM metadata WHERE aweme_id = ?",
+                                         (str(aweme_id),)).fetchone()
+            now = time.time()
+            if row and row[1] > now:
+                self._accessed[str(aweme_id)] = now # Written with the next eviction or on close
+                self.hits += 1
+                result = json.loads(row[0])
+                if url:
+                    result['original_url'] = url
+                return result
+            if row:
+                self._delete(str(aweme_id))
+                logging.debug(f"Metadata cache entry for {aweme_id} expired.")
+        except (sqlite3.Error, ValueError) as e:
+            logging.error(f"Metadata cache lookup failed for {url or aweme_id}: {e}")
+        self.misses += 1
+        return None
+
+    def put(self, url, result):
+        """Stores a successful result under its aweme ID and the canonical form of `url`."""
+        if self._conn is None or result.get('status') != 'success':
+            return
+        aweme_id = result_aweme_id(result)
+        if not aweme_id:
+            return # Without a stable ID the entry could never be shared between URLs
+        now = time.time()
+        expires_at = now + self.ttl
+        signed_expiry = signed_url_expiry(result)
+        if signed_expiry is not None:
+            expires_at = min(expires_at, signed_expiry - SIGNED_URL_SAFETY_MARGIN)
+        if expires_at <= now:
+            return # Media URLs are about to expire, caching them would only cause failed downloads
+        stored = {key: value for key, value in result.items() if key not in UNCACHED_RESULT_KEYS}
+        try:
+            # The post resolved again, so it is no longer unavailable
+            self._conn.execute("DELETE FROM unavailable WHERE key IN (?, ?, ?)",
+                               (f"id:{aweme_id}", f"url:{canonical_url(url)}", f"url:{canonical_url(result.get('original_url'))}"))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO metadata (aweme_id, result, created_at, expires_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?)", (aweme_id, json.dumps(stored, ensure_ascii=False), now, expires_at, now))
+            for key_url in {canonical_url(url), canonical_url(result.get('original_url'))}:
+                if key_url:
+                    self._conn.execute("INSERT OR REPLACE INTO url_index (url, aweme_id) VALUES (?, ?)", (key_url, aweme_id))
+            self._accessed.pop(aweme_id, None)
+            self._count += 1
+            if self._count > self.max_entries:
+                self._evict()
+            self._conn.commit()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logging.error(f"Could not store metadata for {aweme_id} in cache: {e}")
+
+    @staticmethod
+    def _negative_keys(url, aweme_id):
+        keys = []
+        if aweme_id:
+            keys.append(f"id:{aweme_id}")
+        if url:
+            keys.append(f"url:{canonical_url(url)}")
+        return keys
+
+    def get_unavailable(self, url=None, aweme_id=None):
+        """
+        Returns {'failure_class', 'reason', 'created_at'} if the post is remembered as unavailable, else None.
+        """
+        if self._conn is None:
+            return None
+        keys = self._negative_keys(url, aweme_id)
+        if not keys:
+            return None
+        try:
+            row = self._conn.execute(
+                f"SELECT failure_class, reason, created_at FROM unavailable WHERE key IN ({', '.join('?' * len(keys))})"
+                " AND expires_at > ? LIMIT 1", (*keys, time.time())).fetchone()
+        except sqlite3.Error as e:
+            logging.error(f"Negative cache lookup failed for {url or aweme_id}: {e}")
+            return None
+        if row is None:
+            return None
+        self.negative_hits += 1
+        return {'failure_class': row[0], 'reason': row[1], 'created_at': row[2]}
+
+    def put_unavailable(self, url, aweme_id, failure_class, reason=None):
+        """Remembers a post as permanently unavailable for `negative_ttl` seconds."""
+        if self._conn is None or self.negative_ttl <= 0:
+            return
+        now = time.time()
+        try:
+            for key in self._negative_keys(url, aweme_id):
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO unavailable (key, failure_class, reason, created_at, expires_at)"
+                    " VALUES (?, ?, ?, ?, ?)", (key, failure_class, reason, now, now + self.negative_ttl))
+            self._conn.execute("DELETE FROM unavailable WHERE expires_at <= ?", (now,))
+            self._conn.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Could not store unavailable post {url or aweme_id} in cache: {e}")
+
+    def invalidate(self, url=None, aweme_id=None):
+        """Removes the entry for `aweme_id` or for the aweme ID `url` resolved to."""
+        if self._conn is None:
+            return
+        try:
+            if not aweme_id and url:
+                row = self._conn.execute("SELECT aweme_id FROM url_index WHERE url = ?", (canonical_url(url),)).fetchone()
+                aweme_id = row[0] if row else None
+            if aweme_id:
+                self._delete(str(aweme_id))
+        except sqlite3.Error as e:
+            logging.error(f"Metadata cache invalidation failed for {url or aweme_id}: {e}")
+
+    def _delete(self, aweme_id):
+        self._accessed.pop(aweme_id, None)
+        self._conn.execute("DELETE FROM metadata WHERE aweme_id = ?", (aweme_id,))
+        self._conn.execute("DELETE FROM url_index WHERE aweme_id = ?", (aweme_id,))
+        self._conn.commit()
+
+    def _write_access_times(self):
+        """Writes the access times collected by get() (the caller commits)."""
+        if self._accessed:
+            self._conn.executemany("UPDATE metadata SET last_access = ? WHERE aweme_id = ?",
+                                   [(accessed_at, aweme_id) for aweme_id, accessed_at in self._accessed.items()])
+            self._accessed.clear()
+
+    def _evict(self):
+        """Drops expired entries, then the least recently used ones beyond max_entries."""
+        self._write_access_times() # The LRU order needs the hits of this run
+        self._conn.execute("DELETE FROM metadata WHERE expires_at <= ?", (time.time(),))
+        count = self._conn.execute("SELECT COUNT(*) FROM metadata").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM metadata WHERE aweme_id IN (SELECT aweme_id FROM metadata ORDER BY last_access LIMIT ?)",
+                (count - self.max_entries,))
+            count = self.max_entries
+        self._conn.execute("DELETE FROM url_index WHERE aweme_id NOT IN (SELECT aweme_id FROM metadata)")
+        self._count = count
+
+    def summary(self):
+        """Returns a one-line hit/miss summary for this run."""
+        total = self.hits + self.misses
+        ratio = self.hits / total if total else 0.0
+        return (f"metadata cache hits: {self.hits}, misses: {self.misses} ({ratio:.0%} hit rate), "
+                f"known unavailable skipped: {self.negative_hits}")
+
+    def close(self):
+        if self._conn is not None:
+            try:
+                self._write_access_times()
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logging.error(f"Could not save metadata cache access times: {e}")
+            self._conn.close()
+            self._conn = None
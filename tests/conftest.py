@@ -0,0 +1,33 @@
+import os
+import sys
+
+import httpx
+import pytest
+
+# The modules live flat in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class MockClientPool:
+    """Stands in for tiktok_fetcher.HttpClientPool: every API host is served by `handler` (httpx.MockTransport)."""
+
+    def __init__(self, handler):
+        self.requests = []
+
+        async def record(request):
+            self.requests.append(request)
+            return await handler(request)
+
+        self._client = httpx.AsyncClient(transport=httpx.MockTransport(record))
+
+    def get_client(self, url, proxies=None):
+        return self._client
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+@pytest.fixture
+def mock_pool():
+    """Returns a factory for MockClientPool; `handler` is an async function from httpx.Request to httpx.Response."""
+    return MockClientPool
@@ -0,0 +1,87 @@
+import asyncio
+
+import httpx
+
+from tiktok_fetcher import CircuitBreaker, CircuitBreakerRegistry, RetryPolicy, fetch_tiktok_info
+
+API = {'name': 'Mock API', 'url': 'https://api.example/info'}
+POST_URL = "https://www.tiktok.com/@a/video/7234567890123456789"
+VIDEO = {'data': {'id': '7234567890123456789', 'play': 'https://cdn.example/v.mp4'}}
+
+
+def test_breaker_opens_and_recovers_through_a_half_open_probe(mock_pool):
+    status = {'code': 500}
+    events = []
+
+    async def handler(request):
+        if status['code'] == 200:
+            return httpx.Response(200, json=VIDEO)
+        return httpx.Response(status['code'], json={'message': 'upstream error'})
+
+    async def run():
+        pool = mock_pool(handler)
+        breakers = CircuitBreakerRegistry(failure_threshold=2, cooldown=0.1,
+                                          on_event=lambda event: events.append(event['event']))
+        breaker = breakers.get(API['name'])
+
+        async def fetch():
+            return await fetch_tiktok_info(POST_URL, [API], client_pool=pool, circuit_breakers=breakers,
+                                           retry_policy=RetryPolicy(max_attempts=1))
+
+        try:
+            await fetch()
+            assert breaker.state == CircuitBreaker.CLOSED
+            await fetch()
+            assert breaker.state == CircuitBreaker.OPEN
+            assert len(pool.requests) == 2
+
+            # Open: skipped without a request
+            result = await fetch()
+            assert '已熔断' in result['reason']
+            assert len(pool.requests) == 2
+
+            # Cool-down over: one probe, which fails and reopens the breaker
+            await asyncio.sleep(0.15)
+            await fetch()
+            assert len(pool.requests) == 3
+            assert breaker.state == CircuitBreaker.OPEN
+
+            # Next probe succeeds and closes it
+            await asyncio.sleep(0.15)
+            status['code'] = 200
+            result = await fetch()
+            assert result['status'] == 'success'
+            assert breaker.state == CircuitBreaker.CLOSED
+        finally:
+            await pool.aclose()
+
+    asyncio.run(run())
+    assert events == ['tripped', 'half_open', 'reopened', 'half_open', 'recovered']
+
+
+def test_half_open_breaker_lets_one_probe_through():
+    breaker = CircuitBreaker('Mock API', failure_threshold=1, cooldown=0)
+    breaker.record_failure('server')
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.allow_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow_request()
+    breaker.release_probe() # e.g. the probe was cancelled by a hedge
+    assert breaker.allow_request()
+
+
+def test_answers_from_a_live_provider_do_not_trip(mock_pool):
+    async def handler(request):
+        return httpx.Response(404, json={'message': 'Not Found'})
+
+    async def run():
+        pool = mock_pool(handler)
+        breakers = CircuitBreakerRegistry(failure_threshold=1)
+        try:
+            for _ in range(3):
+                await fetch_tiktok_info(POST_URL, [API], client_pool=pool, circuit_breakers=breakers)
+            return breakers.get(API['name']).state, len(pool.requests)
+        finally:
+            await pool.aclose()
+
+    assert asyncio.run(run()) == (CircuitBreaker.CLOSED, 3)
@@ -0,0 +1,74 @@
+import hashlib
+import os
+
+from content_store import ContentStore
+
+
+def write(path, data):
+    path.write_bytes(data)
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_store(tmp_path):
+    return ContentStore(str(tmp_path / "store.db"))
+
+
+def test_identical_download_is_linked_to_stored_file(tmp_path):
+    store = make_store(tmp_path)
+    data = os.urandom(4096)
+    sha256 = write(tmp_path / "a.part", data)
+    assert store.place(str(tmp_path / "a.part"), str(tmp_path / "a.mp4"), sha256, len(data)) == 'new'
+    write(tmp_path / "b.part", data)
+    assert store.place(str(tmp_path / "b.part"), str(tmp_path / "b.mp4"), sha256, len(data)) in ('reflink', 'hardlink')
+    assert not (tmp_path / "b.part").exists()
+    assert (tmp_path / "b.mp4").read_bytes() == data
+    assert store.bytes_saved == len(data)
+    store.close()
+
+
+def test_download_is_kept_when_stored_file_was_edited_in_place(tmp_path):
+    store = make_store(tmp_path)
+    data = os.urandom(4096)
+    sha256 = write(tmp_path / "a.part", data)
+    store.place(str(tmp_path / "a.part"), str(tmp_path / "a.mp4"), sha256, len(data))
+    with open(tmp_path / "a.mp4", 'r+b') as f: # Same size, different bytes
+        f.write(b'edited')
+    stat = os.stat(tmp_path / "a.mp4")
+    os.utime(tmp_path / "a.mp4", ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    write(tmp_path / "b.part", data)
+    assert store.place(str(tmp_path / "b.part"), str(tmp_path / "b.mp4"), sha256, len(data)) == 'new'
+    assert (tmp_path / "b.mp4").read_bytes() == data
+    assert store.bytes_saved == 0
+    store.close()
+
+
+def test_download_is_kept_when_stored_file_was_replaced(tmp_path):
+    store = make_store(tmp_path)
+    data = os.urandom(4096)
+    sha256 = write(tmp_path / "a.part", data)
+    store.place(str(tmp_path / "a.part"), str(tmp_path / "a.mp4"), sha256, len(data))
+    stat = os.stat(tmp_path / "a.mp4")
+    write(tmp_path / "other.mp4", os.urandom(len(data))) # Different file of the same size and time
+    os.utime(tmp_path / "other.mp4", ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(tmp_path / "other.mp4", tmp_path / "a.mp4")
+
+    assert store.materialize(sha256, len(data), str(tmp_path / "c.mp4")) is None
+    assert not (tmp_path / "c.mp4").exists()
+    write(tmp_path / "b.part", data)
+    assert store.place(str(tmp_path / "b.part"), str(tmp_path / "b.mp4"), sha256, len(data)) == 'new'
+    assert (tmp_path / "b.mp4").read_bytes() == data
+    store.close()
+
+
+def test_materialize_from_stored_content(tmp_path):
+    store = make_store(tmp_path)
+    data = os.urandom(4096)
+    sha256 = write(tmp_path / "a.part", data)
+    store.place(str(tmp_path / "a.part"), str(tmp_path / "a.mp4"), sha256, len(data))
+    assert store.materialize(sha256, len(data), str(tmp_path / "c.mp4")) is not None
+    assert (tmp_path / "c.mp4").read_bytes() == data
+    os.remove(tmp_path / "a.mp4")
+    os.remove(tmp_path / "c.mp4")
+    assert store.materialize(sha256, len(data), str(tmp_path / "d.mp4")) is None
+    store.close()
@@ -0,0 +1,83 @@
+import os
+import struct
+import sys
+
+import download_history
+from download_history import DownloadHistory, WAL_FILE, WAL_RECORD
+
+
+def test_compaction_round_trip_with_duplicate_ids(tmp_path):
+    history = DownloadHistory(str(tmp_path), compact_threshold=1000)
+    for aweme_id in (30, 10, 50, 20):
+        history.add(aweme_id, f"first_{aweme_id}.mp4", aweme_id)
+    history.compact()
+    # Replace IDs already in the table (first, middle, last), one twice, and add new ones around them
+    history.add(10, "second_10.mp4", 11)
+    history.add(50, "second_50.mp4", 51)
+    history.add(30, "second_30.mp4", 31)
+    history.add(30, "third_30.mp4", 32, sha256="ab" * 32, verified=True)
+    history.add(5, "first_5.mp4", 5)
+    history.add(40, "first_40.mp4", 40)
+    history.add(60, "first_60.mp4", 60)
+    assert len(history) == 7
+    history.compact()
+    history.close()
+
+    history = DownloadHistory(str(tmp_path))
+    assert len(history) == 7
+    assert os.path.getsize(tmp_path / WAL_FILE) == 0
+    assert list(history._ids) == [5, 10, 20, 30, 40, 50, 60]
+    expected = {5: ("first_5.mp4", 5), 10: ("second_10.mp4", 11), 20: ("first_20.mp4", 20),
+                30: ("third_30.mp4", 32), 40: ("first_40.mp4", 40), 50: ("second_50.mp4", 51), 60: ("first_60.mp4", 60)}
+    for aweme_id, (name, size) in expected.items():
+        entry = history.get(str(aweme_id))
+        assert os.path.basename(entry['path']) == name
+        assert entry['size'] == size
+    assert history.get(30)['sha256'] == "ab" * 32 and history.get(30)['verified']
+    assert history.get(20)['sha256'] is None and not history.get(20)['verified']
+    for missing in (1, 15, 70, "not-an-id"):
+        assert missing not in history
+        assert history.get(missing) is None
+    history.close()
+
+
+def test_compaction_is_triggered_by_the_threshold(tmp_path):
+    history = DownloadHistory(str(tmp_path), compact_threshold=3)
+    for aweme_id in (3, 1, 2):
+        history.add(aweme_id, f"{aweme_id}.mp4", 1)
+    assert history._count == 3 and not history._wal
+    history.add(2, "again.mp4", 2) # Replaces an entry of the table from the log
+    assert len(history) == 3
+    assert os.path.basename(history.get(2)['path']) == "again.mp4"
+    history.close()
+
+
+def test_torn_wal_record_is_dropped_on_open(tmp_path):
+    history = DownloadHistory(str(tmp_path))
+    history.add(111, "a.mp4", 1)
+    history.add(222, "b.mp4", 2)
+    history.close()
+    with open(tmp_path / WAL_FILE, 'ab') as wal:
+        wal.write(WAL_RECORD.pack(333, 0)[:5]) # Interrupted while writing the third record
+
+    history = DownloadHistory(str(tmp_path))
+    assert len(history) == 2
+    assert 333 not in history
+    assert os.path.basename(history.get(222)['path']) == "b.mp4"
+    assert os.path.getsize(tmp_path / WAL_FILE) == 2 * WAL_RECORD.size
+    history.add(333, "c.mp4", 3) # The log stays aligned for new records
+    history.close()
+
+    history = DownloadHistory(str(tmp_path))
+    assert os.path.basename(history.get(333)['path']) == "c.mp4"
+    history.close()
+
+
+def test_id_table_is_little_endian_on_any_host(monkeypatch):
+    on_disk = struct.pack('<3Q', 1, 2 ** 40, 2 ** 64 - 1)
+    for byteorder in ('little', 'big'):
+        monkeypatch.setattr(sys, 'byteorder', byteorder)
+        values = download_history._native_u64(on_disk)
+        assert download_history._little_endian_bytes(values) == on_disk
+    monkeypatch.undo()
+    assert list(download_history._native_u64(on_disk)) == [1, 2 ** 40, 2 ** 64 - 1]
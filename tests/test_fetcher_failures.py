@@ -0,0 +1,82 @@
+import asyncio
+
+import httpx
+
+from tiktok_fetcher import call_external_tiktok_api, fetch_tiktok_info
+from metadata_cache import MetadataCache
+
+API = {'name': 'Mock API', 'url': 'https://api.example/info'}
+POST_URL = "https://www.tiktok.com/@a/video/7234567890123456789"
+
+
+def answer(status, payload):
+    async def handler(request):
+        return httpx.Response(status, json=payload)
+    return handler
+
+
+def classify(mock_pool, status, payload):
+    async def run():
+        pool = mock_pool(answer(status, payload))
+        try:
+            return await call_external_tiktok_api(API, POST_URL, client_pool=pool)
+        finally:
+            await pool.aclose()
+    return asyncio.run(run())
+
+
+def test_video_payload_is_parsed(mock_pool):
+    result = classify(mock_pool, 200, {'data': {'id': '7234567890123456789', 'title': 't',
+                                                'play': 'https://cdn.example/v.mp4', 'hdplay': 'https://cdn.example/hd.mp4'}})
+    assert result['status'] == 'success' and result['url_type'] == 'video'
+    assert result['video_aweme_id'] == '7234567890123456789'
+    assert result['nwm_video_url'] == 'https://cdn.example/hd.mp4'
+
+
+def test_post_without_media_is_no_media(mock_pool):
+    result = classify(mock_pool, 200, {'data': {'id': '7234567890123456789', 'title': 'only text'}})
+    assert result['status'] == 'failed'
+    assert result['failure_class'] == 'no_media'
+
+
+def test_provider_error_envelopes_are_not_permanent(mock_pool):
+    for payload in ({'code': -1, 'msg': 'Url parsing failed, please retry'},
+                    {'message': 'You have exceeded the DAILY quota for requests on your current plan'},
+                    {'message': 'Invalid API key. Go to https://docs.rapidapi.com for more info.'},
+                    {'code': -1, 'msg': 'API key not found'}):
+        result = classify(mock_pool, 200, payload)
+        assert result['status'] == 'failed'
+        assert result['failure_class'] is None, payload
+
+
+def test_message_saying_the_post_is_gone_is_unavailable(mock_pool):
+    result = classify(mock_pool, 200, {'code': -1, 'msg': 'This video is private or has been removed'})
+    assert result['failure_class'] == 'unavailable'
+    result = classify(mock_pool, 404, {'message': 'Video not found'})
+    assert result['failure_class'] == 'unavailable'
+
+
+def test_bare_404_is_not_permanent(mock_pool):
+    for payload in ({'message': "Endpoint '/info' does not exist"}, {'message': 'Not Found'}):
+        result = classify(mock_pool, 404, payload)
+        assert result['error_kind'] == 'http'
+        assert result['failure_class'] is None
+
+
+def test_only_permanent_failures_are_negative_cached(mock_pool, tmp_path):
+    async def run(payload):
+        cache = MetadataCache(str(tmp_path / "cache.db"))
+        pool = mock_pool(answer(200, payload))
+        try:
+            result = await fetch_tiktok_info(POST_URL, [API], client_pool=pool, metadata_cache=cache)
+            return result, cache.get_unavailable(url=POST_URL)
+        finally:
+            await pool.aclose()
+            cache.close()
+
+    result, remembered = asyncio.run(run({'code': -1, 'msg': 'quota exceeded, try again later'}))
+    assert result['status'] == 'failed' and 'failure_class' not in result
+    assert remembered is None
+    result, remembered = asyncio.run(run({'data': {'id': '7234567890123456789'}}))
+    assert result['failure_class'] == 'no_media'
+    assert remembered['failure_class'] == 'no_media'
@@ -0,0 +1,75 @@
+import asyncio
+import time
+
+import httpx
+
+from tiktok_fetcher import HedgePolicy, fetch_tiktok_info
+
+SLOW = {'name': 'Slow API', 'url': 'https://slow.example/info'}
+FAST = {'name': 'Fast API', 'url': 'https://fast.example/info'}
+POST_URL = "https://www.tiktok.com/@a/video/7234567890123456789"
+VIDEO = {'data': {'id': '7234567890123456789', 'play': 'https://cdn.example/v.mp4'}}
+
+
+def serve(slow_seconds, cancelled):
+    async def handler(request):
+        if request.url.host == 'slow.example':
+            try:
+                await asyncio.sleep(slow_seconds)
+            except asyncio.CancelledError:
+                cancelled.append(request.url.host)
+                raise
+        return httpx.Response(200, json=VIDEO)
+    return handler
+
+
+def fetch(mock_pool, handler, hedge_policy):
+    async def run():
+        pool = mock_pool(handler)
+        try:
+            started = time.monotonic()
+            result = await fetch_tiktok_info(POST_URL, [SLOW, FAST], client_pool=pool, hedge_policy=hedge_policy)
+            return result, time.monotonic() - started, [request.url.host for request in pool.requests]
+        finally:
+            await pool.aclose()
+    return asyncio.run(run())
+
+
+def test_hedge_wins_and_cancels_the_slow_request(mock_pool):
+    cancelled = []
+    policy = HedgePolicy(initial_delay=0.05, min_delay=0.05)
+    result, elapsed, hosts = fetch(mock_pool, serve(10, cancelled), policy)
+    assert result['status'] == 'success'
+    assert 'Fast API' in result['analyze_time']
+    assert hosts == ['slow.example', 'fast.example']
+    assert cancelled == ['slow.example']
+    assert (policy.hedges_sent, policy.hedges_won) == (1, 1)
+    assert elapsed < 1
+
+
+def test_no_hedge_when_the_first_endpoint_answers_in_time(mock_pool):
+    cancelled = []
+    policy = HedgePolicy(initial_delay=1, min_delay=1)
+    result, _, hosts = fetch(mock_pool, serve(0.01, cancelled), policy)
+    assert 'Slow API' in result['analyze_time']
+    assert hosts == ['slow.example']
+    assert policy.hedges_sent == 0
+
+
+def test_exhausted_budget_waits_for_the_in_flight_request(mock_pool):
+    cancelled = []
+    policy = HedgePolicy(budget=0, initial_delay=0.05, min_delay=0.05)
+    result, _, hosts = fetch(mock_pool, serve(0.2, cancelled), policy)
+    assert 'Slow API' in result['analyze_time']
+    assert hosts == ['slow.example']
+    assert cancelled == []
+
+
+def test_hedge_delay_follows_the_latency_percentile():
+    policy = HedgePolicy(percentile=0.9, initial_delay=8, min_delay=0.5)
+    for latency in (1, 2, 3, 4):
+        policy.record_latency(latency)
+    assert policy.hedge_delay() == 8 # Not enough samples yet
+    for latency in (5, 6, 7, 8, 9, 10):
+        policy.record_latency(latency)
+    assert policy.hedge_delay() == 9
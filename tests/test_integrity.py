@@ -0,0 +1,70 @@
+import struct
+
+from integrity import StreamVerifier
+
+
+def mp4_box(box_type, payload=b''):
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+MP4 = mp4_box(b'ftyp', b'isom\x00\x00\x02\x00') + mp4_box(b'moov', b'\x00' * 40) + mp4_box(b'mdat', bytes(range(256)) * 4)
+JPEG = b'\xff\xd8\xff\xe0' + b'\x10' * 200 + b'\xff\xd9'
+
+
+def verify(data, kind, chunk_size=7, expected_size=None):
+    verifier = StreamVerifier(kind)
+    for offset in range(0, len(data), chunk_size):
+        verifier.update(data[offset:offset + chunk_size])
+    return verifier.finish(expected_size)
+
+
+def test_complete_mp4_passes_in_any_chunking():
+    for chunk_size in (1, 3, 7, 16, 1000, len(MP4)):
+        report = verify(MP4, 'video', chunk_size)
+        assert report['ok'], (chunk_size, report['detail'])
+        assert report['format'] == 'mp4' and report['size'] == len(MP4)
+
+
+def test_truncated_mp4_is_rejected():
+    report = verify(MP4[:-100], 'video')
+    assert not report['ok']
+    assert "截断" in report['detail']
+
+
+def test_mp4_cut_inside_a_box_header_is_rejected():
+    cut = len(MP4) - len(mp4_box(b'mdat', bytes(range(256)) * 4)) + 4 # Only half of the mdat header
+    report = verify(MP4[:cut], 'video')
+    assert not report['ok']
+
+
+def test_mp4_missing_mdat_is_rejected():
+    data = mp4_box(b'ftyp', b'isom\x00\x00\x02\x00') + mp4_box(b'moov', b'\x00' * 40)
+    report = verify(data, 'video')
+    assert not report['ok']
+    assert "mdat" in report['detail']
+
+
+def test_truncated_jpeg_is_rejected():
+    assert verify(JPEG, 'image')['ok']
+    report = verify(JPEG[:-2], 'image')
+    assert not report['ok']
+    assert report['format'] == 'jpeg'
+
+
+def test_html_error_page_is_rejected():
+    report = verify(b'<html><body>403 Forbidden</body></html>', 'video')
+    assert not report['ok']
+    assert report['format'] == 'text'
+
+
+def test_size_mismatch_is_rejected():
+    assert not verify(MP4, 'video', expected_size=len(MP4) + 1)['ok']
+
+
+def test_catch_up_hashes_like_streaming(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(MP4)
+    verifier = StreamVerifier('video')
+    verifier.update(MP4[:50]) # Streamed prefix, the rest read back from disk
+    verifier.catch_up(str(path))
+    assert verifier.finish() == verify(MP4, 'video')
@@ -0,0 +1,49 @@
+import sqlite3
+
+from metadata_cache import MetadataCache
+
+
+def video_result(aweme_id):
+    return {'status': 'success', 'url_type': 'video', 'video_aweme_id': aweme_id,
+            'nwm_video_url': f"https://cdn.example/{aweme_id}.mp4", 'original_url': f"https://www.tiktok.com/@a/video/{aweme_id}"}
+
+
+def test_hits_are_written_on_close_only(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = MetadataCache(path)
+    cache.put("https://www.tiktok.com/@a/video/1", video_result("1"))
+    stored_access = sqlite3.connect(path).execute("SELECT last_access FROM metadata").fetchone()[0]
+    assert cache.get(aweme_id="1")['nwm_video_url'] == "https://cdn.example/1.mp4"
+    assert cache.get(url="https://tiktok.com/@a/video/1/?lang=en") is not None
+    assert sqlite3.connect(path).execute("SELECT last_access FROM metadata").fetchone()[0] == stored_access
+    cache.close()
+    assert sqlite3.connect(path).execute("SELECT last_access FROM metadata").fetchone()[0] > stored_access
+    assert cache.hits == 2
+
+
+def test_eviction_keeps_recently_used_entries(tmp_path):
+    cache = MetadataCache(str(tmp_path / "cache.db"), max_entries=3)
+    for aweme_id in ("1", "2", "3"):
+        cache.put(f"https://www.tiktok.com/@a/video/{aweme_id}", video_result(aweme_id))
+    assert cache.get(aweme_id="1") is not None # Only recorded in memory so far
+    cache.put("https://www.tiktok.com/@a/video/4", video_result("4"))
+    assert cache.get(aweme_id="2") is None # Least recently used
+    for aweme_id in ("1", "3", "4"):
+        assert cache.get(aweme_id=aweme_id) is not None
+    assert cache.get(url="https://www.tiktok.com/@a/video/2") is None
+    cache.close()
+
+    cache = MetadataCache(str(tmp_path / "cache.db"), max_entries=3)
+    assert cache._count == 3
+    cache.close()
+
+
+def test_replacing_an_entry_does_not_evict_others(tmp_path):
+    cache = MetadataCache(str(tmp_path / "cache.db"), max_entries=2)
+    cache.put("https://www.tiktok.com/@a/video/1", video_result("1"))
+    cache.put("https://www.tiktok.com/@a/video/2", video_result("2"))
+    for _ in range(3):
+        cache.put("https://www.tiktok.com/@a/video/2", video_result("2"))
+    assert cache.get(aweme_id="1") is not None
+    assert cache.get(aweme_id="2") is not None
+    cache.close()
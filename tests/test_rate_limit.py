@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+import httpx
+
+from tiktok_fetcher import RateLimiterRegistry, RetryPolicy, TokenBucket, _parse_rate_limit_headers, fetch_tiktok_info
+
+API = {'name': 'Mock API', 'url': 'https://api.example/info', 'rate_per_second': 10, 'burst': 1}
+POST_URL = "https://www.tiktok.com/@a/video/7234567890123456789"
+
+
+def test_retry_after_throttles_the_bucket(mock_pool):
+    async def handler(request):
+        return httpx.Response(429, headers={'Retry-After': '2'}, json={'message': 'Too many requests'})
+
+    async def run():
+        pool = mock_pool(handler)
+        rate_limiters = RateLimiterRegistry()
+        bucket = rate_limiters.get(API)
+        try:
+            result = await fetch_tiktok_info(POST_URL, [API], client_pool=pool, rate_limiters=rate_limiters,
+                                             retry_policy=RetryPolicy(max_attempts=1))
+            assert result['status'] == 'failed'
+            assert bucket.throttled_count == 1
+            assert bucket.rate == 5
+            assert 1.5 < bucket.blocked_until - time.monotonic() <= 2
+
+            # Paused for longer than this URL's budget: skipped without a request
+            result = await fetch_tiktok_info(POST_URL, [API], client_pool=pool, rate_limiters=rate_limiters,
+                                             retry_policy=RetryPolicy(url_deadline=0.5))
+            assert '速率限制中' in result['reason']
+            assert len(pool.requests) == 1
+        finally:
+            await pool.aclose()
+
+    asyncio.run(run())
+
+
+def test_throttled_endpoint_falls_through_to_the_next(mock_pool):
+    fallback = {'name': 'Fallback API', 'url': 'https://fallback.example/info'}
+
+    async def handler(request):
+        if request.url.host == 'api.example':
+            return httpx.Response(429, headers={'Retry-After': '60'}, json={})
+        return httpx.Response(200, json={'data': {'id': '7234567890123456789', 'play': 'https://cdn.example/v.mp4'}})
+
+    async def run():
+        pool = mock_pool(handler)
+        try:
+            started = time.monotonic()
+            result = await fetch_tiktok_info(POST_URL, [API, fallback], client_pool=pool,
+                                             rate_limiters=RateLimiterRegistry())
+            return result, time.monotonic() - started, [request.url.host for request in pool.requests]
+        finally:
+            await pool.aclose()
+
+    result, elapsed, hosts = asyncio.run(run())
+    assert result['status'] == 'success'
+    assert hosts == ['api.example', 'fallback.example']
+    assert elapsed < 1
+
+
+def test_acquire_gives_up_when_throttled_while_waiting():
+    async def run():
+        bucket = TokenBucket(rate=10, burst=1)
+        assert await bucket.acquire()
+        waiter = asyncio.create_task(bucket.acquire(max_wait=0.5)) # Queued behind the spent token
+        await asyncio.sleep(0.01)
+        bucket.on_throttled(retry_after=5)
+        return await waiter
+
+    assert asyncio.run(run()) is False
+
+
+def test_rate_limit_headers_are_parsed():
+    info = _parse_rate_limit_headers(httpx.Headers({'Retry-After': '3', 'X-RateLimit-Requests-Remaining': '0',
+                                                    'X-RateLimit-Requests-Reset': '120'}))
+    assert info == {'retry_after': 3.0, 'limit': None, 'remaining': 0.0, 'reset': 120.0}
+    assert _parse_rate_limit_headers(httpx.Headers({'Content-Type': 'application/json'})) is None
@@ -0,0 +1,85 @@
+import asyncio
+
+import httpx
+
+from download_history import DownloadHistory
+from tiktok_fetcher import resolve_urls
+
+API = {'name': 'Mock API', 'url': 'https://api.example/info'}
+SLOW_ID = '7000000000000000001'
+
+
+def post_url(aweme_id):
+    return f"https://www.tiktok.com/@a/video/{aweme_id}"
+
+
+def serve(in_flight):
+    async def handler(request):
+        aweme_id = request.url.params['url'].rsplit('/', 1)[-1]
+        in_flight['now'] += 1
+        in_flight['max'] = max(in_flight['max'], in_flight['now'])
+        try:
+            await asyncio.sleep(0.2 if aweme_id == SLOW_ID else 0.01)
+        finally:
+            in_flight['now'] -= 1
+        return httpx.Response(200, json={'data': {'id': aweme_id, 'play': f"https://cdn.example/{aweme_id}.mp4"}})
+    return handler
+
+
+def resolve(mock_pool, raw_inputs, **kwargs):
+    in_flight = {'now': 0, 'max': 0}
+
+    async def run():
+        pool = mock_pool(serve(in_flight))
+        try:
+            return [entry async for entry in resolve_urls(raw_inputs, [API], client_pool=pool, **kwargs)], pool
+        finally:
+            await pool.aclose()
+
+    entries, pool = asyncio.run(run())
+    return entries, pool, in_flight['max']
+
+
+def test_results_stream_in_completion_order_by_default(mock_pool):
+    inputs = [post_url(SLOW_ID)] + [post_url(f"70000000000000000{n}") for n in range(10, 14)]
+    entries, _, _ = resolve(mock_pool, inputs)
+    assert sorted(entry['index'] for entry in entries) == list(range(5))
+    assert entries[-1]['index'] == 0 # The slow one does not hold back the others
+    assert all(entry['result']['status'] == 'success' for entry in entries)
+
+
+def test_ordered_mode_keeps_input_order(mock_pool):
+    inputs = [post_url(SLOW_ID)] + [post_url(f"70000000000000000{n}") for n in range(10, 14)]
+    entries, _, _ = resolve(mock_pool, inputs, ordered=True)
+    assert [entry['index'] for entry in entries] == list(range(5))
+    assert [entry['result']['video_aweme_id'] for entry in entries] == [url.rsplit('/', 1)[-1] for url in inputs]
+
+
+def test_concurrency_is_bounded(mock_pool):
+    inputs = (post_url(f"7000000000000000{n}") for n in range(100, 130)) # Generators are pulled lazily
+    entries, _, max_in_flight = resolve(mock_pool, inputs, concurrency=4)
+    assert len(entries) == 30
+    assert max_in_flight <= 4
+
+
+def test_rejected_and_duplicate_inputs_are_not_sent(mock_pool):
+    inputs = ["not a link", post_url('7000000000000000100'), post_url('7000000000000000100') + "?lang=en"]
+    entries, pool, _ = resolve(mock_pool, inputs, ordered=True)
+    assert [entry['status'] for entry in entries] == ['rejected', 'ok', 'duplicate']
+    assert entries[2]['duplicate_of'] == 1
+    assert entries[0]['result'] is None and entries[2]['result'] is None
+    assert len(pool.requests) == 1
+
+
+def test_downloaded_posts_are_skipped(mock_pool, tmp_path):
+    history = DownloadHistory(str(tmp_path))
+    history.add('7000000000000000100', str(tmp_path / "a.mp4"), 1)
+    try:
+        entries, pool, _ = resolve(mock_pool, [post_url('7000000000000000100'), post_url('7000000000000000101')],
+                                   ordered=True, download_history=history)
+    finally:
+        history.close()
+    assert [entry['status'] for entry in entries] == ['downloaded', 'ok']
+    assert entries[0]['history']['size'] == 1
+    assert history.skipped == 1
+    assert len(pool.requests) == 1
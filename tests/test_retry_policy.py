@@ -0,0 +1,62 @@
+import asyncio
+
+import httpx
+
+from tiktok_fetcher import RetryPolicy, fetch_tiktok_info
+
+API = {'name': 'Mock API', 'url': 'https://api.example/info'}
+POST_URL = "https://www.tiktok.com/@a/video/7234567890123456789"
+VIDEO = {'data': {'id': '7234567890123456789', 'play': 'https://cdn.example/v.mp4'}}
+
+
+def fetch(mock_pool, handler, retry_policy, on_attempt=None):
+    async def run():
+        pool = mock_pool(handler)
+        try:
+            result = await fetch_tiktok_info(POST_URL, [API], client_pool=pool, retry_policy=retry_policy,
+                                             on_attempt=on_attempt)
+            return result, len(pool.requests)
+        finally:
+            await pool.aclose()
+    return asyncio.run(run())
+
+
+def test_retryable_errors_are_retried_until_success(mock_pool):
+    statuses = [503, 500, 200]
+    attempts = []
+
+    async def handler(request):
+        status = statuses.pop(0)
+        return httpx.Response(status, json=VIDEO if status == 200 else {'message': 'busy'})
+
+    result, requests = fetch(mock_pool, handler, RetryPolicy(max_attempts=3, base_delay=0.01), attempts.append)
+    assert result['status'] == 'success'
+    assert requests == 3
+    assert [attempt['attempt'] for attempt in attempts] == [1, 2, 3]
+    assert attempts[-1]['last_error'].kind == 'server'
+
+
+def test_non_retryable_errors_are_not_retried(mock_pool):
+    async def handler(request):
+        return httpx.Response(401, json={'message': 'Invalid API key'})
+
+    result, requests = fetch(mock_pool, handler, RetryPolicy(max_attempts=3, base_delay=0.01))
+    assert result['status'] == 'failed'
+    assert requests == 1
+
+
+def test_deadline_stops_retries(mock_pool):
+    async def handler(request):
+        await asyncio.sleep(0.1)
+        return httpx.Response(500, json={'message': 'busy'})
+
+    result, requests = fetch(mock_pool, handler, RetryPolicy(max_attempts=10, base_delay=0, url_deadline=0.25))
+    assert result['error_kind'] == 'deadline'
+    assert requests <= 3 # 0.1s per call: no room for a fourth
+    assert 'failure_class' not in result
+
+
+def test_backoff_is_capped():
+    policy = RetryPolicy(base_delay=1, max_delay=4)
+    for attempt in range(1, 8):
+        assert 0 <= policy.backoff(attempt) <= min(4, 2 ** (attempt - 1))
@@ -0,0 +1,77 @@
+import asyncio
+
+import httpx
+
+from tiktok_fetcher import EndpointScoreboard, fetch_tiktok_info
+
+POST_URL = "https://www.tiktok.com/@a/video/7234567890123456789"
+
+
+def configs(*names):
+    return [{'name': name, 'url': f"https://{name.lower()}.example/info"} for name in names]
+
+
+def test_rank_prefers_fast_healthy_endpoints():
+    scoreboard = EndpointScoreboard()
+    for _ in range(3):
+        scoreboard.record('A', 2.0, 'success')
+        scoreboard.record('B', 0.5, 'success')
+        scoreboard.record('C', 0.5, 'failed')
+    assert scoreboard.score('B') < scoreboard.score('A') < scoreboard.score('C')
+    assert [cfg['name'] for cfg in scoreboard.rank(configs('A', 'B', 'C'))] == ['B', 'A', 'C']
+
+
+def test_unsampled_endpoints_rank_as_average_and_keep_their_order():
+    scoreboard = EndpointScoreboard()
+    for _ in range(3):
+        scoreboard.record('Fast', 0.1, 'success')
+        scoreboard.record('Medium', 1.0, 'success')
+        scoreboard.record('Slow', 5.0, 'success')
+    scoreboard.record('New', 0.01, 'success') # Below SCOREBOARD_MIN_CALLS
+    assert scoreboard.score('New') is None
+    ranked = scoreboard.rank(configs('Slow', 'New', 'Other', 'Medium', 'Fast'))
+    assert [cfg['name'] for cfg in ranked] == ['Fast', 'New', 'Other', 'Medium', 'Slow']
+
+
+def test_ewma_weights_the_newest_sample():
+    scoreboard = EndpointScoreboard(alpha=0.5)
+    scoreboard.record('A', 1.0, 'success')
+    scoreboard.record('A', 3.0, 'rate_limited')
+    stats = scoreboard.get_stats('A')
+    assert stats['latency_ewma'] == 2.0
+    assert stats['success_ratio'] == 0.5
+    assert stats['rate_limit_ratio'] == 0.5
+
+
+def test_statistics_survive_save_and_load(tmp_path):
+    path = str(tmp_path / "endpoints.json")
+    scoreboard = EndpointScoreboard(path)
+    for _ in range(3):
+        scoreboard.record('A', 1.0, 'success')
+    scoreboard.save()
+    assert EndpointScoreboard(path).score('A') == scoreboard.score('A')
+
+
+def test_fetch_tries_the_best_ranked_endpoint_first(mock_pool):
+    scoreboard = EndpointScoreboard()
+    for _ in range(3):
+        scoreboard.record('Broken', 0.5, 'failed')
+        scoreboard.record('Working', 0.5, 'success')
+
+    async def handler(request):
+        if request.url.host == 'broken.example':
+            return httpx.Response(500, json={'message': 'upstream error'})
+        return httpx.Response(200, json={'data': {'id': '7234567890123456789', 'play': 'https://cdn.example/v.mp4'}})
+
+    async def run():
+        pool = mock_pool(handler)
+        try:
+            result = await fetch_tiktok_info(POST_URL, configs('Broken', 'Working'), client_pool=pool, scoreboard=scoreboard)
+            return result, [request.url.host for request in pool.requests]
+        finally:
+            await pool.aclose()
+
+    result, hosts = asyncio.run(run())
+    assert result['status'] == 'success'
+    assert hosts == ['working.example']
+    assert scoreboard.get_stats('Working')['calls'] == 4
@@ -0,0 +1,82 @@
+import asyncio
+
+import httpx
+
+from tiktok_fetcher import UrlNormalizer
+
+POST_URL = "https://www.tiktok.com/@someone/video/7234567890123456789"
+
+
+def normalize(raw_input, client_pool=None):
+    return asyncio.run(UrlNormalizer(client_pool).normalize(raw_input))
+
+
+def test_post_urls_are_canonicalized():
+    for raw_input in ("https://m.tiktok.com/@someone/video/7234567890123456789?is_from_webapp=1&sender_device=pc",
+                      "看看这个 tiktok.com/@someone/video/7234567890123456789， 很好笑",
+                      "HTTPS://WWW.TIKTOK.COM/@someone/VIDEO/7234567890123456789#comments"):
+        entry = normalize(raw_input)
+        assert entry['status'] == 'ok', raw_input
+        assert entry['url'] == POST_URL
+        assert entry['aweme_id'] == '7234567890123456789' and entry['url_type'] == 'video'
+
+
+def test_photo_and_id_only_urls():
+    entry = normalize("https://www.tiktok.com/@someone/photo/7234567890123456789")
+    assert entry['url_type'] == 'album'
+    entry = normalize("https://www.tiktok.com/embed/v2/7234567890123456789")
+    assert entry['url'] == "https://www.tiktok.com/v/7234567890123456789"
+    assert entry['aweme_id'] == '7234567890123456789' and entry['url_type'] is None
+
+
+def test_non_tiktok_hosts_are_rejected():
+    for raw_input in ("https://tiktok.com.evil.example/@someone/video/7234567890123456789",
+                      "https://nottiktok.com/@someone/video/7234567890123456789",
+                      "https://example.com/?next=tiktok.com/@someone/video/7234567890123456789",
+                      "hello", ""):
+        entry = normalize(raw_input)
+        assert entry['status'] == 'rejected', raw_input
+        assert entry['url'] is None
+
+
+def test_short_links_are_resolved_once(mock_pool):
+    async def handler(request):
+        assert request.method == 'HEAD'
+        return httpx.Response(301, headers={'Location': POST_URL + "?_r=1"})
+
+    async def run():
+        pool = mock_pool(handler)
+        normalizer = UrlNormalizer(pool)
+        try:
+            first = await normalizer.normalize("https://vm.tiktok.com/ZMabc123/")
+            second = await normalizer.normalize("https://vm.tiktok.com/ZMabc123?share=1")
+            return first, second, len(pool.requests)
+        finally:
+            await pool.aclose()
+
+    first, second, requests = asyncio.run(run())
+    assert first['url'] == second['url'] == POST_URL
+    assert requests == 1
+
+
+def test_unresolvable_short_link_is_passed_to_the_api(mock_pool):
+    async def handler(request):
+        return httpx.Response(200)
+
+    async def run():
+        pool = mock_pool(handler)
+        try:
+            return await UrlNormalizer(pool).normalize("https://vt.tiktok.com/ZSxyz/")
+        finally:
+            await pool.aclose()
+
+    entry = asyncio.run(run())
+    assert entry['status'] == 'ok'
+    assert entry['url'] == "https://vt.tiktok.com/ZSxyz/" and entry['aweme_id'] is None
+
+
+def test_batch_marks_duplicates():
+    entries = asyncio.run(UrlNormalizer().normalize_batch([
+        POST_URL, "https://example.com/video", POST_URL + "?lang=en"]))
+    assert [entry['status'] for entry in entries] == ['ok', 'rejected', 'duplicate']
+    assert entries[2]['duplicate_of'] == 0
@@ -1,8 +1,21 @@
 import logging
+import os
 import time
 import asyncio
 import httpx
 import json # Import json for parsing
+import math
+import random
+import re
+from collections import deque, OrderedDict
+from urllib.parse import urlsplit
+from email.utils import parsedate_to_datetime
+
+try:
+    import h2 # noqa: F401 - Only needed so httpx can negotiate HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - [%(funcName)s] - %(message)s')
@@ -10,6 +23,8 @@ logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - [
 # --- Constants ---
 # Common keys to look for in API responses for the NWM video URL
 NWM_VIDEO_URL_KEYS = ['hdplay', 'play', 'nwm_video_url', 'video_url', 'download_url', 'url', 'nwmUrl', 'videoUrlNwm']
+# Quality label of the video URL found under a key (last part of its path); other keys are labelled 'default'
+VIDEO_URL_QUALITY = {'hdplay': 'hd', 'play': 'sd'}
 # Common keys for metadata
 METADATA_KEYS = {
     'aweme_id': ['id', 'aweme_id', 'awemeId'],
@@ -21,39 +36,565 @@ METADATA_KEYS = {
     'cover_url': ['dynamic_cover', 'cover', 'origin_cover', 'coverUrl', 'videoCover'],
     'album_list': ['images', 'imageList', 'album_list'] # Keys for image URLs in albums
 }
+# Keys for the URL when album images are objects instead of plain URLs
+ALBUM_IMAGE_URL_KEYS = ['url', 'imageURL', 'src']
+# Provider messages saying a post is gone (deleted, private, region-locked...)
+PAYLOAD_MESSAGE_KEYS = ['msg', 'message', 'status_msg', 'error', 'detail']
+UNAVAILABLE_MESSAGE_RE = re.compile(
+    r'unavailable|not (?:found|exist|available)|does ?n.t exist|private|deleted|removed|region|'
+    r'url parsing is failed|不存在|已删除|已被删除|私密|不可用|无法查看', re.IGNORECASE)
+# Gateway/account messages about the request rather than the post (wrong endpoint path, key, quota...)
+REQUEST_MESSAGE_RE = re.compile(r'endpoint|route|no such path|api ?key|token|quota|limit|subscri|auth|'
+                                r'^\s*(?:404\s*)?not found\W*$', re.IGNORECASE)
+# Failure classes that will not change on a retry (see fetch_tiktok_info / MetadataCache.put_unavailable)
+PERMANENT_FAILURE_CLASSES = ('unavailable', 'no_media')
+API_REQUEST_TIMEOUT = 60 # Seconds, per API request
+API_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+# Connection pool defaults (per endpoint host + proxy combination)
+POOL_MAX_CONNECTIONS = 20
+POOL_MAX_KEEPALIVE_CONNECTIONS = 10
+POOL_KEEPALIVE_EXPIRY = 30.0 # Seconds an idle connection is kept open
+# Hedged request defaults
+HEDGE_DEFAULT_PERCENTILE = 0.9 # Hedge once the in-flight call is slower than the p90 latency
+HEDGE_DEFAULT_BUDGET = 100 # Maximum extra (hedge) API calls per batch
+HEDGE_INITIAL_DELAY = 8.0 # Seconds, used until enough latency samples exist
+HEDGE_MIN_DELAY = 1.0 # Never hedge sooner than this (seconds)
+HEDGE_MIN_SAMPLES = 5 # Latency samples needed before the percentile is trusted
+HEDGE_LATENCY_WINDOW = 200 # Recent latency samples kept
+# Adaptive endpoint ranking defaults
+SCOREBOARD_EWMA_ALPHA = 0.2 # Weight of the newest sample in the moving averages
+SCOREBOARD_MIN_CALLS = 3 # Calls needed before an endpoint's score is trusted
+SCOREBOARD_STALE_SECONDS = 6 * 3600 # Statistics older than this are ignored for ranking
+# Circuit breaker defaults
+BREAKER_FAILURE_THRESHOLD = 5 # Consecutive provider failures before an endpoint is skipped
+BREAKER_COOLDOWN_SECONDS = 60.0 # How long a tripped endpoint is skipped before a probe
+# Retry policy defaults
+RETRY_MAX_ATTEMPTS = 3 # Calls per endpoint for retryable errors (429, 5xx, timeouts, connection errors)
+RETRY_BASE_DELAY = 0.5 # Seconds, first backoff ceiling (doubles per retry, full jitter)
+RETRY_MAX_DELAY = 8.0 # Seconds, backoff ceiling
+URL_DEADLINE_SECONDS = 90.0 # Overall budget per URL across all endpoints and retries
+# Token bucket rate limiting defaults
+RATE_LIMIT_FALLBACK_RATE = 1.0 # Requests/second assumed for an unlimited endpoint once it returns 429
+RATE_LIMIT_MIN_RATE = 0.01 # Never throttle an endpoint below this many requests/second
+RATE_LIMIT_DECREASE_FACTOR = 0.5 # Rate multiplier applied on each 429
+RATE_LIMIT_RECOVERY_STEP = 0.05 # Fraction of the configured rate restored per success
+RATE_LIMIT_MAX_WAIT = 30.0 # Skip to the next endpoint instead of waiting longer than this (seconds)
+RATE_LIMIT_EPOCH_THRESHOLD = 1e9 # x-ratelimit-reset values above this are Unix timestamps
+# Short link resolution (vm.tiktok.com etc.)
+SHORT_LINK_TIMEOUT = 15 # Seconds per redirect lookup
+SHORT_LINK_MAX_REDIRECTS = 5
+SHORT_LINK_CACHE_SIZE = 10000 # Resolved short links remembered per normalizer
+SHORT_LINK_CONCURRENCY = 8 # Parallel short link lookups per batch
+# Bulk resolution (resolve_urls)
+BULK_RESOLVE_CONCURRENCY = 8 # URLs normalized and resolved in parallel
+
+QUALITY_MODES = ('hd', 'sd', 'smallest', 'hd_under') # See QualityPolicy
+VIDEO_SIZE_PROBE_TIMEOUT = 10 # Seconds per HEAD/Range request measuring a video URL candidate
+VIDEO_SIZE_PROBE_CONNECTIONS = 8 # Open connections of the batch's size probe client (all CDN hosts together)
 # -----------------
 
-def _get_nested_value(data_dict, key_path_list):
-    """Safely retrieves a value from a nested dictionary using a list of possible key paths."""
-    if not isinstance(data_dict, dict):
+# --- Response Field Extraction ---
+
+class KeyPath:
+    """A dotted key path ('author.nickname', 'images.0.url') parsed once into a tuple of keys/list indexes."""
+
+    __slots__ = ('path', 'keys')
+
+    def __init__(self, path):
+        self.path = path
+        self.keys = tuple(int(key) if key.isdigit() else key for key in path.split('.'))
+
+    def get(self, data):
+        """Returns (True, value) if every key along the path exists in `data`, else (False, None)."""
+        current = data
+        for key in self.keys:
+            if isinstance(key, int) and isinstance(current, list):
+                if key >= len(current):
+                    return False, None
+            elif not isinstance(current, dict) or key not in current:
+                return False, None
+            current = current[key]
+        return True, current
+
+
+# Candidate paths per result field, compiled once
+DEFAULT_FIELD_PATHS = {field: [KeyPath(path) for path in paths] for field, paths in METADATA_KEYS.items()}
+DEFAULT_FIELD_PATHS['nwm_video_url'] = [KeyPath(path) for path in NWM_VIDEO_URL_KEYS]
+DEFAULT_FIELD_PATHS['album_image_url'] = [KeyPath(path) for path in ALBUM_IMAGE_URL_KEYS]
+
+
+class ResponseExtractor:
+    """
+    Extracts result fields from one endpoint's responses.
+
+    Paths declared in the endpoint's optional 'field_map' config ({field: path or [paths]},
+    relative to the response's 'data' object) are tried before the built-in candidates.
+    The path that matched a field is remembered and tried first on later responses,
+    so a known provider costs one lookup per field.
+    """
+
+    def __init__(self, field_map=None):
+        self.field_paths = {}
+        for field, default_paths in DEFAULT_FIELD_PATHS.items():
+            configured = (field_map or {}).get(field) or []
+            if isinstance(configured, str):
+                configured = [configured]
+            self.field_paths[field] = [KeyPath(path) for path in configured] + default_paths
+        self.learned = {} # field -> KeyPath that matched last time
+
+    def get(self, field, data):
+        """Returns the value of `field` in `data` (None if no candidate path exists)."""
+        if not isinstance(data, dict):
+            return None
+        learned_path = self.learned.get(field)
+        if learned_path is not None:
+            found, value = learned_path.get(data)
+            if found:
+                return value
+        for key_path in self.field_paths[field]:
+            if key_path is learned_path:
+                continue
+            found, value = key_path.get(data)
+            if found:
+                logging.debug(f"Learned response path '{key_path.path}' for field '{field}'")
+                self.learned[field] = key_path
+                return value
         return None
-    for key_path in key_path_list:
-        keys = key_path.split('.')
-        current_val = data_dict
-        found = True
-        for key in keys:
-            if isinstance(current_val, dict) and key in current_val:
-                current_val = current_val[key]
-            else:
-                found = False
-                break
-        if found:
-            return current_val
+
+    def get_all(self, field, data):
+        """Returns (KeyPath, value) for every candidate path of `field` that exists in `data`, in priority order."""
+        if not isinstance(data, dict):
+            return []
+        matches = []
+        for key_path in self.field_paths[field]:
+            found, value = key_path.get(data)
+            if found:
+                matches.append((key_path, value))
+        return matches
+
+
+def video_url_candidates(extractor, data):
+    """
+    Returns every NWM video URL in a response as [{'url', 'quality', 'key'}], in the priority order of
+    the candidate paths (so HD before SD) and without duplicates. A path may hold a single URL or a
+    list of mirror URLs for the same video.
+    """
+    candidates = []
+    seen = set()
+    for key_path, value in extractor.get_all('nwm_video_url', data):
+        quality = VIDEO_URL_QUALITY.get(str(key_path.keys[-1]), 'default')
+        for url in value if isinstance(value, list) else [value]:
+            if isinstance(url, str) and url.startswith('http') and url not in seen:
+                seen.add(url)
+                candidates.append({'url': url, 'quality': quality, 'key': key_path.path})
+    return candidates
+
+
+_response_extractors = {} # (api name, field_map) -> ResponseExtractor, shared for the life of the process
+
+
+def get_response_extractor(api_config):
+    """Returns the (learning) ResponseExtractor for an API configuration."""
+    field_map = api_config.get('field_map') or {}
+    key = (api_config.get('name', 'Unnamed API'), json.dumps(field_map, sort_keys=True))
+    extractor = _response_extractors.get(key)
+    if extractor is None:
+        extractor = ResponseExtractor(field_map)
+        _response_extractors[key] = extractor
+    return extractor
+
+
+def _proxy_url(proxies):
+    """Returns a single proxy URL string from a proxy URL or a requests-style proxies dict."""
+    if not proxies:
+        return None
+    if isinstance(proxies, dict):
+        return proxies.get('https') or proxies.get('http')
+    return str(proxies)
+
+
+class HttpClientPool:
+    """
+    Registry of long-lived httpx.AsyncClient instances shared across a whole batch.
+
+    One pooled client is kept per (scheme://host, proxy) combination, so repeated calls to the
+    same API host reuse open TCP/TLS connections instead of handshaking for every URL and retry.
+    Media CDN requests that are not API calls (video size probes) share one separate client per proxy
+    instead, from media_client(), so CDN hosts do not each get a long-lived API client.
+    Use as an async context manager (or call aclose()) to close every client when the batch ends.
+    Clients are bound to the event loop they were created on, so create one pool per loop.
+    """
+
+    def __init__(self, max_connections=POOL_MAX_CONNECTIONS,
+                 max_keepalive_connections=POOL_MAX_KEEPALIVE_CONNECTIONS,
+                 keepalive_expiry=POOL_KEEPALIVE_EXPIRY, http2=False, compress=True,
+                 timeout=API_REQUEST_TIMEOUT):
+        """
+        Args:
+            max_connections (int): Maximum open connections per pooled client.
+            max_keepalive_connections (int): Maximum idle connections kept alive per client.
+            keepalive_expiry (float): Seconds before an idle keep-alive connection is closed.
+            http2 (bool): Negotiate HTTP/2 when the optional 'h2' package is installed.
+            compress (bool): Ask servers for compressed responses (httpx decodes them transparently).
+            timeout (float): Default request timeout in seconds.
+        """
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        if http2 and not HTTP2_AVAILABLE:
+            logging.warning("HTTP/2 requested but the 'h2' package is not installed. Falling back to HTTP/1.1.")
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.compress = compress
+        self.timeout = timeout
+        self._clients = {}
+        self._media_clients = {} # Proxy -> size probe client
+        self._closed = False
+
+    @staticmethod
+    def _client_key(url, proxies):
+        parts = urlsplit(url)
+        return (f"{parts.scheme}://{parts.netloc}".lower(), _proxy_url(proxies))
+
+    def get_client(self, url, proxies=None):
+        """Returns the pooled client for the host of `url` and the given proxy, creating it on first use."""
+        if self._closed:
+            raise RuntimeError("HttpClientPool is closed")
+        key = self._client_key(url, proxies)
+        client = self._clients.get(key)
+        if client is None:
+            headers = {'User-Agent': API_USER_AGENT}
+            if not self.compress:
+                headers['Accept-Encoding'] = 'identity'
+            client = httpx.AsyncClient(
+                proxy=key[1],
+                follow_redirects=True,
+                timeout=self.timeout,
+                limits=self.limits,
+                http2=self.http2,
+                headers=headers
+            )
+            self._clients[key] = client
+            logging.debug(f"Created pooled HTTP client for {key[0]} (proxy: {key[1]}, http2: {self.http2})")
+        return client
+
+    def media_client(self, proxies=None):
+        """Returns the client for HEAD/Range requests to media CDNs (any host), creating it on first use."""
+        if self._closed:
+            raise RuntimeError("HttpClientPool is closed")
+        proxy = _proxy_url(proxies)
+        client = self._media_clients.get(proxy)
+        if client is None:
+            client = httpx.AsyncClient(
+                proxy=proxy,
+                follow_redirects=True,
+                timeout=VIDEO_SIZE_PROBE_TIMEOUT,
+                limits=httpx.Limits(max_connections=VIDEO_SIZE_PROBE_CONNECTIONS,
+                                    max_keepalive_connections=VIDEO_SIZE_PROBE_CONNECTIONS,
+                                    keepalive_expiry=self.limits.keepalive_expiry),
+                headers={'User-Agent': API_USER_AGENT, 'Accept-Encoding': 'identity'}
+            )
+            self._media_clients[proxy] = client
+            logging.debug(f"Created media probe HTTP client (proxy: {proxy})")
+        return client
+
+    async def aclose(self):
+        """Closes every pooled client. The pool cannot be used afterwards."""
+        self._closed = True
+        clients = list(self._clients.values()) + list(self._media_clients.values())
+        self._clients.clear()
+        self._media_clients.clear()
+        for client in clients:
+            try:
+                await client.aclose()
+            except Exception as e:
+                logging.warning(f"Error closing pooled HTTP client: {e}")
+        if clients:
+            logging.debug(f"Closed {len(clients)} pooled HTTP client(s).")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+
+def _http_error_kind(status_code):
+    """Maps an HTTP error status code to the 'error_kind' reported in failed results."""
+    if status_code in (401, 403):
+        return 'auth'
+    if status_code == 429:
+        return 'rate_limit'
+    if status_code >= 500:
+        return 'server'
+    return 'http'
+
+
+# --- Video Quality Selection ---
+
+class QualityPolicy:
+    """
+    Which of a post's video URL candidates is downloaded, per batch:
+    'hd' (best quality first, the default), 'sd' (standard quality first), 'smallest' (fewest bytes)
+    or 'hd_under' (HD if it is at most `max_hd_mb` MB, otherwise SD). 'smallest' and 'hd_under' need
+    the sizes, which probe_video_sizes() measures before anything is downloaded.
+    The other candidates are kept after the chosen ones as fallbacks.
+    """
+
+    def __init__(self, mode='hd', max_hd_mb=0):
+        if mode not in QUALITY_MODES:
+            logging.warning(f"Unknown video quality mode '{mode}', using 'hd'.")
+            mode = 'hd'
+        self.mode = mode
+        self.max_hd_bytes = max_hd_mb * 1024 * 1024
+
+    @property
+    def needs_sizes(self):
+        return self.mode in ('smallest', 'hd_under')
+
+    def order(self, candidates):
+        """Returns the candidates ([{'url', 'quality', 'size'?}], best quality first) in download order."""
+        if self.mode == 'smallest':
+            return sorted(candidates, key=lambda candidate: (candidate.get('size') is None, candidate.get('size') or 0))
+        if self.mode == 'hd_under':
+            hd_sizes = [candidate.get('size') for candidate in candidates if candidate.get('quality') == 'hd']
+            if not hd_sizes or any(size is None or size <= self.max_hd_bytes for size in hd_sizes):
+                return list(candidates) # No HD, HD small enough, or its size unknown: keep HD first
+        elif self.mode == 'hd':
+            return list(candidates)
+        # 'sd', or 'hd_under' with an HD version that is too large
+        preference = {'sd': 0, 'default': 1, 'hd': 2}
+        return sorted(candidates, key=lambda candidate: preference.get(candidate.get('quality'), 1))
+
+
+async def _probe_video_size(client, url, timeout):
+    """Returns the size in bytes of the file at `url` (HEAD, else a one-byte Range request), or None."""
+    headers = {'Accept-Encoding': 'identity'} # The length of the file itself, not of a compressed body
+    try:
+        response = await client.head(url, headers=headers, timeout=timeout)
+        if response.status_code == 200 and response.headers.get('content-length', '').isdigit():
+            return int(response.headers['content-length'])
+        async with client.stream('GET', url, headers=dict(headers, Range='bytes=0-0'), timeout=timeout) as response:
+            match = re.match(r'bytes\s+\d+-\d+/(\d+)', response.headers.get('content-range', ''))
+            if response.status_code == 206 and match:
+                return int(match.group(1))
+            if response.status_code == 200 and response.headers.get('content-length', '').isdigit():
+                return int(response.headers['content-length']) # Range ignored; the body is not read
+    except httpx.HTTPError as e:
+        logging.debug(f"Size probe failed for {url[:80]}: {e}")
     return None
 
-async def call_external_tiktok_api(api_config, original_url, proxies=None):
+
+async def probe_video_sizes(candidates, client_pool=None, proxies=None, timeout=VIDEO_SIZE_PROBE_TIMEOUT):
+    """
+    Sets 'size' (bytes, None if unknown) on every video URL candidate. Mirrors of the same quality
+    are taken to be the same file, so one candidate per quality is probed, all qualities in parallel,
+    over the pool's media client (see HttpClientPool.media_client).
+    """
+    first_per_quality = {}
+    for candidate in candidates:
+        first_per_quality.setdefault(candidate.get('quality'), candidate)
+    if client_pool is not None:
+        client = client_pool.media_client(proxies)
+        sizes = await asyncio.gather(*(_probe_video_size(client, candidate['url'], timeout)
+                                       for candidate in first_per_quality.values()))
+    else:
+        async with httpx.AsyncClient(proxy=_proxy_url(proxies), follow_redirects=True,
+                                     headers={'User-Agent': API_USER_AGENT}) as client:
+            sizes = await asyncio.gather(*(_probe_video_size(client, candidate['url'], timeout)
+                                           for candidate in first_per_quality.values()))
+    size_per_quality = dict(zip(first_per_quality, sizes))
+    for candidate in candidates:
+        candidate['size'] = size_per_quality[candidate.get('quality')]
+
+
+async def apply_quality_policy(result, quality_policy, client_pool=None, proxies=None):
+    """
+    Returns a video result with its 'video_url_candidates' in the order of `quality_policy` (sizes
+    probed first if the policy needs them) and 'nwm_video_url' set to the first of them. The result
+    passed in (possibly shared with the metadata cache) is not modified.
+    """
+    candidates = result.get('video_url_candidates') or []
+    if quality_policy is None or len(candidates) < 2:
+        return result
+    candidates = [dict(candidate) for candidate in candidates]
+    if quality_policy.needs_sizes:
+        # 'hd_under' only decides on the HD size
+        probed = [candidate for candidate in candidates
+                  if quality_policy.mode != 'hd_under' or candidate.get('quality') == 'hd']
+        await probe_video_sizes(probed, client_pool, proxies)
+    ordered = quality_policy.order(candidates)
+    chosen = ordered[0]
+    size_text = f", {chosen['size'] / 1024 / 1024:.1f} MB" if chosen.get('size') else ""
+    logging.info(f"Quality policy '{quality_policy.mode}' chose the {chosen.get('quality')} video URL{size_text} "
+                 f"for {result.get('original_url')}")
+    return dict(result, video_url_candidates=ordered, nwm_video_url=chosen['url'])
+
+
+# --- Typed Fetch Errors ---
+
+class FetchError(Exception):
+    """
+    Base class of the typed errors behind failed API calls.
+
+    `kind` matches the 'error_kind' of failed result dicts, `retryable` says whether the same
+    endpoint may succeed on another attempt and `trips_breaker` whether the failure counts
+    towards opening the endpoint's circuit breaker.
+    """
+    kind = 'internal'
+    retryable = False
+    trips_breaker = False
+
+    def __init__(self, reason, status_code=None, retry_after=None):
+        super().__init__(reason)
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class ApiConfigError(FetchError):
+    kind = 'config'
+
+
+class ApiAuthError(FetchError):
+    kind = 'auth'
+    trips_breaker = True
+
+
+class ApiRateLimitError(FetchError):
+    kind = 'rate_limit'
+    retryable = True
+
+
+class ApiServerError(FetchError):
+    kind = 'server'
+    retryable = True
+    trips_breaker = True
+
+
+class ApiHttpError(FetchError):
+    kind = 'http'
+
+
+class ApiTimeoutError(FetchError):
+    kind = 'timeout'
+    retryable = True
+    trips_breaker = True
+
+
+class ApiNetworkError(FetchError):
+    kind = 'network'
+    retryable = True
+    trips_breaker = True
+
+
+class ApiResponseError(FetchError):
+    kind = 'response'
+
+
+class DeadlineExceededError(FetchError):
+    kind = 'deadline'
+
+
+FETCH_ERROR_CLASSES = {error_class.kind: error_class for error_class in (
+    FetchError, ApiConfigError, ApiAuthError, ApiRateLimitError, ApiServerError, ApiHttpError,
+    ApiTimeoutError, ApiNetworkError, ApiResponseError, DeadlineExceededError)}
+
+
+def fetch_error_from_result(result):
+    """Builds the typed FetchError for a failed call_external_tiktok_api result."""
+    error_class = FETCH_ERROR_CLASSES.get(result.get('error_kind'), FetchError)
+    return error_class(result.get('reason', '请求失败'), status_code=result.get('status_code'),
+                       retry_after=(result.get('rate_limit') or {}).get('retry_after'))
+
+
+# --- Retry Policy and Deadlines ---
+
+class Deadline:
+    """Overall time budget for one URL, shared by every endpoint and retry."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        """Seconds left (never negative)."""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def cap(self, seconds):
+        """Limits a timeout or wait to the remaining budget."""
+        return min(seconds, self.remaining())
+
+
+class RetryPolicy:
+    """
+    Retry settings for API calls: up to `max_attempts` calls per endpoint for retryable
+    errors, exponential backoff with full jitter between them, and a per-URL deadline
+    (`url_deadline` seconds) covering all endpoints and retries.
+    """
+
+    def __init__(self, max_attempts=RETRY_MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY,
+                 max_delay=RETRY_MAX_DELAY, url_deadline=URL_DEADLINE_SECONDS):
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.url_deadline = url_deadline
+
+    def backoff(self, attempt):
+        """Delay before retry number `attempt` (1-based): uniform in [0, min(max_delay, base * 2^(attempt-1))]."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+    def new_deadline(self):
+        return Deadline(self.url_deadline)
+
+
+def _payload_failure_class(response_data, default=None):
+    """Returns 'unavailable' if the provider's message says the post is gone, otherwise `default`."""
+    if not isinstance(response_data, dict):
+        return default
+    sources = [response_data]
+    if isinstance(response_data.get('data'), dict):
+        sources.append(response_data['data'])
+    for source in sources:
+        for key in PAYLOAD_MESSAGE_KEYS:
+            message = source.get(key)
+            if isinstance(message, str) and UNAVAILABLE_MESSAGE_RE.search(message) and not REQUEST_MESSAGE_RE.search(message):
+                return 'unavailable'
+    return default
+
+
+async def _send_api_request(client, method, api_url, headers, params, data, timeout):
+    """Sends the API request with the given client and returns the response."""
+    if method == 'POST':
+        return await client.post(api_url, headers=headers, json=data, timeout=timeout) # Send data as JSON
+    return await client.get(api_url, headers=headers, params=params, timeout=timeout)
+
+
+async def call_external_tiktok_api(api_config, original_url, proxies=None, client_pool=None, timeout=API_REQUEST_TIMEOUT):
     """
     Calls a specific external TikTok download API endpoint using its configuration.
 
     Args:
         api_config (dict): A dictionary containing the API configuration
-                           (name, url, key, host, param_name, method).
+                           (name, url, key, host, param_name, method, optional field_map).
         original_url (str): The TikTok video/album URL to analyze.
         proxies (dict, optional): Dictionary of proxies for the HTTP request. Defaults to None.
+        client_pool (HttpClientPool, optional): Shared client pool. If None, a one-off client is used.
+        timeout (float, optional): Request timeout in seconds. Defaults to API_REQUEST_TIMEOUT.
 
     Returns:
         dict: A dictionary containing video/album information or an error dictionary.
               Includes 'status': 'success' or 'failed', and 'reason' on failure.
+              Failures also carry 'error_kind': 'auth', 'rate_limit', 'server', 'http', 'timeout',
+              'network', 'response', 'config' or 'internal'. Once a response was received,
+              'rate_limit' holds its parsed rate limit headers (see _parse_rate_limit_headers).
+              'failure_class' is set for failures that will not change on a retry
+              ('unavailable' or 'no_media', see PERMANENT_FAILURE_CLASSES); 'no_media' only when
+              the payload describes the post (carries its ID), not for provider error envelopes.
     """
     api_name = api_config.get('name', 'Unnamed API')
     api_url = api_config.get('url')
@@ -64,13 +605,13 @@ async def call_external_tiktok_api(api_config, original_url, proxies=None):
 
     if not api_url:
         logging.error(f"API '{api_name}' is missing 'url' in configuration.")
-        return {'status': 'failed', 'reason': f"API '{api_name}' 配置缺少 URL", 'original_url': original_url}
+        return {'status': 'failed', 'reason': f"API '{api_name}' 配置缺少 URL", 'original_url': original_url, 'error_kind': 'config'}
 
     logging.info(f"Calling API '{api_name}' ({method} {api_url}) for TikTok URL: {original_url}")
     start_time = time.time()
 
     headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+        'User-Agent': API_USER_AGENT
     }
     # Add RapidAPI headers if key and host are provided
     if api_key and api_host:
@@ -95,39 +636,46 @@ async def call_external_tiktok_api(api_config, original_url, proxies=None):
         headers['Content-Type'] = 'application/json' # Assume JSON post
     else:
         logging.error(f"Unsupported HTTP method '{method}' for API '{api_name}'.")
-        return {'status': 'failed', 'reason': f"不支持的 HTTP 方法: {method}", 'original_url': original_url}
+        return {'status': 'failed', 'reason': f"不支持的 HTTP 方法: {method}", 'original_url': original_url, 'error_kind': 'config'}
 
     logging.debug(f"  Request Headers: {headers}")
     logging.debug(f"  Request Params (GET): {params}")
     logging.debug(f"  Request Data (POST): {data}")
 
     response_data = {} # Initialize response_data
+    rate_limit_info = None # Retry-After / x-ratelimit-* hints, passed back so the caller can pace this endpoint
 
     try:
-        async with httpx.AsyncClient(proxies=proxies, follow_redirects=True, timeout=60) as client:
-            if method == 'GET':
-                response = await client.get(api_url, headers=headers, params=params)
-            elif method == 'POST':
-                response = await client.post(api_url, headers=headers, json=data) # Send data as JSON
+        if client_pool is not None:
+            client = client_pool.get_client(api_url, proxies)
+            response = await _send_api_request(client, method, api_url, headers, params, data, timeout)
+        else:
+            async with httpx.AsyncClient(proxy=_proxy_url(proxies), follow_redirects=True, timeout=timeout) as client:
+                response = await _send_api_request(client, method, api_url, headers, params, data, timeout)
 
-            logging.debug(f"API '{api_name}' response status code for {original_url}: {response.status_code}")
+        logging.debug(f"API '{api_name}' response status code for {original_url}: {response.status_code}")
+        rate_limit_info = _parse_rate_limit_headers(response.headers)
 
-            # Check for non-JSON content types first
-            content_type = response.headers.get('content-type', '').lower()
-            if 'application/json' not in content_type:
-                 logging.error(f"API '{api_name}' returned non-JSON content type: {content_type} for {original_url}. Response text: {response.text[:500]}")
-                 return {'status': 'failed', 'reason': f"API '{api_name}' 返回非 JSON 内容 ({content_type})", 'original_url': original_url}
+        # Check for non-JSON content types first
+        content_type = response.headers.get('content-type', '').lower()
+        if 'application/json' not in content_type:
+             logging.error(f"API '{api_name}' returned non-JSON content type: {content_type} for {original_url}. Response text: {response.text[:500]}")
+             # An HTML error page from a failing gateway is still an HTTP error, classify it by status
+             status_code = response.status_code if response.status_code >= 400 else None
+             return {'status': 'failed', 'reason': f"API '{api_name}' 返回非 JSON 内容 ({content_type})", 'original_url': original_url,
+                     'status_code': status_code, 'error_kind': _http_error_kind(status_code) if status_code else 'response',
+                     'rate_limit': rate_limit_info}
 
-            # Attempt to parse JSON, handle potential errors
-            try:
-                response_data = response.json()
-                logging.debug(f"API '{api_name}' response JSON for {original_url}: {json.dumps(response_data, indent=2)}") # Pretty print JSON
-            except json.JSONDecodeError as e_json:
-                logging.error(f"Failed to decode JSON response from API '{api_name}' for {original_url}. Error: {e_json}. Response text: {response.text[:500]}")
-                return {'status': 'failed', 'reason': f"API '{api_name}' 返回无效 JSON", 'original_url': original_url}
+        # Attempt to parse JSON, handle potential errors
+        try:
+            response_data = response.json()
+            logging.debug(f"API '{api_name}' response JSON for {original_url}: {json.dumps(response_data, indent=2)}") # Pretty print JSON
+        except json.JSONDecodeError as e_json:
+            logging.error(f"Failed to decode JSON response from API '{api_name}' for {original_url}. Error: {e_json}. Response text: {response.text[:500]}")
+            return {'status': 'failed', 'reason': f"API '{api_name}' 返回无效 JSON", 'original_url': original_url, 'error_kind': 'response', 'rate_limit': rate_limit_info}
 
-            # Raise exception for 4xx or 5xx status codes AFTER attempting to get JSON error message
-            response.raise_for_status()
+        # Raise exception for 4xx or 5xx status codes AFTER attempting to get JSON error message
+        response.raise_for_status()
 
         analyze_time = format((time.time() - start_time), '.4f')
 
@@ -137,23 +685,25 @@ async def call_external_tiktok_api(api_config, original_url, proxies=None):
         if not isinstance(source_dict, dict):
              # If even after checking 'data', we don't have a dict, fail
              logging.error(f"Could not find usable dictionary in API '{api_name}' response for {original_url}. Response: {response_data}")
-             return {'status': 'failed', 'reason': f"API '{api_name}' 响应格式无法识别", 'original_url': original_url}
+             return {'status': 'failed', 'reason': f"API '{api_name}' 响应格式无法识别", 'original_url': original_url, 'error_kind': 'response', 'rate_limit': rate_limit_info,
+                     'failure_class': _payload_failure_class(response_data)}
 
         # --- Determine if it's an album or video ---
         # Heuristic: Look for album-specific keys or check a type indicator if provided by API
-        album_list = _get_nested_value(source_dict, METADATA_KEYS['album_list'])
+        extractor = get_response_extractor(api_config)
+        album_list = extractor.get('album_list', source_dict)
         is_album = bool(album_list) and isinstance(album_list, list) and len(album_list) > 0
         url_type = 'album' if is_album else 'video'
         logging.info(f"Determined type based on API '{api_name}' response: {url_type}")
 
         # --- Extract common metadata ---
-        aweme_id = _get_nested_value(source_dict, METADATA_KEYS['aweme_id'])
-        title = _get_nested_value(source_dict, METADATA_KEYS['title'])
-        author_nickname = _get_nested_value(source_dict, METADATA_KEYS['author_nickname'])
-        author_id = _get_nested_value(source_dict, METADATA_KEYS['author_id'])
-        create_time = _get_nested_value(source_dict, METADATA_KEYS['create_time'])
-        music_title = _get_nested_value(source_dict, METADATA_KEYS['music_title'])
-        cover_url = _get_nested_value(source_dict, METADATA_KEYS['cover_url'])
+        aweme_id = extractor.get('aweme_id', source_dict)
+        title = extractor.get('title', source_dict)
+        author_nickname = extractor.get('author_nickname', source_dict)
+        author_id = extractor.get('author_id', source_dict)
+        create_time = extractor.get('create_time', source_dict)
+        music_title = extractor.get('music_title', source_dict)
+        cover_url = extractor.get('cover_url', source_dict)
 
         result_data = {
             'status': 'success',
@@ -162,6 +712,7 @@ async def call_external_tiktok_api(api_config, original_url, proxies=None):
             'platform': 'tiktok',
             'original_url': original_url,
             'cover_url': cover_url, # Common cover URL
+            'rate_limit': rate_limit_info,
         }
 
         if is_album:
@@ -172,13 +723,14 @@ async def call_external_tiktok_api(api_config, original_url, proxies=None):
                     if isinstance(item, str) and item.startswith('http'):
                         valid_album_urls.append(item)
                     elif isinstance(item, dict): # Handle cases where images are dicts with a URL key
-                        img_url = _get_nested_value(item, ['url', 'imageURL', 'src']) # Common keys for URL within image object
+                        img_url = extractor.get('album_image_url', item) # Common keys for URL within image object
                         if isinstance(img_url, str) and img_url.startswith('http'):
                             valid_album_urls.append(img_url)
 
             if not valid_album_urls:
                 logging.error(f"API '{api_name}' indicated album, but no valid image URLs found in list for {original_url}. List: {album_list}")
-                return {'status': 'failed', 'reason': f"API '{api_name}' 返回无效图集列表", 'original_url': original_url}
+                return {'status': 'failed', 'reason': f"API '{api_name}' 返回无效图集列表", 'original_url': original_url, 'error_kind': 'response', 'rate_limit': rate_limit_info,
+                        'failure_class': _payload_failure_class(response_data, 'no_media' if aweme_id else None)}
 
             result_data.update({
                 'album_aweme_id': aweme_id,
@@ -193,18 +745,22 @@ async def call_external_tiktok_api(api_config, original_url, proxies=None):
             logging.info(f"API '{api_name}' successfully fetched album info for {original_url}")
         else:
             # --- Video: Find the NWM URL ---
-            nwm_video_url = _get_nested_value(source_dict, NWM_VIDEO_URL_KEYS)
+            # Every playable URL is kept: the downloader races mirrors and falls back when one is refused
+            video_candidates = video_url_candidates(extractor, source_dict)
+            nwm_video_url = video_candidates[0]['url'] if video_candidates else None
 
-            if not nwm_video_url or not isinstance(nwm_video_url, str) or not nwm_video_url.startswith('http'):
-                logging.error(f"Could not find a valid NWM video URL in API '{api_name}' response for {original_url}. Keys tried: {NWM_VIDEO_URL_KEYS}")
+            if not nwm_video_url:
+                logging.error(f"Could not find a valid NWM video URL in API '{api_name}' response for {original_url}. Keys tried: {[key_path.path for key_path in extractor.field_paths['nwm_video_url']]}")
                 logging.debug(f"Full API source_dict from '{api_name}': {source_dict}")
-                return {'status': 'failed', 'reason': f"API '{api_name}' 响应缺少 NWM 视频 URL", 'original_url': original_url}
+                return {'status': 'failed', 'reason': f"API '{api_name}' 响应缺少 NWM 视频 URL", 'original_url': original_url, 'error_kind': 'response', 'rate_limit': rate_limit_info,
+                        'failure_class': _payload_failure_class(response_data, 'no_media' if aweme_id else None)}
 
             result_data.update({
                 'video_aweme_id': aweme_id,
                 'video_title': title,
                 'video_bytes': None, # External APIs provide URL, not bytes
-                'nwm_video_url': nwm_video_url, # The found NWM URL
+                'nwm_video_url': nwm_video_url, # The found NWM URL (best quality first)
+                'video_url_candidates': video_candidates, # All found NWM URLs with their quality labels
                 'video_author_nickname': author_nickname,
                 'video_author_id': author_id,
                 'video_create_time': create_time,
@@ -233,21 +789,821 @@ async def call_external_tiktok_api(api_config, original_url, proxies=None):
             reason = f"API '{api_name}' 速率限制"
         elif e_http.response.status_code >= 500:
             reason = f"API '{api_name}' 服务器错误"
-        return {'status': 'failed', 'reason': reason, 'original_url': original_url, 'status_code': e_http.response.status_code} # Include status code
+        # A 404/410 alone may be a wrong endpoint path; only the provider's message can say the post is gone
+        failure_class = None
+        if e_http.response.status_code in (400, 404, 410, 451):
+            failure_class = _payload_failure_class(response_data)
+            if failure_class == 'unavailable':
+                reason = f"API '{api_name}' 作品不可用: {error_detail}"
+        return {'status': 'failed', 'reason': reason, 'original_url': original_url, 'status_code': e_http.response.status_code, # Include status code
+                'error_kind': _http_error_kind(e_http.response.status_code), 'rate_limit': rate_limit_info,
+                'failure_class': failure_class}
     except httpx.TimeoutException as e_timeout:
         logging.error(f"API '{api_name}' Timeout for {original_url}: {e_timeout}")
-        return {'status': 'failed', 'reason': f"API '{api_name}' 请求超时", 'original_url': original_url, 'status_code': None}
+        return {'status': 'failed', 'reason': f"API '{api_name}' 请求超时", 'original_url': original_url, 'status_code': None, 'error_kind': 'timeout'}
     except httpx.RequestError as e_req:
         logging.error(f"API '{api_name}' Request Error for {original_url}: {e_req}")
-        return {'status': 'failed', 'reason': f"API '{api_name}' 网络或请求错误", 'original_url': original_url, 'status_code': None}
+        return {'status': 'failed', 'reason': f"API '{api_name}' 网络或请求错误", 'original_url': original_url, 'status_code': None, 'error_kind': 'network'}
     except Exception as e:
         logging.exception(f"General Error calling API '{api_name}' for {original_url}: {e}")
-        return {'status': 'failed', 'reason': f"处理 API '{api_name}' 时发生内部错误", 'original_url': original_url, 'status_code': None}
+        return {'status': 'failed', 'reason': f"处理 API '{api_name}' 时发生内部错误", 'original_url': original_url, 'status_code': None, 'error_kind': 'internal'}
+
+
+# --- URL Normalization ---
+
+# Known TikTok URL shapes, compiled once
+TIKTOK_POST_URL_RE = re.compile(
+    r'^https?://(?:www\.|m\.)?tiktok\.com/@(?P<user>[^/?#]+)/(?P<kind>video|photo)/(?P<id>\d+)', re.IGNORECASE)
+TIKTOK_ID_URL_RE = re.compile(
+    r'^https?://(?:www\.|m\.)?tiktok\.com/(?:v|embed(?:/v2)?|share/video)/(?P<id>\d+)', re.IGNORECASE)
+TIKTOK_SHORT_URL_RE = re.compile(
+    r'^https?://(?:(?:vm|vt)\.tiktok\.com/[\w-]+|(?:www\.|m\.)?tiktok\.com/t/[\w-]+)/?(?:[?#].*)?$', re.IGNORECASE)
+TIKTOK_HOST_RE = re.compile(r'^(?:[\w-]+\.)*tiktok\.com$', re.IGNORECASE)
+# Share texts wrap the link in prose: any http(s) URL, or a bare tiktok.com link that does not start mid-hostname
+URL_IN_TEXT_RE = re.compile(r'https?://\S+|(?<![\w./-])(?:[\w-]+\.)*tiktok\.com/\S*', re.IGNORECASE)
+
+
+def _match_tiktok_post(url):
+    """
+    Matches a full (non-short) TikTok post URL.
+
+    Returns:
+        tuple: (canonical_url, aweme_id, url_type) or None if `url` is not a known post shape.
+    """
+    match = TIKTOK_POST_URL_RE.match(url)
+    if match:
+        kind = match.group('kind').lower()
+        canonical = f"https://www.tiktok.com/@{match.group('user')}/{kind}/{match.group('id')}"
+        return canonical, match.group('id'), 'album' if kind == 'photo' else 'video'
+    match = TIKTOK_ID_URL_RE.match(url)
+    if match:
+        return f"https://www.tiktok.com/v/{match.group('id')}", match.group('id'), None
+    return None
+
+
+class UrlNormalizer:
+    """
+    Pre-fetch stage turning user input into canonical TikTok post URLs before any API call.
+
+    Known shapes are parsed with precompiled patterns; short links (vm./vt.tiktok.com, /t/)
+    are resolved with HEAD requests that only read the redirect target, over the shared
+    client pool, and remembered in an in-memory LRU cache. Inputs that are clearly not
+    TikTok URLs are rejected locally.
+    """
+
+    def __init__(self, client_pool=None, proxies=None, cache_size=SHORT_LINK_CACHE_SIZE,
+                 concurrency=SHORT_LINK_CONCURRENCY):
+        self.client_pool = client_pool
+        self.proxies = proxies
+        self.cache_size = cache_size
+        self.concurrency = concurrency
+        self._resolved = OrderedDict() # short link -> resolved URL (or None when resolution failed)
+
+    async def _resolve_short_link(self, url):
+        """Follows the redirects of a short link without downloading the target page."""
+        key = url.split('?', 1)[0].split('#', 1)[0].rstrip('/').lower()
+        if key in self._resolved:
+            self._resolved.move_to_end(key)
+            return self._resolved[key]
+
+        resolved = None
+        current_url = url
+        try:
+            if self.client_pool is not None:
+                client, one_off_client = self.client_pool.get_client(url, self.proxies), None
+            else:
+                client = one_off_client = httpx.AsyncClient(proxy=_proxy_url(self.proxies), timeout=SHORT_LINK_TIMEOUT,
+                                                            headers={'User-Agent': API_USER_AGENT})
+            try:
+                for _ in range(SHORT_LINK_MAX_REDIRECTS):
+                    response = await client.head(current_url, follow_redirects=False, timeout=SHORT_LINK_TIMEOUT)
+                    if response.status_code == 405: # Some edges refuse HEAD; GET without reading the body
+                        async with client.stream('GET', current_url, follow_redirects=False, timeout=SHORT_LINK_TIMEOUT) as response:
+                            pass
+                    location = response.headers.get('location')
+                    if not response.is_redirect or not location:
+                        break
+                    current_url = str(response.url.join(location))
+                    if _match_tiktok_post(current_url):
+                        resolved = current_url
+                        break
+            finally:
+                if one_off_client is not None:
+                    await one_off_client.aclose()
+        except httpx.HTTPError as e:
+            logging.warning(f"Could not resolve short link {url}: {e}")
+            return None # Not cached, a later attempt may succeed
+
+        if resolved is None:
+            logging.warning(f"Short link {url} did not redirect to a known TikTok post URL (last: {current_url}).")
+        self._resolved[key] = resolved
+        if len(self._resolved) > self.cache_size:
+            self._resolved.popitem(last=False)
+        return resolved
+
+    async def normalize(self, raw_input):
+        """
+        Normalizes a single input line.
+
+        Returns:
+            dict: 'input' (the raw line), 'url' (what to send to the API), 'aweme_id' and
+                  'url_type' (None when unknown), 'status' ('ok' or 'rejected') and 'reason'.
+        """
+        entry = {'input': raw_input, 'url': None, 'aweme_id': None, 'url_type': None, 'status': 'ok', 'reason': None}
+        text = (raw_input or '').strip()
+        url = None
+        for found in URL_IN_TEXT_RE.finditer(text): # First link whose host really is TikTok
+            candidate = found.group(0).rstrip('.,;:!?)]}>"\'，。')
+            if not candidate.lower().startswith(('http://', 'https://')):
+                candidate = 'https://' + candidate
+            if TIKTOK_HOST_RE.match(urlsplit(candidate).hostname or ''):
+                url = candidate
+                break
+        if url is None:
+            entry.update(status='rejected', reason='不是 TikTok 链接')
+            return entry
+
+        if TIKTOK_SHORT_URL_RE.match(url):
+            resolved = await self._resolve_short_link(url)
+            if resolved is None:
+                entry['url'] = url # Let the API try to resolve it
+                return entry
+            url = resolved
+
+        post = _match_tiktok_post(url)
+        if post:
+            entry['url'], entry['aweme_id'], entry['url_type'] = post
+        else:
+            # A tiktok.com URL of an unknown shape: pass it on without tracking parameters
+            parts = urlsplit(url)
+            entry['url'] = f"https://{parts.netloc.lower()}{parts.path}"
+        return entry
+
+    async def normalize_batch(self, raw_inputs):
+        """
+        Normalizes a whole batch and marks duplicates of the same post.
+
+        Returns:
+            list: One entry per input (see normalize()). Duplicates get status 'duplicate'
+                  and 'duplicate_of', the index of the first input for the same post.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def normalize_limited(raw_input):
+            async with semaphore:
+                return await self.normalize(raw_input)
+
+        entries = await asyncio.gather(*(normalize_limited(raw_input) for raw_input in raw_inputs))
+        first_seen = {}
+        for index, entry in enumerate(entries):
+            if entry['status'] != 'ok':
+                continue
+            key = entry['aweme_id'] or entry['url']
+            if key in first_seen:
+                entry.update(status='duplicate', duplicate_of=first_seen[key], reason='重复链接')
+            else:
+                first_seen[key] = index
+        return entries
+
+
+# --- Hedged Requests ---
+
+class HedgePolicy:
+    """
+    Opt-in hedging for fetch_tiktok_info.
+
+    If the endpoint currently being tried has not produced a valid result within the hedge delay
+    (a latency percentile of recent successful endpoint calls), the same URL is also sent to the
+    next endpoint and the first valid result wins. `budget` caps the number of extra (hedge) API
+    calls for the lifetime of the policy, so create one policy per batch.
+    """
+
+    def __init__(self, percentile=HEDGE_DEFAULT_PERCENTILE, budget=HEDGE_DEFAULT_BUDGET,
+                 initial_delay=HEDGE_INITIAL_DELAY, min_delay=HEDGE_MIN_DELAY,
+                 window=HEDGE_LATENCY_WINDOW):
+        """
+        Args:
+            percentile (float): Latency percentile (0-1) after which a hedge request is sent.
+            budget (int, optional): Maximum number of hedge requests per batch. None means unlimited.
+            initial_delay (float): Hedge delay used until enough latency samples are collected.
+            min_delay (float): Lower bound for the hedge delay in seconds.
+            window (int): Number of recent latency samples kept.
+        """
+        self.percentile = min(max(percentile, 0.0), 1.0)
+        self.budget = budget
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self._latencies = deque(maxlen=window)
+        self.hedges_sent = 0
+        self.hedges_won = 0
+
+    def record_latency(self, seconds):
+        """Records the latency of a successful endpoint call."""
+        self._latencies.append(seconds)
+
+    def hedge_delay(self):
+        """Returns how long to wait for the in-flight endpoint before hedging to the next one."""
+        if len(self._latencies) < HEDGE_MIN_SAMPLES:
+            return max(self.initial_delay, self.min_delay)
+        samples = sorted(self._latencies)
+        index = max(math.ceil(self.percentile * len(samples)) - 1, 0)
+        return max(samples[index], self.min_delay)
+
+    def try_spend(self):
+        """Consumes one hedge from the budget. Returns False if the budget is exhausted."""
+        if self.budget is not None and self.hedges_sent >= self.budget:
+            return False
+        self.hedges_sent += 1
+        return True
+
+
+# --- Adaptive Endpoint Ranking ---
+
+class EndpointScoreboard:
+    """
+    Per-endpoint live statistics used to rank api_endpoint_configs for every call.
+
+    Tracks, as exponentially weighted moving averages, the latency of each API call, the success
+    ratio, the "success but missing data" ratio and the HTTP 429 rate. Endpoints are ranked by
+    expected time to a valid result (latency / success ratio, penalised by 429s and missing data).
+    Endpoints without recent samples keep their configured position relative to each other and
+    are scored like an average endpoint, so they still get traffic and can recover.
+    The scoreboard can be persisted to a JSON file between runs with load()/save().
+    """
+
+    OUTCOMES = ('success', 'missing_data', 'rate_limited', 'failed')
+
+    def __init__(self, path=None, alpha=SCOREBOARD_EWMA_ALPHA):
+        """
+        Args:
+            path (str, optional): JSON file used by load()/save(). Loaded immediately if it exists.
+            alpha (float): EWMA smoothing factor (weight of the newest sample).
+        """
+        self.path = path
+        self.alpha = alpha
+        self._stats = {}
+        if path:
+            self.load()
+
+    def record(self, api_name, latency, outcome):
+        """
+        Records one API call.
+
+        Args:
+            api_name (str): Endpoint name.
+            latency (float): Seconds the call took.
+            outcome (str): One of 'success', 'missing_data', 'rate_limited' or 'failed'.
+        """
+        stats = self._stats.get(api_name)
+        if stats is None:
+            # First sample initialises the averages directly
+            stats = {
+                'calls': 0,
+                'latency_ewma': latency,
+                'success_ratio': 1.0 if outcome == 'success' else 0.0,
+                'missing_data_ratio': 1.0 if outcome == 'missing_data' else 0.0,
+                'rate_limit_ratio': 1.0 if outcome == 'rate_limited' else 0.0,
+            }
+            self._stats[api_name] = stats
+        else:
+            a = self.alpha
+            stats['latency_ewma'] += a * (latency - stats['latency_ewma'])
+            stats['success_ratio'] += a * ((1.0 if outcome == 'success' else 0.0) - stats['success_ratio'])
+            stats['missing_data_ratio'] += a * ((1.0 if outcome == 'missing_data' else 0.0) - stats['missing_data_ratio'])
+            stats['rate_limit_ratio'] += a * ((1.0 if outcome == 'rate_limited' else 0.0) - stats['rate_limit_ratio'])
+        stats['calls'] += 1
+        stats['updated_at'] = time.time()
+
+    def get_stats(self, api_name):
+        """Returns a copy of the statistics for `api_name`, or None if it has never been called."""
+        stats = self._stats.get(api_name)
+        return dict(stats) if stats else None
+
+    def score(self, api_name):
+        """
+        Returns the expected seconds to a valid result for `api_name` (lower is better),
+        or None if there are not enough recent samples.
+        """
+        stats = self._stats.get(api_name)
+        if not stats or stats['calls'] < SCOREBOARD_MIN_CALLS:
+            return None
+        if time.time() - stats.get('updated_at', 0) > SCOREBOARD_STALE_SECONDS:
+            return None # Old data: give the endpoint a fresh chance
+        expected = stats['latency_ewma'] / max(stats['success_ratio'], 0.05)
+        return expected * (1.0 + stats['rate_limit_ratio']) * (1.0 + stats['missing_data_ratio'])
+
+    def rank(self, api_endpoint_configs):
+        """Returns api_endpoint_configs reordered so the fastest healthy endpoint comes first."""
+        scores = [self.score(cfg.get('name', 'Unnamed API')) for cfg in api_endpoint_configs]
+        known = sorted(s for s in scores if s is not None)
+        prior = known[len(known) // 2] if known else 0.0 # Median: unsampled endpoints rank as average
+        order = sorted(range(len(api_endpoint_configs)),
+                       key=lambda i: (scores[i] if scores[i] is not None else prior, i))
+        return [api_endpoint_configs[i] for i in order]
+
+    def load(self):
+        """Loads statistics from self.path. Missing or invalid files leave the scoreboard empty."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                self._stats = {name: stats for name, stats in data.items() if isinstance(stats, dict) and 'latency_ewma' in stats}
+            logging.debug(f"Loaded endpoint statistics for {len(self._stats)} API(s) from {self.path}")
+        except (IOError, ValueError) as e:
+            logging.warning(f"Could not load endpoint statistics from {self.path}: {e}")
+
+    def save(self):
+        """Writes statistics to self.path atomically."""
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._stats, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            logging.debug(f"Saved endpoint statistics to {self.path}")
+        except (IOError, OSError) as e:
+            logging.warning(f"Could not save endpoint statistics to {self.path}: {e}")
+
+
+# --- Per-Endpoint Circuit Breaker ---
+
+class CircuitBreaker:
+    """
+    Circuit breaker for a single API endpoint.
+
+    closed:    requests flow normally; consecutive tripping failures are counted.
+    open:      the endpoint is skipped instantly until the cool-down period has passed.
+    half_open: a single probe request is let through; success closes the breaker,
+               a tripping failure opens it again for another cool-down period.
+    Only provider-side failures (FetchError classes with trips_breaker) count towards tripping;
+    any other answer (e.g. 404, 429 or "missing data") shows the provider is alive.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, api_name, failure_threshold=BREAKER_FAILURE_THRESHOLD,
+                 cooldown=BREAKER_COOLDOWN_SECONDS, on_event=None):
+        self.api_name = api_name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.on_event = on_event
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def _emit(self, event, reason=None):
+        logging.info(f"Circuit breaker for API '{self.api_name}': {event} (state: {self.state}, reason: {reason})")
+        if self.on_event:
+            try:
+                self.on_event({'api_name': self.api_name, 'event': event, 'state': self.state,
+                               'reason': reason, 'cooldown': self.cooldown})
+            except Exception as e:
+                logging.error(f"Circuit breaker event callback failed: {e}")
+
+    def allow_request(self):
+        """Returns True if a request may be sent to the endpoint now."""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+            self._emit('half_open')
+        # Half-open: only one probe at a time
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self):
+        """Records a response showing the endpoint is healthy."""
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+        if self.state != self.CLOSED:
+            self.state = self.CLOSED
+            self._emit('recovered')
+
+    def record_failure(self, error_kind, reason=None):
+        """Records a failed call. Only tripping error kinds count towards opening the breaker."""
+        if not FETCH_ERROR_CLASSES.get(error_kind, FetchError).trips_breaker:
+            self.record_success()
+            return
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._emit('reopened', reason)
+        elif self.state == self.CLOSED and self.consecutive_failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._emit('tripped', reason)
+
+    def release_probe(self):
+        """Frees the half-open probe slot if the probe ended without an outcome (e.g. it was cancelled)."""
+        self._probe_in_flight = False
+
+
+class CircuitBreakerRegistry:
+    """
+    Holds one CircuitBreaker per API endpoint name. `on_event` is called with an event dict
+    (api_name, event, state, reason, cooldown) whenever a breaker trips, probes or recovers.
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN_SECONDS, on_event=None):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.on_event = on_event
+        self._breakers = {}
+
+    def get(self, api_name):
+        """Returns the breaker for `api_name`, creating a closed one on first use."""
+        breaker = self._breakers.get(api_name)
+        if breaker is None:
+            breaker = CircuitBreaker(api_name, self.failure_threshold, self.cooldown, self.on_event)
+            self._breakers[api_name] = breaker
+        return breaker
+
+
+# --- Per-Endpoint Rate Limiting ---
+
+def _parse_rate_limit_headers(headers):
+    """
+    Extracts rate limit hints from API response headers.
+    Understands `Retry-After` (seconds or HTTP date) and the `x-ratelimit-*` family, including
+    RapidAPI's `x-ratelimit-requests-*` names. Reset values may be seconds or a Unix timestamp.
+
+    Returns:
+        dict or None: {'retry_after', 'limit', 'remaining', 'reset'} (values may be None),
+                      or None if the response carried no rate limit headers.
+    """
+    info = {'retry_after': None, 'limit': None, 'remaining': None, 'reset': None}
+    found = False
+
+    retry_after = headers.get('retry-after')
+    if retry_after:
+        try:
+            info['retry_after'] = max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                info['retry_after'] = max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                logging.debug(f"Ignoring unparsable Retry-After header: {retry_after}")
+        found = info['retry_after'] is not None
+
+    for name, value in headers.items():
+        name = name.lower()
+        if not name.startswith('x-ratelimit-'):
+            continue
+        field = name.rsplit('-', 1)[-1]
+        if field not in ('limit', 'remaining', 'reset') or info[field] is not None:
+            continue # Keep the first (usually request-count) header of each kind
+        try:
+            number = float(value.split(',')[0].strip())
+        except ValueError:
+            continue
+        if field == 'reset' and number > RATE_LIMIT_EPOCH_THRESHOLD:
+            number = max(0.0, number - time.time()) # Unix timestamp -> seconds from now
+        info[field] = number
+        found = True
+
+    return info if found else None
+
+
+class TokenBucket:
+    """
+    Async token bucket limiting requests to one API endpoint.
+
+    `rate` is the configured number of requests per second (0 means unlimited) and `burst`
+    the number of requests that may be sent back to back. A 429 halves the current rate
+    (an unlimited bucket falls back to RATE_LIMIT_FALLBACK_RATE) and pauses the bucket for
+    the Retry-After period; each success then restores a little of the configured rate.
+    """
+
+    def __init__(self, rate=0.0, burst=1):
+        self.configured_rate = max(0.0, float(rate or 0))
+        self.burst = max(1, int(burst or 1))
+        self.rate = self.configured_rate
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.throttled_count = 0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        if self.rate > 0:
+            self.tokens = min(float(self.burst), self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def _wait_time(self, now):
+        """Seconds until a token is available, ignoring other waiters."""
+        wait = max(0.0, self.blocked_until - now)
+        if self.rate > 0 and self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    async def acquire(self, max_wait=None):
+        """
+        Waits for a token. Returns False if the token cannot be had within `max_wait` seconds
+        (also when a 429 pauses the bucket while waiting), so the caller can try another endpoint.
+        """
+        give_up_at = None if max_wait is None else time.monotonic() + max_wait
+        async with self._lock: # Reservations are handed out in order; nobody sleeps holding the lock
+            now = time.monotonic()
+            self._refill(now)
+            wait = self._wait_time(now)
+            if give_up_at is not None and now + wait > give_up_at:
+                return False
+            reserved = self.rate > 0
+            if reserved:
+                self.tokens -= 1 # May go negative: later callers queue behind this reservation
+        while wait > 0:
+            await asyncio.sleep(wait)
+            now = time.monotonic()
+            wait = max(0.0, self.blocked_until - now) # Paused again by a 429 while sleeping
+            if give_up_at is not None and now + wait > give_up_at:
+                if reserved:
+                    self.tokens += 1 # Hand the reservation back
+                return False
+        return True
+
+    def on_throttled(self, retry_after=None):
+        """Shrinks the rate after a 429 and pauses the bucket for `retry_after` seconds."""
+        self.throttled_count += 1
+        now = time.monotonic()
+        self._refill(now)
+        current_rate = self.rate if self.rate > 0 else RATE_LIMIT_FALLBACK_RATE
+        self.rate = max(RATE_LIMIT_MIN_RATE, current_rate * RATE_LIMIT_DECREASE_FACTOR)
+        self.tokens = min(self.tokens, 0.0)
+        pause = retry_after if retry_after is not None else 1.0 / self.rate
+        self.blocked_until = max(self.blocked_until, now + pause)
+        logging.warning(f"Rate limited: reducing request rate to {self.rate:.3f}/s, pausing {pause:.1f}s")
+
+    def on_success(self):
+        """Gradually restores the configured rate after throttling."""
+        if self.rate == self.configured_rate:
+            return
+        if self.configured_rate == 0:
+            # Unlimited endpoint: lift the fallback limit again once it has recovered well past it
+            self.rate = self.rate * (1 + RATE_LIMIT_RECOVERY_STEP)
+            if self.rate >= RATE_LIMIT_FALLBACK_RATE * 4:
+                self.rate = 0.0
+        else:
+            self.rate = min(self.configured_rate, self.rate + self.configured_rate * RATE_LIMIT_RECOVERY_STEP)
+
+    def observe(self, rate_limit_info):
+        """Applies `x-ratelimit-*` / `Retry-After` hints from a response (see _parse_rate_limit_headers)."""
+        if not rate_limit_info:
+            return
+        remaining, reset = rate_limit_info.get('remaining'), rate_limit_info.get('reset')
+        if remaining is not None and remaining < 1 and reset is not None:
+            # Quota exhausted: nothing will succeed before the window resets
+            self.blocked_until = max(self.blocked_until, time.monotonic() + reset)
+            logging.warning(f"Rate limit quota exhausted, pausing endpoint for {reset:.0f}s")
+        elif remaining is not None and reset:
+            # Spread the remaining quota over the rest of the window
+            quota_rate = max(RATE_LIMIT_MIN_RATE, remaining / reset)
+            if self.rate == 0 or quota_rate < self.rate:
+                self.rate = quota_rate
+
+
+class RateLimiterRegistry:
+    """Holds one TokenBucket per API endpoint, configured from its 'rate_per_second' and 'burst' keys."""
+
+    def __init__(self):
+        self._buckets = {}
+
+    def get(self, api_config):
+        """Returns the bucket for `api_config`, creating it on first use."""
+        api_name = api_config.get('name', 'Unnamed API')
+        bucket = self._buckets.get(api_name)
+        if bucket is None:
+            bucket = TokenBucket(api_config.get('rate_per_second', 0), api_config.get('burst', 1))
+            self._buckets[api_name] = bucket
+        return bucket
+
+
+# --- Request Coalescing ---
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into one in-flight task.
+
+    The first caller for a key starts the work; callers arriving while it runs await the
+    same result instead of repeating it. The key is released as soon as the task finishes,
+    so later calls start fresh (results are not cached here).
+    """
+
+    def __init__(self):
+        self._flights = {}
+
+    def __contains__(self, key):
+        return key in self._flights
+
+    async def do(self, key, coroutine_factory):
+        """
+        Runs `coroutine_factory()` unless a call for `key` is already in flight.
+
+        Returns:
+            tuple: (result, shared) where `shared` is True if the result came from another caller's call.
+        """
+        task = self._flights.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(coroutine_factory())
+            self._flights[key] = task
+            task.add_done_callback(lambda done_task: self._release(key, done_task))
+        # Shielded: a cancelled caller must not cancel the work other callers are waiting for
+        return await asyncio.shield(task), shared
+
+    def _release(self, key, task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
 
 
 # --- Main Fetcher Function (Uses Configured External API with Fallback and Retry) ---
 
-async def fetch_tiktok_info(original_url, api_endpoint_configs=None, proxies=None):
+async def _try_api_endpoint(api_config, original_url, proxies=None, client_pool=None, scoreboard=None, circuit_breakers=None,
+                            rate_limiters=None, retry_policy=None, deadline=None, on_attempt=None):
+    """
+    Tries a single API configuration, retrying retryable errors (see FetchError) with
+    exponential backoff and full jitter according to `retry_policy`.
+    Every call is recorded in `scoreboard` if one is given. If `circuit_breakers` is given,
+    an endpoint whose breaker is open is skipped without sending a request. If `rate_limiters`
+    is given, each request first waits for a token from the endpoint's bucket; an endpoint
+    throttled for longer than RATE_LIMIT_MAX_WAIT is skipped instead. Request timeouts and
+    waits never exceed what is left of `deadline`. `on_attempt` is called before each request
+    with {'api_name', 'attempt', 'max_attempts', 'remaining', 'last_error'}.
+
+    Returns:
+        tuple: (result_dict, None, None) with valid video/album data on success, or
+               (None, last_error_reason, failure_class) if this endpoint failed. `failure_class`
+               is one of PERMANENT_FAILURE_CLASSES if the endpoint says the post itself is gone.
+    """
+    api_name = api_config.get('name', 'Unnamed API')
+    retry_policy = retry_policy or RetryPolicy()
+    deadline = deadline or retry_policy.new_deadline()
+    last_error_reason = f"API '{api_name}' 请求失败"
+    last_error = None
+    failure_class = None
+    breaker = circuit_breakers.get(api_name) if circuit_breakers else None
+    bucket = rate_limiters.get(api_config) if rate_limiters else None
+
+    for attempt in range(1, retry_policy.max_attempts + 1):
+        if deadline.expired():
+            logging.warning(f"Deadline of {deadline.seconds:.0f}s reached for {original_url} before trying API '{api_name}'.")
+            return None, f"已超过单个链接的时间预算 ({deadline.seconds:.0f} 秒)", None
+        # Breaker first: a skipped endpoint must not use up (or wait for) rate limit quota
+        if breaker and not breaker.allow_request():
+            logging.info(f"Skipping API '{api_name}' for {original_url}: circuit breaker is {breaker.state}.")
+            return None, f"API '{api_name}' 已熔断，暂时跳过", None
+        try:
+            acquired = not bucket or await bucket.acquire(max_wait=deadline.cap(RATE_LIMIT_MAX_WAIT))
+        except asyncio.CancelledError:
+            if breaker: breaker.release_probe()
+            raise
+        if not acquired:
+            if breaker: breaker.release_probe() # No request was sent, so no half-open outcome either
+            logging.info(f"Skipping API '{api_name}' for {original_url}: rate limited for longer than the remaining wait budget.")
+            return None, f"API '{api_name}' 速率限制中，暂时跳过", None
+
+        if on_attempt:
+            on_attempt({'api_name': api_name, 'attempt': attempt, 'max_attempts': retry_policy.max_attempts,
+                        'remaining': deadline.remaining(), 'last_error': last_error})
+        logging.info(f"Attempting API '{api_name}' (Attempt {attempt}/{retry_policy.max_attempts}, "
+                     f"{deadline.remaining():.1f}s left) for URL: {original_url}")
+        call_start = time.monotonic()
+        try:
+            result = await call_external_tiktok_api(api_config, original_url, proxies=proxies, client_pool=client_pool,
+                                                    timeout=deadline.cap(API_REQUEST_TIMEOUT))
+        except asyncio.CancelledError:
+            if breaker: breaker.release_probe() # A cancelled (e.g. hedged) probe must not block the endpoint
+            raise
+        call_latency = time.monotonic() - call_start
+        if bucket:
+            bucket.observe(result.get('rate_limit'))
+            if result.get('error_kind') == ApiRateLimitError.kind:
+                # Every 429 slows the bucket down, whether or not this endpoint is retried
+                bucket.on_throttled((result.get('rate_limit') or {}).get('retry_after'))
+
+        if result.get('status') == 'success':
+            if breaker: breaker.record_success()
+            if bucket: bucket.on_success()
+            # Check if the successful result actually contains the necessary data
+            url_type = result.get('url_type')
+            if url_type == 'video' and result.get('nwm_video_url'):
+                logging.info(f"Success with API '{api_name}'. Found NWM video URL.")
+                if scoreboard: scoreboard.record(api_name, call_latency, 'success')
+                return result, None, None # Found valid video data
+            elif url_type == 'album' and result.get('album_list'):
+                logging.info(f"Success with API '{api_name}'. Found album list.")
+                if scoreboard: scoreboard.record(api_name, call_latency, 'success')
+                return result, None, None # Found valid album data
+            else:
+                # API reported success but didn't return the expected data
+                logging.warning(f"API '{api_name}' reported success but missing required data (NWM URL or album list). Trying next API.")
+                if scoreboard: scoreboard.record(api_name, call_latency, 'missing_data')
+                # Only a payload describing the post shows it has no media; anything else may be a provider error
+                has_post = result.get('video_aweme_id') or result.get('album_aweme_id')
+                return None, f"API '{api_name}' 成功但缺少数据", 'no_media' if has_post else None
+
+        # --- API call failed ---
+        last_error = fetch_error_from_result(result)
+        last_error_reason = last_error.reason
+        failure_class = result.get('failure_class')
+        if scoreboard: scoreboard.record(api_name, call_latency, 'rate_limited' if isinstance(last_error, ApiRateLimitError) else 'failed')
+        if breaker: breaker.record_failure(last_error.kind, last_error_reason)
+
+        if not last_error.retryable or attempt == retry_policy.max_attempts:
+            logging.warning(f"API '{api_name}' failed ({last_error.kind}) permanently or after retries. Reason: {last_error_reason}. Trying next API.")
+            break
+
+        # --- Backoff before retrying the same endpoint ---
+        if isinstance(last_error, ApiRateLimitError) and bucket:
+            delay = 0.0 # The bucket already holds back the retry for as long as the provider asked
+        else:
+            delay = max(retry_policy.backoff(attempt), last_error.retry_after or 0.0)
+        if delay >= deadline.remaining():
+            logging.warning(f"API '{api_name}' failed ({last_error.kind}); no time left in the {deadline.seconds:.0f}s budget to retry.")
+            break
+        logging.warning(f"API '{api_name}' failed with retryable error ({last_error.kind}, Status: {last_error.status_code}). Retrying in {delay:.2f}s...")
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    return None, last_error_reason, failure_class
+
+
+async def _fetch_hedged(original_url, api_endpoint_configs, proxies, client_pool, hedge_policy, scoreboard=None,
+                        circuit_breakers=None, rate_limiters=None, retry_policy=None, deadline=None, on_attempt=None):
+    """
+    Races endpoints according to `hedge_policy`. Returns (result, None, None) for the first valid result,
+    or (None, last_error_reason, failure_classes) if every endpoint failed. Losing requests are cancelled.
+    """
+    remaining = list(api_endpoint_configs)
+    pending = {} # task -> (api_name, start_time, is_hedge)
+    last_error_reason = "所有API尝试均失败"
+    failure_classes = [] # One per failed endpoint
+
+    def launch(is_hedge):
+        api_config = remaining.pop(0)
+        task = asyncio.create_task(_try_api_endpoint(api_config, original_url, proxies=proxies,
+                                                     client_pool=client_pool, scoreboard=scoreboard,
+                                                     circuit_breakers=circuit_breakers,
+                                                     rate_limiters=rate_limiters, retry_policy=retry_policy,
+                                                     deadline=deadline, on_attempt=on_attempt))
+        pending[task] = (api_config.get('name', 'Unnamed API'), time.monotonic(), is_hedge)
+
+    launch(is_hedge=False)
+    try:
+        while pending:
+            timeout = hedge_policy.hedge_delay() if remaining else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            if not done: # In-flight endpoint(s) slower than the hedge delay
+                if hedge_policy.try_spend():
+                    logging.info(f"No answer within {timeout:.2f}s for {original_url}. Hedging to API '{remaining[0].get('name', 'Unnamed API')}'.")
+                    launch(is_hedge=True)
+                    continue
+                logging.debug(f"Hedge budget exhausted; waiting for in-flight API for {original_url}.")
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                api_name, start_time, is_hedge = pending.pop(task)
+                result, error_reason, failure_class = task.result()
+                if result is not None:
+                    hedge_policy.record_latency(time.monotonic() - start_time)
+                    if is_hedge:
+                        hedge_policy.hedges_won += 1
+                        logging.info(f"Hedged request to API '{api_name}' won for {original_url}.")
+                    return result, None, None
+                last_error_reason = error_reason
+                failure_classes.append(failure_class)
+
+            if not pending and remaining and not (deadline and deadline.expired()):
+                launch(is_hedge=False) # Everything in flight failed: fall through to the next endpoint
+
+        if remaining: # Deadline hit with endpoints left untried: the URL stays retryable
+            last_error_reason = f"已超过单个链接的时间预算 ({deadline.seconds:.0f} 秒)，最后错误: {last_error_reason}"
+            failure_classes.append(None)
+        return None, last_error_reason, failure_classes
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def fetch_tiktok_info(original_url, api_endpoint_configs=None, proxies=None, client_pool=None, hedge_policy=None,
+                            scoreboard=None, circuit_breakers=None, rate_limiters=None, metadata_cache=None,
+                            aweme_id=None, single_flight=None, force_refresh=False, retry_policy=None, on_attempt=None):
     """
     Fetches TikTok video/album information using a list of external API configurations,
     trying them sequentially with retry logic until one succeeds in providing valid NWM data.
@@ -256,6 +1612,22 @@ async def fetch_tiktok_info(original_url, api_endpoint_configs=None, proxies=Non
         original_url (str): The TikTok video/album URL.
         api_endpoint_configs (list, optional): A list of API configuration dictionaries to try. Defaults to None.
         proxies (dict, optional): Dictionary of proxies for the HTTP request. Defaults to None.
+        client_pool (HttpClientPool, optional): Shared client pool reused across calls. Defaults to None.
+        hedge_policy (HedgePolicy, optional): Enables hedged requests across endpoints. Defaults to None (sequential).
+        scoreboard (EndpointScoreboard, optional): Records every call and reorders the endpoints
+            (fastest healthy first) before trying them. Defaults to None (configured order).
+        circuit_breakers (CircuitBreakerRegistry, optional): Skips endpoints whose breaker is open. Defaults to None.
+        rate_limiters (RateLimiterRegistry, optional): Paces requests per endpoint and backs off on 429. Defaults to None.
+        metadata_cache (metadata_cache.MetadataCache, optional): Returns a cached result for a URL resolved
+            earlier (marked with 'cache_hit': True) and stores new successful results. Defaults to None.
+        aweme_id (str, optional): Post ID already known from UrlNormalizer, used for the cache lookup. Defaults to None.
+        single_flight (SingleFlight, optional): Concurrent calls for the same post (aweme_id, or URL when the
+            ID is unknown) share one API round instead of each paying for it. Defaults to None.
+        force_refresh (bool, optional): Skip cached results, including posts remembered as unavailable. Defaults to False.
+        retry_policy (RetryPolicy, optional): Retries per endpoint, backoff and the overall per-URL deadline
+            shared by all endpoints. Defaults to RetryPolicy().
+        on_attempt (callable, optional): Called before every API request with a dict
+            (api_name, attempt, max_attempts, remaining, last_error), e.g. to show the remaining budget.
 
     Returns:
         dict: A dictionary containing video/album information or an error dictionary
@@ -265,54 +1637,194 @@ async def fetch_tiktok_info(original_url, api_endpoint_configs=None, proxies=Non
         logging.error("No API endpoint configurations provided. Cannot fetch information.")
         return {'status': 'failed', 'reason': '未提供API配置列表', 'original_url': original_url}
 
+    if single_flight is not None:
+        result, shared = await single_flight.do(
+            f"metadata:{aweme_id or original_url}",
+            lambda: fetch_tiktok_info(original_url, api_endpoint_configs, proxies=proxies, client_pool=client_pool,
+                                      hedge_policy=hedge_policy, scoreboard=scoreboard,
+                                      circuit_breakers=circuit_breakers, rate_limiters=rate_limiters,
+                                      metadata_cache=metadata_cache, aweme_id=aweme_id, force_refresh=force_refresh,
+                                      retry_policy=retry_policy, on_attempt=on_attempt)
+        )
+        if shared:
+            logging.info(f"Joined in-flight metadata request for URL: {original_url}")
+        return dict(result, original_url=original_url) # Each caller gets its own copy
+
     last_error_reason = "所有API尝试均失败" # Default error if loop finishes
+    failure_classes = [] # Why each endpoint failed, to tell a dead post from a transient outage
 
-    for api_config in api_endpoint_configs:
-        api_name = api_config.get('name', 'Unnamed API')
-        max_retries = 1 # Number of retries for temporary errors (0 means try once, 1 means try twice total)
-        retry_delay = 1.0 # Seconds to wait before retrying
-
-        for attempt in range(max_retries + 1):
-            logging.info(f"Attempting API '{api_name}' (Attempt {attempt + 1}/{max_retries + 1}) for URL: {original_url}")
-            result = await call_external_tiktok_api(api_config, original_url, proxies=proxies)
-
-            if result.get('status') == 'success':
-                # Check if the successful result actually contains the necessary data
-                url_type = result.get('url_type')
-                if url_type == 'video' and result.get('nwm_video_url'):
-                    logging.info(f"Success with API '{api_name}'. Found NWM video URL.")
-                    return result # Found valid video data
-                elif url_type == 'album' and result.get('album_list'):
-                    logging.info(f"Success with API '{api_name}'. Found album list.")
-                    return result # Found valid album data
-                else:
-                    # API reported success but didn't return the expected data
-                    logging.warning(f"API '{api_name}' reported success but missing required data (NWM URL or album list). Trying next API.")
-                    last_error_reason = f"API '{api_name}' 成功但缺少数据" # Update last error
-                    break # Break retry loop for this API, move to the next API config
-
-            else: # API call failed
-                status_code = result.get('status_code')
-                last_error_reason = result.get('reason', f"API '{api_name}' 请求失败") # Store the reason
-
-                # --- Retry Logic for Temporary Errors ---
-                is_temporary_error = (status_code == 429 or (status_code is not None and status_code >= 500)) or "超时" in last_error_reason
-                if is_temporary_error and attempt < max_retries:
-                    logging.warning(f"API '{api_name}' failed with temporary error (Status: {status_code}, Reason: {last_error_reason}). Retrying in {retry_delay}s...")
-                    await asyncio.sleep(retry_delay)
-                    continue # Continue to the next attempt for this API
-                else:
-                    # Permanent error or max retries reached for temporary error
-                    logging.warning(f"API '{api_name}' failed permanently or after retries. Reason: {last_error_reason}. Trying next API.")
-                    break # Break retry loop for this API, move to the next API config
-                # --------------------------------------
-
-        # If we broke from the inner loop (failed this API), continue to the next API config in the outer loop
-        # If the inner loop completed all retries and still failed, last_error_reason is set, and we continue outer loop
-
-    # If the outer loop completes without returning, all APIs failed
+    if metadata_cache is not None and not force_refresh:
+        known_unavailable = metadata_cache.get_unavailable(url=original_url, aweme_id=aweme_id)
+        if known_unavailable is not None:
+            logging.info(f"Skipping known unavailable post ({known_unavailable['failure_class']}): {original_url}")
+            return {'status': 'failed', 'reason': f"已知不可用: {known_unavailable['reason']}", 'original_url': original_url,
+                    'known_unavailable': True, 'failure_class': known_unavailable['failure_class']}
+        cached_result = metadata_cache.get(url=original_url, aweme_id=aweme_id)
+        if cached_result is not None:
+            logging.info(f"Metadata cache hit for URL: {original_url}")
+            cached_result['cache_hit'] = True
+            return cached_result
+
+    if scoreboard is not None:
+        api_endpoint_configs = scoreboard.rank(api_endpoint_configs)
+    retry_policy = retry_policy or RetryPolicy()
+    deadline = retry_policy.new_deadline() # One budget for every endpoint and retry of this URL
+
+    if hedge_policy is not None and len(api_endpoint_configs) > 1:
+        result, error_reason, failure_classes = await _fetch_hedged(original_url, api_endpoint_configs, proxies, client_pool,
+                                                                    hedge_policy, scoreboard, circuit_breakers, rate_limiters,
+                                                                    retry_policy, deadline, on_attempt)
+        if result is not None:
+            if metadata_cache is not None:
+                metadata_cache.put(original_url, result)
+            return result
+        last_error_reason = error_reason or last_error_reason
+    else:
+        for api_config in api_endpoint_configs:
+            if deadline.expired():
+                last_error_reason = f"已超过单个链接的时间预算 ({deadline.seconds:.0f} 秒)，最后错误: {last_error_reason}"
+                failure_classes.append(None) # Endpoints left untried: the URL stays retryable
+                break
+            result, error_reason, failure_class = await _try_api_endpoint(api_config, original_url, proxies=proxies,
+                                                           client_pool=client_pool, scoreboard=scoreboard,
+                                                           circuit_breakers=circuit_breakers,
+                                                           rate_limiters=rate_limiters, retry_policy=retry_policy,
+                                                           deadline=deadline, on_attempt=on_attempt)
+            if result is not None:
+                if metadata_cache is not None:
+                    metadata_cache.put(original_url, result)
+                return result
+            last_error_reason = error_reason # Remember why this API failed, then try the next one
+            failure_classes.append(failure_class)
+
+    # If every endpoint failed
     logging.error(f"All API endpoints failed for URL: {original_url}. Last error: {last_error_reason}")
-    return {'status': 'failed', 'reason': last_error_reason, 'original_url': original_url}
+    failed_result = {'status': 'failed', 'reason': last_error_reason, 'original_url': original_url}
+    if deadline.expired():
+        failed_result['error_kind'] = DeadlineExceededError.kind
+    # Only when every endpoint agrees the post is gone; one transient error keeps the URL retryable
+    if failure_classes and all(failure_class in PERMANENT_FAILURE_CLASSES for failure_class in failure_classes):
+        failure_class = min(failure_classes, key=PERMANENT_FAILURE_CLASSES.index) # Most specific class
+        failed_result['failure_class'] = failure_class
+        if metadata_cache is not None:
+            metadata_cache.put_unavailable(original_url, aweme_id, failure_class, last_error_reason)
+    return failed_result
+
+
+async def _iterate(items):
+    """Iterates a plain or async iterable asynchronously."""
+    if hasattr(items, '__aiter__'):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+async def resolve_urls(raw_inputs, api_endpoint_configs=None, concurrency=BULK_RESOLVE_CONCURRENCY, ordered=False,
+                       normalizer=None, client_pool=None, on_attempt=None, download_history=None, quality_policy=None,
+                       **fetch_kwargs):
+    """
+    Normalizes and resolves a stream of URLs, yielding each one as soon as it is done.
+
+    At most `concurrency` inputs are in flight (normalizing or waiting for the API); the next input
+    is only pulled from `raw_inputs` when a slot frees up and the previous result has been consumed,
+    so arbitrarily long (or endless async) inputs never materialize more than that many tasks.
+
+    Args:
+        raw_inputs (iterable | async iterable): Raw input lines or URLs.
+        api_endpoint_configs (list): Passed on to fetch_tiktok_info.
+        concurrency (int): Maximum inputs processed at the same time.
+        ordered (bool): Yield in input order (a slow URL holds back the ones after it) instead of
+            completion order.
+        normalizer (UrlNormalizer, optional): Shares its short link cache across calls. Created if omitted.
+        client_pool (HttpClientPool, optional): Pooled API clients. A private pool is used (and closed) if omitted.
+        on_attempt (callable, optional): Called as on_attempt(index, attempt) before every API request.
+        download_history (DownloadHistory, optional): Posts recorded there are not resolved again
+            (unless force_refresh is passed).
+        quality_policy (QualityPolicy, optional): Orders the video URL candidates of each video result
+            (see apply_quality_policy); without one, the best quality comes first.
+        **fetch_kwargs: Any other fetch_tiktok_info keyword argument (proxies, hedge_policy, metadata_cache, ...).
+
+    Yields:
+        dict: The normalizer entry (see UrlNormalizer.normalize()) plus 'index' (position in the input)
+              and 'result' (the fetch_tiktok_info result dict, or None for rejected and duplicate inputs).
+              An input for a post already seen in this stream gets status 'duplicate' and 'duplicate_of',
+              the index of the input that is resolved for it. An input whose post is in `download_history`
+              gets status 'downloaded' and 'history', the recorded entry.
+    """
+    own_pool = client_pool is None
+    if own_pool:
+        client_pool = HttpClientPool()
+    normalizer = normalizer or UrlNormalizer(client_pool, fetch_kwargs.get('proxies'))
+    concurrency = max(1, int(concurrency))
+    first_seen = {} # Post key -> index of the input resolving it
+
+    async def process(index, raw_input):
+        entry = await normalizer.normalize(raw_input)
+        entry['index'] = index
+        entry['result'] = None
+        if entry['status'] != 'ok':
+            return entry
+        key = entry['aweme_id'] or entry['url']
+        if key in first_seen:
+            entry.update(status='duplicate', duplicate_of=first_seen[key], reason='重复链接')
+            return entry
+        first_seen[key] = index
+        if download_history is not None and entry['aweme_id'] and not fetch_kwargs.get('force_refresh'):
+            record = download_history.get(entry['aweme_id']) # Known from the URL, so no API call is needed
+            if record:
+                download_history.skipped += 1
+                entry.update(status='downloaded', history=record, reason='已下载')
+                return entry
+        callback = (lambda attempt: on_attempt(index, attempt)) if on_attempt else None
+        try:
+            entry['result'] = await fetch_tiktok_info(entry['url'], api_endpoint_configs, client_pool=client_pool,
+                                                      aweme_id=entry['aweme_id'], on_attempt=callback, **fetch_kwargs)
+            if entry['result'].get('status') == 'success' and entry['result'].get('url_type') == 'video':
+                entry['result'] = await apply_quality_policy(entry['result'], quality_policy, client_pool,
+                                                             fetch_kwargs.get('proxies'))
+        except Exception as e:
+            logging.exception(f"Unexpected error resolving {entry['url']}")
+            entry['result'] = {'status': 'failed', 'reason': f"内部错误: {e}", 'original_url': entry['url']}
+        return entry
+
+    pending = {} # task -> index
+    finished = {} # index -> entry, completed but not yet yielded (ordered mode)
+    next_to_yield = 0
+    inputs = _iterate(raw_inputs).__aiter__()
+    exhausted = False
+    try:
+        index = 0
+        while True:
+            # Fill free slots; in ordered mode buffered results still occupy theirs
+            while not exhausted and len(pending) + len(finished) < concurrency:
+                try:
+                    raw_input = await inputs.__anext__()
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                pending[asyncio.create_task(process(index, raw_input))] = index
+                index += 1
+            if not pending:
+                break
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                finished[pending.pop(task)] = task.result()
+            if ordered:
+                while next_to_yield in finished:
+                    yield finished.pop(next_to_yield)
+                    next_to_yield += 1
+            else:
+                for done_index in sorted(finished):
+                    yield finished.pop(done_index)
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        if own_pool:
+            await client_pool.aclose()
 
 
 # Removed all TikTokApi related code and the old RapidAPI specific function.